@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+## bench-courier.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""bench-courier.py measures the stages of file-courier on a synthetic
+tree of small files.  It generates a tree with a given count of files
+and a distribution of sizes, and then runs make-index.sh (indexing),
+catalog-files.sh for each group (cataloging), and pack-copy-files.sh
+into a local target directory (packing, rsync copies locally without
+ssh).  It writes a JSON record with the time, files/s, MB/s (MB=2^20
+bytes), and the peak memory (the maximum resident set size of the
+processes of a stage) for each stage.  On Linux, the peak of a child
+is at least the size of this process at fork, and the record has
+"baseline_rss_kb" measured by running "true" for comparison.  Runs
+are reproducible by the seed.  A generated tree is reused when the
+parameters are the same."""
+
+## Usage:
+## python3 bench-courier.py --work /scratch/bench --files 100000 \
+##   --sizes lognormal:8:2 --group-limit 1G > result.json
+## python3 bench-courier.py --work /scratch/bench --files 100000 \
+##   --index-options "-d -o" --pack-options "-p 64" > result-new.json
+
+## Size distributions are "fixed:N", "uniform:MIN:MAX",
+## "exponential:MEAN", and "lognormal:MU:SIGMA" (of the natural
+## logarithm of bytes; lognormal:8:2 has a median of about 3 KB).
+## "--duplicates F" makes a fraction F of files copies of earlier files
+## (for make-index.sh -d).
+
+import os
+import sys
+import time
+import json
+import math
+import shutil
+import random
+import shlex
+import argparse
+import subprocess
+
+scripts = os.path.dirname(os.path.abspath(__file__))
+
+"""The directory of the file-courier scripts."""
+
+shell = "ksh"
+
+"""A shell to run the scripts (as they are written for ksh)."""
+
+files_per_directory = 1000
+
+"""A count of files in a directory of a generated tree.  Directories
+are nested by two levels."""
+
+_units = {"K": (1 << 10), "M": (1 << 20), "G": (1 << 30), "T": (1 << 40)}
+
+def parse_bytes(v):
+    if (v[-1:].upper() in _units):
+        return int(float(v[:-1]) * _units[v[-1:].upper()])
+    else:
+        return int(v)
+
+def size_sampler(spec, rnd):
+    """Returns a function to draw a size by a distribution spec."""
+    ws = spec.split(":")
+    kind = ws[0]
+    ps = [float(x) for x in ws[1:]]
+    if (kind == "fixed" and len(ps) == 1):
+        return (lambda: int(ps[0]))
+    elif (kind == "uniform" and len(ps) == 2):
+        return (lambda: rnd.randint(int(ps[0]), int(ps[1])))
+    elif (kind == "exponential" and len(ps) == 1):
+        return (lambda: int(rnd.expovariate(1.0 / ps[0])))
+    elif (kind == "lognormal" and len(ps) == 2):
+        return (lambda: int(math.exp(rnd.gauss(ps[0], ps[1]))))
+    else:
+        raise argparse.ArgumentTypeError("Bad size distribution: " + spec)
+
+def generate_tree(root, nfiles, sizes, duplicates, seed):
+    """Makes a tree of nfiles files under root.  Contents are slices of
+    a random buffer, so that zip does not compress them much.  It
+    returns a pair of the bytes and the count of files."""
+    rnd = random.Random(seed)
+    draw = size_sampler(sizes, rnd)
+    buf = bytes(rnd.getrandbits(8) for _ in range(1 << 20))
+    nbytes = 0
+    made = []
+    for i in range(nfiles):
+        d = os.path.join(root, ("%04d" % (i // (files_per_directory
+                                               * files_per_directory))),
+                         ("%04d" % ((i // files_per_directory)
+                                    % files_per_directory)))
+        if ((i % files_per_directory) == 0):
+            os.makedirs(d, exist_ok=True)
+        path = os.path.join(d, ("f%07d" % i))
+        if (len(made) != 0 and rnd.random() < duplicates):
+            src = made[rnd.randrange(len(made))]
+            shutil.copyfile(src, path)
+            nbytes += os.path.getsize(path)
+            continue
+        size = max(0, draw())
+        offset = rnd.randrange(len(buf))
+        with open(path, "wb") as f:
+            while (size > 0):
+                chunk = buf[offset:(offset + size)]
+                f.write(chunk)
+                size -= len(chunk)
+                offset = 0
+                nbytes += len(chunk)
+        if (len(made) < 10000):
+            made.append(path)
+    return (nbytes, nfiles)
+
+def run_stage(commands):
+    """Runs commands (each is a list of arguments, with an optional
+    output file name at the end as a pair) one by one, and returns a
+    pair of the elapsed time and the peak resident set size in KB.
+    The peak is taken by wait4 for each command, which covers its
+    descendants."""
+    t0 = time.perf_counter()
+    peak = 0
+    for (args, out) in commands:
+        f = (open(out, "wb") if out != None else subprocess.DEVNULL)
+        try:
+            p = subprocess.Popen(args, stdout=f, stderr=subprocess.DEVNULL)
+            ## Reap it by wait4 to take its rusage.
+            (_, status, ru) = os.wait4(p.pid, 0)
+            p.returncode = status
+        finally:
+            if (out != None):
+                f.close()
+        if (status != 0):
+            raise Exception("Stage failed: " + " ".join(args))
+        peak = max(peak, ru.ru_maxrss)
+    return ((time.perf_counter() - t0), peak)
+
+def stage_record(dt, peak, nbytes, nfiles):
+    return {"seconds": round(dt, 3),
+            "files_per_s": (round(nfiles / dt, 1) if dt > 0 else None),
+            "mb_per_s": (round(nbytes / float(1 << 20) / dt, 3)
+                         if dt > 0 else None),
+            "peak_rss_kb": peak}
+
+def count_groups(index):
+    """Returns the count of groups in an index-file (the last line is
+    the count)."""
+    last = None
+    with open(index, "rb") as f:
+        for line in f:
+            last = line
+    return int(last)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description='''
+bench-courier.py measures indexing, cataloging, and packing of
+file-courier on a synthetic tree, and writes the results in JSON.''')
+    p.add_argument('--work', dest='work', type=str, required=True,
+                   help='working directory (tree, index, and target)')
+    p.add_argument('--files', dest='files', type=int, default=10000)
+    p.add_argument('--sizes', dest='sizes', type=str,
+                   default="lognormal:8:2",
+                   help='size distribution of files')
+    p.add_argument('--duplicates', dest='duplicates', type=float,
+                   default=0.0, help='fraction of duplicate files')
+    p.add_argument('--seed', dest='seed', type=int, default=0)
+    p.add_argument('--group-limit', dest='group_limit', type=str,
+                   default=None, help='bytes in a group (make-index.sh -l)')
+    p.add_argument('--index-options', dest='index_options', type=str,
+                   default="", help='options to make-index.sh')
+    p.add_argument('--pack-options', dest='pack_options', type=str,
+                   default="", help='options to pack-copy-files.sh')
+    p.add_argument('--stages', dest='stages', type=str,
+                   default="index,catalog,pack",
+                   help='stages to run (comma separated)')
+    p.add_argument('--shell', dest='shell', type=str, default=shell)
+    p.add_argument('--keep', dest='keep', action='store_const',
+                   const=True, default=False,
+                   help='keep archives in the target')
+    args = p.parse_args()
+    shell = args.shell
+    size_sampler(args.sizes, random.Random(0))
+    work = os.path.abspath(args.work)
+    params = {"files": args.files, "sizes": args.sizes,
+              "duplicates": args.duplicates, "seed": args.seed}
+    tree = os.path.join(work, "tree")
+    stamp = os.path.join(work, "tree.json")
+    result = {"params": dict(params), "stages": {}}
+    result["params"].update({"group_limit": args.group_limit,
+                             "index_options": args.index_options,
+                             "pack_options": args.pack_options})
+
+    ## Generate a tree (or reuse).
+    old = None
+    if (os.path.exists(stamp)):
+        with open(stamp, "r") as f:
+            old = json.load(f)
+    if (old != None and old.get("params") == params):
+        (nbytes, nfiles) = (old["bytes"], old["files"])
+    else:
+        shutil.rmtree(tree, ignore_errors=True)
+        os.makedirs(tree)
+        t0 = time.perf_counter()
+        (nbytes, nfiles) = generate_tree(tree, args.files, args.sizes,
+                                         args.duplicates, args.seed)
+        dt = (time.perf_counter() - t0)
+        result["stages"]["generate"] = stage_record(dt, 0, nbytes, nfiles)
+        with open(stamp, "w") as f:
+            json.dump({"params": params, "bytes": nbytes,
+                       "files": nfiles}, f)
+    result["bytes"] = nbytes
+    result["files"] = nfiles
+    result["baseline_rss_kb"] = run_stage([(["true"], None)])[1]
+
+    stages = args.stages.split(",")
+    index = os.path.join(work, "index.txt")
+    if ("index" in stages):
+        opts = shlex.split(args.index_options)
+        if (args.group_limit != None):
+            opts += ["-l", str(parse_bytes(args.group_limit))]
+        cmd = ([shell, os.path.join(scripts, "make-index.sh")]
+               + opts + [tree])
+        (dt, peak) = run_stage([(cmd, index)])
+        result["stages"]["index"] = stage_record(dt, peak, nbytes, nfiles)
+    groups = count_groups(index)
+    result["groups"] = groups
+    if ("catalog" in stages):
+        cmds = [([shell, os.path.join(scripts, "catalog-files.sh"), index,
+                  str(i)], None)
+                for i in range(groups)]
+        (dt, peak) = run_stage(cmds)
+        result["stages"]["catalog"] = stage_record(dt, peak, nbytes, nfiles)
+    if ("pack" in stages):
+        target = os.path.join(work, "target")
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target)
+        cmd = ([shell, os.path.join(scripts, "pack-copy-files.sh")]
+               + shlex.split(args.pack_options)
+               + [tree, target, os.path.join(work, "pack"), index,
+                  "0", str(groups - 1)])
+        (dt, peak) = run_stage([(cmd, None)])
+        result["stages"]["pack"] = stage_record(dt, peak, nbytes, nfiles)
+        if (not args.keep):
+            shutil.rmtree(target, ignore_errors=True)
+    print(json.dumps(result, sort_keys=True), file=sys.stdout)
+    sys.exit(0)
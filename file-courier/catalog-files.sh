@@ -1,15 +1,23 @@
 #!/bin/ksh
 
-# Usage: catalog-files.sh index-file N
+# Usage: catalog-files.sh index-file N [aliases]
 
 # This enumerates a list of files in the group at N in the index-file
 # which is created by "make-index.sh".  "expr 0 + N" is used to ignore
-# leading zeros on the 2nd argument.
+# leading zeros on the 2nd argument.  Alias lines (made by
+# "make-index.sh -d") are skipped.  With the 3rd argument "aliases",
+# it instead enumerates the aliases in the group as lines
+# "alias<TAB>original".
 
 set -e
 indexfile="$1"
 blocks=$(printf "%04d" $(expr 0 + $2))
 blocke=$(printf "%04d" $(expr 1 + $2))
 #sed -n "/^${blocks}\$/,/^${blocke}\$/p" "${indexfile}"
-awk "/^${blocks}\$/{flag=1;next}/^${blocke}\$/{exit 0}flag" "${indexfile}" \
-    | sed -e 's/^[0-9]* //'
+if [ "$3" = "aliases" ]; then
+    awk "/^${blocks}\$/{flag=1;next}/^${blocke}\$/{exit 0}flag" "${indexfile}" \
+	| sed -n -e 's/^=	//p'
+else
+    awk "/^${blocks}\$/{flag=1;next}/^${blocke}\$/{exit 0}flag" "${indexfile}" \
+	| sed -e '/^=	/d' -e 's/^[0-9]* //'
+fi
@@ -0,0 +1,55 @@
+#!/usr/bin/awk -f
+
+# USAGE: awk -f dedup-files.awk hashes list-of-files list-of-files > deduplicated-list-of-files
+
+# This removes duplicate files from a list of lines "size file-name".
+# "hashes" are lines "hash  file-name" output by "sha256sum" for the
+# candidate files (files with the same size as others).  The list is
+# read twice.  The first file in the list among the files with the
+# same hash is kept as an original, and the others are removed from
+# the list.  Instead, alias lines "=<TAB>alias<TAB>original" are placed
+# right after the line of the original, so that they go in the same
+# group as the original.  It prints the count and the bytes of the
+# removed duplicates to the stderr.  Names escaped by "sha256sum"
+# (with a leading backslash) are not deduplicated.
+
+FNR == 1 && FILENAME != ARGV[1] {
+    pass++
+}
+FILENAME == ARGV[1] {
+    if (substr($0, 1, 1) != "\\") {
+	hash[substr($0, 67)] = $1
+    }
+    next
+}
+pass == 1 {
+    name = substr($0, length($1) + 2)
+    if (name in hash) {
+	h = hash[name]
+	if (h in original) {
+	    alias[name] = original[h]
+	    aliases[original[h]] = aliases[original[h]] "\n" name
+	    count++
+	    bytes += $1
+	} else {
+	    original[h] = name
+	}
+    }
+    next
+}
+{
+    name = substr($0, length($1) + 2)
+    if (name in alias) {
+	next
+    }
+    print $0
+    if (name in aliases) {
+	n = split(substr(aliases[name], 2), as, "\n")
+	for (i = 1; i <= n; i++) {
+	    printf("=\t%s\t%s\n", as[i], name)
+	}
+    }
+}
+END {
+    printf("duplicates: %d files %.0f bytes\n", count, bytes) > "/dev/stderr"
+}
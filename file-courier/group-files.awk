@@ -7,13 +7,22 @@
 # limit).  Groups are separated by lines "nnnn", where "nnnn" are four
 # digits numbers starting by "0000" and ending with "nnnn" for the
 # number of groups.  The "-M" option to AWK is for using bignums.
+# The limit is 25 GB, or it can be given by "-v limit=bytes".
+# Alias lines "=<TAB>alias<TAB>original" made by "dedup-files.awk" are
+# passed through and they are not counted in the sum.
 
 BEGIN { 
-    limit = (25 * 1024 * 1024 * 1024)
+    if (limit == 0) {
+	limit = (25 * 1024 * 1024 * 1024)
+    }
     #limit = (200 * 1024)
     printf("%04d\n", no)
     no++
 }
+/^=\t/ {
+    print $0
+    next
+}
 {
     if (sum != 0 && sum + $1 >= limit) {
 	sum = 0
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+## locality.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""locality.py helps read files of a group in the physical order.  It
+has two modes.  "order" reorders the lines in each group of an
+index-file (made by make-index.sh) by the physical location of the
+files.  The location is the first extent by FIEMAP when the file
+system supports it, or the inode number otherwise.  On Lustre, the
+device of an extent is the OST index.  "prefetch" is a filter of a
+list of files, which tells the kernel to read the files ahead by
+posix_fadvise(WILLNEED) a window of files before passing them to the
+next (zip -@)."""
+
+## Usage:
+## python3 locality.py order source-directory < index > ordered-index
+## (cd source-directory; catalog-files.sh index N \
+##   | python3 locality.py prefetch --window 64 | zip -q -@ xxxx)
+
+import os
+import sys
+import re
+import fcntl
+import struct
+import argparse
+import collections
+
+use_fiemap = True
+
+"""An option to use FIEMAP.  Inode numbers are used when it is false
+or FIEMAP fails."""
+
+window = 64
+
+"""The number of files to prefetch ahead in "prefetch"."""
+
+## FS_IOC_FIEMAP = _IOWR('f', 11, struct fiemap).  struct fiemap is
+## 32 bytes and it is followed by struct fiemap_extent of 56 bytes.
+## fe_reserved[0] of an extent is fe_device on Lustre.  An extent
+## with FIEMAP_EXTENT_UNKNOWN (e.g. delayed allocation) has no
+## physical location.
+
+_FS_IOC_FIEMAP = 0xC020660B
+_fiemap = struct.Struct("=QQIIII")
+_fiemap_extent = struct.Struct("=QQQQQIIII")
+_FIEMAP_EXTENT_UNKNOWN = 0x00000002
+
+_group_line = re.compile(r"^[0-9]{4}$")
+
+def first_extent(path):
+    """Returns a pair of the device and the physical offset of the first
+    extent of a file, or None when FIEMAP is not available or the file
+    has no known extents."""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOATIME", 0))
+    except PermissionError:
+        fd = os.open(path, os.O_RDONLY)
+    try:
+        buf = bytearray(_fiemap.size + _fiemap_extent.size)
+        _fiemap.pack_into(buf, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+        fcntl.ioctl(fd, _FS_IOC_FIEMAP, buf)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    (_, _, _, mapped, _, _) = _fiemap.unpack_from(buf, 0)
+    if (mapped == 0):
+        return None
+    e = _fiemap_extent.unpack_from(buf, _fiemap.size)
+    if ((e[5] & _FIEMAP_EXTENT_UNKNOWN) != 0):
+        return None
+    (physical, device) = (e[1], e[6])
+    return (device, physical)
+
+class _counts():
+    """Counts of files by the kind of their sort keys."""
+    extent = 0
+    inode = 0
+    error = 0
+
+def locality_key(path):
+    """Returns a sort key of a file.  Files with extents go first in the
+    order of the extents, and then the others in the order of inodes.
+    Files that cannot be accessed go last."""
+    try:
+        if (use_fiemap):
+            e = first_extent(path)
+            if (e != None):
+                _counts.extent += 1
+                return (0, e[0], e[1])
+        st = os.lstat(path)
+        _counts.inode += 1
+        return (1, st.st_dev, st.st_ino)
+    except OSError:
+        _counts.error += 1
+        return (2, 0, 0)
+
+def order_index(source, lines, out):
+    """Reorders the lines in each group.  Alias lines ("=<TAB>...", made
+    by make-index.sh -d) stay right after their original."""
+    members = []
+
+    def flush():
+        members.sort(key=lambda m: m[0])
+        for (_, ls) in members:
+            out.writelines(ls)
+        del members[:]
+        return None
+
+    for line in lines:
+        if (_group_line.match(line)):
+            flush()
+            out.write(line)
+        elif (line.startswith("=\t") and len(members) > 0):
+            members[-1][1].append(line)
+        else:
+            name = line.rstrip("\n").partition(" ")[2]
+            members.append((locality_key(os.path.join(source, name)),
+                            [line]))
+    flush()
+    return None
+
+def prefetch(lines, out, window):
+    """Passes file names through after a window of names ahead of them
+    are given to posix_fadvise(WILLNEED)."""
+    advise = getattr(os, "posix_fadvise", None)
+    queue = collections.deque()
+    for line in lines:
+        if (advise != None):
+            try:
+                fd = os.open(line.rstrip("\n"), os.O_RDONLY)
+                try:
+                    advise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+        queue.append(line)
+        if (len(queue) > window):
+            out.write(queue.popleft())
+            out.flush()
+    while (len(queue) > 0):
+        out.write(queue.popleft())
+    out.flush()
+    return None
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description='''
+locality.py orders files of an index-file by the physical location
+("order"), or prefetches files in a list ("prefetch").''')
+    p.add_argument('mode', choices=['order', 'prefetch'])
+    p.add_argument('source', nargs='?', default=None,
+                   help='source directory of the index-file ("order")')
+    p.add_argument('--inode', dest='inode',
+                   action='store_const', const=True, default=False,
+                   help='use inode numbers without FIEMAP')
+    p.add_argument('--window', dest='window', type=int, default=window,
+                   help='files to prefetch ahead')
+    args = p.parse_args()
+    ## Names are passed as bytes would be (find -printf prints them raw).
+    stdin = open(sys.stdin.fileno(), "r", encoding="utf-8",
+                 errors="surrogateescape", newline="\n", closefd=False)
+    stdout = open(sys.stdout.fileno(), "w", encoding="utf-8",
+                  errors="surrogateescape", newline="\n", closefd=False)
+    if (args.mode == "order"):
+        if (args.source == None):
+            print("locality.py order needs a source directory",
+                  file=sys.stderr)
+            sys.exit(1)
+        use_fiemap = (not args.inode)
+        order_index(args.source, stdin, stdout)
+        stdout.flush()
+        print("ordered: " + str(_counts.extent) + " by extents, "
+              + str(_counts.inode) + " by inodes, "
+              + str(_counts.error) + " errors", file=sys.stderr)
+    else:
+        window = args.window
+        prefetch(stdin, stdout, window)
+    sys.exit(0)
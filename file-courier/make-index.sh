@@ -1,19 +1,82 @@
 #!/bin/ksh -x
 
-# Usage: make-index.sh source-directory
+# Usage: make-index.sh [-d] [-j jobs] [-o] [-i] [-l limit] source-directory
 
 # This makes a file list as lines of "size file-name".  It then groups
 # the files by the sum of the sizes by calling "group-files.awk".  It
 # strips the directory prefix (by using "%P" in printf).
 
+# Option "-d" removes duplicate files from the list.  It first selects
+# candidates that have the same size as some other files, and hashes
+# them by "sha256sum" in parallel ("-j jobs" processes, the default is
+# the number of processors).  Then, "dedup-files.awk" keeps the first
+# file of the same contents, and records the others as alias lines
+# "=<TAB>alias<TAB>original" in the group of the original.  See
+# "restore-aliases.sh" to recreate the aliases after extraction.
+
+# Option "-o" orders the files in each group by the physical location
+# by calling "locality.py", so that archiving reads the files mostly
+# sequentially.  The location is the first extent by FIEMAP, or the
+# inode number when FIEMAP is not available.  Option "-i" uses inode
+# numbers always.  Option "-l limit" sets the limit of the sum of the
+# sizes in a group in bytes (25 GB by default).
+
 # Examples
 # make-index.sh source-directory > index.txt
+# make-index.sh -d -j 16 source-directory > index.txt
+# make-index.sh -o source-directory > index.txt
+
+dedup=0
+jobs=$(nproc)
+order=0
+inode=""
+limit=0
+while getopts dj:oil: opt; do
+    case "${opt}" in
+	d) dedup=1 ;;
+	j) jobs="${OPTARG}" ;;
+	o) order=1 ;;
+	i) order=1; inode="--inode" ;;
+	l) limit="${OPTARG}" ;;
+	*) echo "Usage: ksh $0 [-d] [-j jobs] [-o] [-i] [-l limit] source-directory"
+	   exit 1 ;;
+    esac
+done
+shift $((OPTIND - 1))
 
 if [ "$#" -ne 1 ]; then
-    echo "Usage: ksh $0 source-directory"
+    echo "Usage: ksh $0 [-d] [-j jobs] [-o] [-i] [-l limit] source-directory"
     exit 1
 fi
 
 set -e
-find "$1" -xdev -type f -printf "%s %P\n" \
-     | awk -M -f $(dirname $0)/group-files.awk
+scripts=$(cd $(dirname $0); pwd)
+source="$1"
+orderfiles() {
+    if [ "${order}" -eq 0 ]; then
+	cat
+    else
+	python3 "${scripts}/locality.py" order "${source}" ${inode}
+    fi
+}
+
+if [ "${dedup}" -eq 0 ]; then
+    find "$1" -xdev -type f -printf "%s %P\n" \
+	 | awk -M -v limit="${limit}" -f $(dirname $0)/group-files.awk \
+	 | orderfiles
+    exit 0
+fi
+
+work=$(mktemp -d)
+trap 'rm -rf "${work}"' EXIT
+find "$1" -xdev -type f -printf "%s %P\n" > "${work}/list"
+# Candidates are non-empty files whose size appears twice or more.
+awk 'NR == FNR { n[$1]++; next }
+     $1 > 0 && n[$1] > 1 { print substr($0, length($1) + 2) }' \
+    "${work}/list" "${work}/list" > "${work}/candidates"
+(cd "$1"; tr '\n' '\0' < "${work}/candidates" \
+	 | xargs -0 -r -P "${jobs}" -n 64 sha256sum) > "${work}/hashes"
+awk -f "${scripts}/dedup-files.awk" \
+    "${work}/hashes" "${work}/list" "${work}/list" \
+    | awk -M -v limit="${limit}" -f "${scripts}/group-files.awk" \
+    | orderfiles
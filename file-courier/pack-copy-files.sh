@@ -1,6 +1,6 @@
 #!/bin/sh
 
-# Usage: pack-copy-files.sh source-directory target-directory temporary-prefix index-file n0 n1
+# Usage: pack-copy-files.sh [-p window] [-q gfarm-directory] source-directory target-directory temporary-prefix index-file n0 n1
 
 # This archives-then-transfers files in groups from n0 to n1 (n1
 # inclusive).  It uses an index-file created by "make-index.sh".
@@ -10,26 +10,73 @@
 # file will be /tmp/xxxx-0000.zip.  A "temporary-prefix" path should
 # be absolte, because it does change-directory to the source-directory
 # before calling zip.  "set_-e" lets the process exit on errors.
+# When the index-file has aliases (by "make-index.sh -d"), the aliases
+# in a group are also transferred as /tmp/xxxx-0000.aliases, which is
+# used by "restore-aliases.sh" after extracting the archive.  Option
+# "-p window" prefetches files by "locality.py prefetch" for the given
+# number of files ahead of zip.  It works best with an index-file made
+# by "make-index.sh -o".  Option "-q gfarm-directory" checks the quota
+# of the directory in Gfarm (where the target-directory is stored)
+# before each group by "quota-preflight.py" of retirefile, and stops
+# at a group that does not fit.  The quota state is kept in
+# /tmp/xxxx.quota during a run.  GFLIB is a path to "libgfarm.so".
 
 # Examples
 # pack-copy-files.sh /source/somewhere host:/target/elsewhere \
 #    /tmp/some-prefix /tmp/index-of-somewhere 0 N
 
+window=0
+quotadir=""
+while getopts p:q: opt; do
+    case "${opt}" in
+	p) window="${OPTARG}" ;;
+	q) quotadir="${OPTARG}" ;;
+	*) echo "Usage: ksh $0 [-p window] [-q gfarm-directory] source-directory target-directory temporary-prefix index-file n0 n1"
+	   exit 1 ;;
+    esac
+done
+shift $((OPTIND - 1))
+
 if [ "$#" -ne 6 ]; then
-    echo "Usage: ksh $0 source-directory target-directory temporary-prefix index-file n0 n1"
+    echo "Usage: ksh $0 [-p window] [-q gfarm-directory] source-directory target-directory temporary-prefix index-file n0 n1"
     exit 1
 fi
 
 set -e
+scripts=$(cd $(dirname $0); pwd)
+prefetch() {
+    if [ "${window}" -eq 0 ]; then
+	cat
+    else
+	python3 "${scripts}/locality.py" prefetch --window "${window}"
+    fi
+}
 sourcedirectory="$1"
 targetdirectory="$2"
 temporaryprefix="$3"
 indexfile="$4"
+rm -f "${temporaryprefix}.quota"
 for i in `seq -f '%04g' $5 $6`
 do
+    if [ -n "${quotadir}" ]; then
+	if ! python3 "${scripts}/../retirefile/quota-preflight.py" \
+	     --so "${GFLIB:-libgfarm.so}" --state "${temporaryprefix}.quota" \
+	     --index "${indexfile}" --groups $i $i "${quotadir}" > /dev/null; then
+	    echo "Stopping at a group $i: quota exceeded or not obtained."
+	    rm -f "${temporaryprefix}.quota"
+	    exit 1
+	fi
+    fi
     echo "zip and copy a group $i ..."
     sh "$(dirname $0)/catalog-files.sh" "${indexfile}" "$i" \
-	| (cd "${sourcedirectory}"; zip -q -@ "${temporaryprefix}-$i")
+	| (cd "${sourcedirectory}"; prefetch | zip -q -@ "${temporaryprefix}-$i")
     rsync -ptgo -P -e ssh "${temporaryprefix}-$i.zip" "${targetdirectory}/"
     rm "${temporaryprefix}-$i.zip"
+    sh "$(dirname $0)/catalog-files.sh" "${indexfile}" "$i" aliases \
+       > "${temporaryprefix}-$i.aliases"
+    if [ -s "${temporaryprefix}-$i.aliases" ]; then
+	rsync -ptgo -P -e ssh "${temporaryprefix}-$i.aliases" "${targetdirectory}/"
+    fi
+    rm "${temporaryprefix}-$i.aliases"
 done
+rm -f "${temporaryprefix}.quota"
@@ -0,0 +1,28 @@
+#!/bin/sh
+
+# Usage: restore-aliases.sh target-directory aliases-file
+
+# This recreates duplicate files removed by "make-index.sh -d".  An
+# aliases-file is transferred by "pack-copy-files.sh" along with an
+# archive, and it consists of lines "alias<TAB>original".  It copies
+# each original to the alias in the target-directory, where the
+# archive is extracted beforehand.
+
+# Examples
+# (cd /target/elsewhere; unzip -q /tmp/some-prefix-0000.zip)
+# restore-aliases.sh /target/elsewhere /tmp/some-prefix-0000.aliases
+
+if [ "$#" -ne 2 ]; then
+    echo "Usage: sh $0 target-directory aliases-file"
+    exit 1
+fi
+
+set -e
+targetdirectory="$1"
+aliasesfile="$2"
+tab=$(printf '\t')
+while IFS="${tab}" read -r alias original
+do
+    mkdir -p "${targetdirectory}/$(dirname "${alias}")"
+    cp -p "${targetdirectory}/${original}" "${targetdirectory}/${alias}"
+done < "${aliasesfile}"
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+## gfpcopy-progress.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""gfpcopy-progress.py is a filter to extract throughput metrics from
+the progress outputs of gfpcopy -P.  It reads the outputs from the
+stdin incrementally, and writes records in JSON lines to the stdout.
+It emits a "progress" record periodically, and a "summary" record at
+the end of the input.  A record has the counts of bytes and files,
+the instantaneous and average rates in MB/s (MB=2^20 bytes as gfpcopy
+prints), and an ETA in seconds.  It can be placed in the fd=3 path of
+tee2, or be used as a filter on a saved log."""
+
+## Usage:
+## tee2 --syslog ftp.debug gfpcopy -P src gfarm://dst \
+##   3> >(exec python3 gfpcopy-progress.py --tag account=hpciN >> m.txt)
+## Or:
+## tr '\r' '\n' < gfpcopy-output.txt | python3 gfpcopy-progress.py
+
+## A progress line of gfpcopy -P looks like the following (lines are
+## terminated by CR).  It is parsed loosely to accept variations of
+## spacing and units: "[0000012/0000345] 1234/56789MB 98MB/s 00:01:23".
+## The fields are the number of files done/total, the size done/total,
+## the rate, and the elapsed time.
+
+import os
+import sys
+import re
+import time
+import json
+import argparse
+
+interval = 10.0
+
+"""A time in seconds between progress records."""
+
+passthrough = False
+
+"""An option to copy the input to the stderr as well as writing the
+records to the stdout."""
+
+_progress_line = re.compile(
+    rb"\[\s*(\d+)\s*/\s*(\d+)\s*\]"
+    rb"\s*(\d+(?:\.\d+)?)\s*(?:([KMGT]?B)\s*)?"
+    rb"/\s*(\d+(?:\.\d+)?)\s*([KMGT]?B)"
+    rb"(?:\s+(\d+(?:\.\d+)?)\s*([KMGT]?B)/s)?"
+    rb"(?:\s+(\d+):(\d\d):(\d\d))?")
+
+_units = {b"B": 1, b"KB": (1 << 10), b"MB": (1 << 20),
+          b"GB": (1 << 30), b"TB": (1 << 40)}
+
+_MB = float(1 << 20)
+
+class ProgressParser():
+    """A parser of gfpcopy -P outputs.  It is fed with chunks of bytes
+    by feed(), and it calls emit() with a record (a dict).  It emits
+    a record at most once in an interval, and a summary at close()."""
+
+    def __init__(self, emit, interval=10.0, tags=None, clock=time.time):
+        self.emit = emit
+        self.interval = interval
+        self.tags = (tags if tags != None else {})
+        self.clock = clock
+        self.partial = b""
+        self.start = None
+        self.last = None
+        self.state = None
+        self.lines = 0
+        return
+
+    def feed(self, b):
+        """Takes a chunk of outputs.  Lines are broken at CR or LF."""
+        data = self.partial + b
+        lines = re.split(rb"[\r\n]", data)
+        self.partial = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+        return None
+
+    def parse_line(self, line):
+        m = _progress_line.search(line)
+        if (m == None):
+            return None
+        now = self.clock()
+        (nf, tf, nb, nu, tb, tu, r, ru, hh, mm, ss) = m.groups()
+        unit = _units.get(tu, 1)
+        nunit = (_units.get(nu, 1) if nu != None else unit)
+        state = {
+            "files": int(nf),
+            "files_total": int(tf),
+            "bytes": int(float(nb) * nunit),
+            "bytes_total": int(float(tb) * unit),
+            "elapsed": ((int(hh) * 3600 + int(mm) * 60 + int(ss))
+                        if hh != None else None),
+            "time": now}
+        if (self.start == None):
+            self.start = state
+        self.state = state
+        self.lines += 1
+        if (self.last == None
+            or (self.elapsed(state) - self.elapsed(self.last))
+                >= self.interval):
+            self.emit(self.record("progress", self.last, state))
+            self.last = state
+        return None
+
+    def elapsed(self, state):
+        """Returns the elapsed time of gfpcopy, or the time since the
+        first progress line when gfpcopy does not print it.  It is used
+        as the time axis, so that a saved log can be filtered."""
+        if (state["elapsed"] != None):
+            return float(state["elapsed"])
+        else:
+            return (state["time"] - self.start["time"])
+
+    def record(self, kind, last, state):
+        elapsed = self.elapsed(state)
+        dt = ((elapsed - self.elapsed(last)) if last != None else 0.0)
+        if (dt > 0):
+            rate = ((state["bytes"] - last["bytes"]) / _MB / dt)
+        else:
+            rate = None
+        average = ((state["bytes"] / _MB / elapsed)
+                   if elapsed > 0 else None)
+        left = (state["bytes_total"] - state["bytes"])
+        if (left <= 0):
+            eta = 0.0
+        elif (average != None and average > 0):
+            eta = (left / _MB / average)
+        else:
+            eta = None
+        r = dict(self.tags)
+        r.update({
+            "type": kind,
+            "time": round(state["time"], 3),
+            "elapsed": round(elapsed, 3),
+            "files": state["files"],
+            "files_total": state["files_total"],
+            "bytes": state["bytes"],
+            "bytes_total": state["bytes_total"],
+            "rate_mb_s": (round(rate, 3) if rate != None else None),
+            "average_mb_s": (round(average, 3)
+                             if average != None else None),
+            "eta": (round(eta, 1) if eta != None else None)})
+        return r
+
+    def close(self):
+        """Flushes a partial line and emits a summary."""
+        if (self.partial != b""):
+            self.parse_line(self.partial)
+            self.partial = b""
+        if (self.state != None):
+            r = self.record("summary", self.start, self.state)
+            r["progress_lines"] = self.lines
+            self.emit(r)
+        return None
+
+def write_record(r):
+    print(json.dumps(r, sort_keys=True), file=sys.stdout, flush=True)
+    return None
+
+def filter_stdin(parser):
+    """Reads the stdin by chunks (not by lines, because progress lines
+    are terminated by CR), and feeds them to the parser."""
+    fd = sys.stdin.fileno()
+    while True:
+        b = os.read(fd, 65536)
+        if (len(b) == 0):
+            break
+        if (passthrough):
+            sys.stderr.buffer.write(b)
+            sys.stderr.buffer.flush()
+        parser.feed(b)
+    parser.close()
+    return None
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description='''
+gfpcopy-progress.py reads outputs of gfpcopy -P from the stdin, and
+writes throughput records in JSON lines to the stdout.''')
+    p.add_argument('--interval', dest='interval', type=float,
+                   default=interval,
+                   help='seconds between progress records')
+    p.add_argument('--tag', dest='tags', type=str, action='append',
+                   default=[], metavar='NAME=VALUE',
+                   help='add a field to records (repeatable)')
+    p.add_argument('--passthrough', dest='passthrough',
+                   action='store_const', const=True, default=False,
+                   help='copy the input to the stderr')
+    args = p.parse_args()
+    interval = args.interval
+    passthrough = args.passthrough
+    tags = {}
+    for t in args.tags:
+        (k, sep, v) = t.partition("=")
+        if (sep == ""):
+            print("Bad tag (not NAME=VALUE): " + t, file=sys.stderr)
+            sys.exit(1)
+        tags[k] = v
+    parser = ProgressParser(write_record, interval, tags)
+    try:
+        filter_stdin(parser)
+    except KeyboardInterrupt:
+        parser.close()
+    sys.exit(0)
@@ -1,9 +1,25 @@
 #!/bin/bash
 
 ## A wrapper for gfpcopy with logging to syslog.  See wrapper.sh for
-## general usage.
+## general usage (and "TEE2_SYSLOG").  When the environment variable
+## "METRICS" is set to a file, throughput records extracted from the
+## progress outputs are appended to the file in JSON lines (see
+## gfpcopy-progress.py).
 
 log="ftp.debug"
 echo HPCI-ACCESS "$0" "$*" | /bin/logger -p ${log}
-exec ./tee2 gfpcopy -P "$@" \
-     3> >(trap '' INT QUIT; exec /bin/logger -p ${log})
+if [ -n "${TEE2_SYSLOG}" -a -z "${METRICS}" ]; then
+    exec ./tee2 --syslog ${log} gfpcopy -P "$@"
+elif [ -n "${TEE2_SYSLOG}" ]; then
+    exec ./tee2 --syslog ${log} gfpcopy -P "$@" \
+	 3> >(trap '' INT QUIT; exec python3 ./gfpcopy-progress.py \
+		  --tag user="$(id -un)" >> "${METRICS}")
+elif [ -z "${METRICS}" ]; then
+    exec ./tee2 gfpcopy -P "$@" \
+	 3> >(trap '' INT QUIT; exec /bin/logger -p ${log})
+else
+    exec ./tee2 gfpcopy -P "$@" \
+	 3> >(trap '' INT QUIT; tee >(exec python3 ./gfpcopy-progress.py \
+					 --tag user="$(id -un)" >> "${METRICS}") \
+		  | exec /bin/logger -p ${log})
+fi
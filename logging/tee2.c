@@ -1,4 +1,4 @@
-/* tee2.c (2021-03-18) -*-Coding: us-ascii-unix;-*- */
+/* tee2.c (2026-10-19) -*-Coding: us-ascii-unix;-*- */
 
 /* tee2 duplicates command outputs to fd=1,2,3,4 that are passed by
    the caller.  Its intended use is to copy command outputs to syslog.
@@ -12,13 +12,32 @@
    the signals INT and QUIT to keep pumping outputs forward.  It
    disables the output buffers for immediate printing.  It detects
    termination of the subprocess by a closure of the stdout and the
-   stderr.  It assumes the write streams (fd=1,2,3,4) never block.  It
-   processes the stderr first and then the stdout, to prioritize
-   stderr outputs. */
+   stderr.  It sets the log streams (fd=3,4) non-blocking and keeps
+   outputs in bounded ring buffers while they would block, so that a
+   stalled logger never throttles the command.  It restores the flags
+   of the log streams at exit, because they are shared with the
+   caller.  It drops the oldest outputs in the buffers when they
+   overflow, and reports the dropped bytes at exit.  It assumes fd=1,2
+   may block, and it never drops outputs to them.  It processes the
+   stderr first and then the stdout, to prioritize stderr outputs.  It
+   moves the outputs with tee(2) and splice(2) without copying them in
+   userspace, when fd=3 (fd=4) is a pipe.  It falls back to copying by
+   read/write when the system calls are not usable for the fds (for
+   example, fd=1 is a terminal).  It reports the byte counts of
+   forwarded outputs to fd=4 (or fd=3) at exit, when the environment
+   variable TEE2_STATS is set to a non-empty value or when some outputs
+   to the logs are dropped.  It ignores SIGPIPE.  When the reader of
+   fd=1 (fd=2) exits, it discards the outputs to it and keeps logging,
+   and when a logger exits, it drops the outputs to the log stream.
+   With the option "--syslog facility.level", it sends the outputs
+   directly to syslog via /dev/log, instead of letting the caller run
+   logger(1) on fd=3.  Passing fd=3 is optional then.  USAGE: tee2
+   --syslog ftp.debug command-and-arguments... */
 
-/* GCC with -std=c99 (for GCC<=4) requires the lines below. */
+/* GCC with -std=c99 (for GCC<=4) requires the lines below.  tee(2)
+   and splice(2) are Linux specific and require _GNU_SOURCE. */
 
-#define _POSIX_SOURCE 500
+#define _GNU_SOURCE
 
 #include <stdbool.h>
 #include <stdio.h>
@@ -33,17 +52,173 @@
 #include <assert.h>
 #include <poll.h>
 #include <spawn.h>
+#include <sys/stat.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <sys/uio.h>
+#include <syslog.h>
+#include <time.h>
 
-#define VERSION "2021-03-07"
+#define VERSION "2026-10-19"
 #define GITHUB "https://github.com/RIKEN-RCCS/gfarm-v2-tools"
 
 extern char **environ;
 
-/* The streams for fd=3 and fd=4.  logout=logerr, when fd=4 is
-   missing. */
+/* A log sink for fd=3 or fd=4.  The fd is set non-blocking, and the
+   outputs are kept in a ring buffer of SINK_RING_SIZE bytes while
+   writing would block.  When the buffer overflows, the oldest outputs
+   are dropped up to a line break.  A sink is closed (fd=-1) when
+   writing fails, and then all the outputs to it are dropped.  The
+   file status flags are shared with the caller (and the other
+   writers) through the open file description, so the original flags
+   are kept in fd0/flags0 and restored at exit. */
 
-FILE *logout;
-FILE *logerr;
+#define SINK_RING_SIZE (1024 * 1024)
+
+/* A time in milliseconds to wait for the log sinks to drain at
+   exit. */
+
+#define SINK_DRAIN_TIMEOUT 5000
+
+struct sink {
+    int fd;
+    int fd0;
+    int flags0;
+    char *b;
+    size_t head;
+    size_t len;
+    long long dropped;
+};
+
+struct sink sinks[2];
+
+/* The sinks for fd=3 and fd=4.  logout=logerr, when fd=4 is missing.
+   Both are null, when fd=3 is missing with --syslog. */
+
+struct sink *logout;
+struct sink *logerr;
+
+/* Selections of the ways of forwarding, indexed by out_or_err (0 for
+   the stdout and 1 for the stderr).  use_tee is set when fd=3 (fd=4)
+   is a pipe.  use_splice is cleared when splice(2) fails on fd=1
+   (fd=2) with EINVAL, which happens with terminals or files opened
+   with O_APPEND. */
+
+bool use_tee[2];
+bool use_splice[2];
+
+/* Flags of closed outputs, indexed by out_or_err.  One is set when
+   writing to fd=1 (fd=2) fails other than by EAGAIN, typically by
+   EPIPE when the reader has exited.  The outputs to it are discarded
+   then, and forwarding to the log streams continues. */
+
+bool closed_output[2];
+
+/* Counters of forwarded bytes, indexed by out_or_err.  The moved ones
+   are the bytes forwarded by tee(2) and splice(2), which are also
+   included in the forwarded ones. */
+
+long long forwarded_bytes[2];
+long long moved_bytes[2];
+
+/* A flag to report the counters at exit always, set by the
+   environment variable TEE2_STATS.  The report is otherwise made only
+   when some outputs are dropped, to avoid a log line for each
+   command. */
+
+bool report_stats;
+
+/* A size to request to tee(2) and splice(2).  It is the default
+   capacity of a pipe on Linux. */
+
+#define PIPE_CHUNK (64 * 1024)
+
+/* The syslog sink (--syslog).  It sends each line as an RFC 5424
+   message to /dev/log.  Lines are batched for SYSLOG_WINDOW
+   milliseconds (or up to SYSLOG_BATCH lines), and a batch is sent by
+   a single sendmmsg(2).  Messages are kept in a queue of SYSLOG_QUEUE
+   messages while sending would block, and the oldest ones are dropped
+   when the queue overflows.  It tags each message with the stream (out,
+   err, or tee2 for its own messages) in the MSGID and in the
+   structured data together with a sequence number, so that the
+   interleaving of the stdout and the stderr can be reconstructed.  It
+   breaks lines at both LF and CR to split progress outputs.  The
+   SD-ID uses the enterprise number 32473 reserved for documentation.
+   syslog_fd=-1 when the sink is not used. */
+
+#ifndef SYSLOG_PATH
+#define SYSLOG_PATH "/dev/log"
+#endif
+#define SYSLOG_WINDOW 50
+#define SYSLOG_BATCH 64
+#define SYSLOG_QUEUE 1024
+#define SYSLOG_LINE_MAX 1800
+#define SYSLOG_MESSAGE_MAX 2048
+
+struct syslog_message {
+    size_t len;
+    char b[SYSLOG_MESSAGE_MAX];
+};
+
+int syslog_fd = -1;
+int syslog_pri;
+char syslog_host[256];
+char syslog_app[49];
+pid_t syslog_pid;
+unsigned long long syslog_seq;
+
+char *syslog_streams[3] = {"out", "err", "tee2"};
+char syslog_line[3][SYSLOG_LINE_MAX];
+size_t syslog_line_len[3];
+
+struct syslog_message syslog_queue[SYSLOG_QUEUE];
+int syslog_queue_head;
+int syslog_queue_n;
+bool syslog_blocked;
+struct timespec syslog_batch_time;
+long long syslog_dropped;
+
+struct syslog_code {
+    char *name;
+    int value;
+};
+
+struct syslog_code syslog_facilities[] = {
+    {"kern", LOG_KERN}, {"user", LOG_USER}, {"mail", LOG_MAIL},
+    {"daemon", LOG_DAEMON}, {"auth", LOG_AUTH}, {"syslog", LOG_SYSLOG},
+    {"lpr", LOG_LPR}, {"news", LOG_NEWS}, {"uucp", LOG_UUCP},
+    {"cron", LOG_CRON}, {"authpriv", LOG_AUTHPRIV}, {"ftp", LOG_FTP},
+    {"local0", LOG_LOCAL0}, {"local1", LOG_LOCAL1},
+    {"local2", LOG_LOCAL2}, {"local3", LOG_LOCAL3},
+    {"local4", LOG_LOCAL4}, {"local5", LOG_LOCAL5},
+    {"local6", LOG_LOCAL6}, {"local7", LOG_LOCAL7},
+    {0, 0}};
+
+struct syslog_code syslog_levels[] = {
+    {"emerg", LOG_EMERG}, {"panic", LOG_EMERG}, {"alert", LOG_ALERT},
+    {"crit", LOG_CRIT}, {"err", LOG_ERR}, {"error", LOG_ERR},
+    {"warning", LOG_WARNING}, {"warn", LOG_WARNING},
+    {"notice", LOG_NOTICE}, {"info", LOG_INFO}, {"debug", LOG_DEBUG},
+    {0, 0}};
+
+void syslog_put(int stream, char *b, size_t n);
+void syslog_end_line(int stream);
+void sink_write(struct sink *s, char *b, size_t n);
+
+/* Writes a line of tee2's own message to the log streams. */
+
+void
+log_line(char *m)
+{
+    if (logerr != 0) {
+	sink_write(logerr, m, strlen(m));
+	sink_write(logerr, "\n", 1);
+    }
+    if (syslog_fd != -1) {
+	syslog_put(2, m, strlen(m));
+	syslog_end_line(2);
+    }
+}
 
 /* Prints a message to the stderr by supplementing with an error
    string. */
@@ -51,21 +226,607 @@ FILE *logerr;
 void
 perror2(char *m, int error)
 {
+    char b[320];
     if (error == 0) {
-	fprintf(stderr, "tee2 warning: %s\n", m);
-	if (logerr != 0) {
-	    fprintf(logerr, "tee2 warning: %s\n", m);
-	}
+	snprintf(b, sizeof(b), "tee2 warning: %s", m);
     } else {
 	char *s = strerror(error);
-	fprintf(stderr, "tee2 error: %s: %s\n", m, s);
-	if (logerr != 0) {
-	    fprintf(logerr, "tee2 error: %s: %s\n", m, s);
+	snprintf(b, sizeof(b), "tee2 error: %s: %s", m, s);
+    }
+    fprintf(stderr, "%s\n", b);
+    log_line(b);
+    fflush(0);
+}
+
+/* Looks up a name in a table of syslog codes.  It returns -1 if not
+   found. */
+
+int
+syslog_lookup(struct syslog_code *table, char *name, size_t len)
+{
+    for (struct syslog_code *c = table; c->name != 0; c++) {
+	if (strlen(c->name) == len && strncmp(c->name, name, len) == 0) {
+	    return c->value;
+	}
+    }
+    return -1;
+}
+
+/* Opens the syslog sink by parsing "facility.level", and sets the
+   APP-NAME by the basename of the command.  It returns false on
+   errors. */
+
+bool
+syslog_open(char *spec, char *command)
+{
+    char *dot = strchr(spec, '.');
+    if (dot == 0) {
+	perror2("bad syslog facility.level", EINVAL);
+	return false;
+    }
+    int facility = syslog_lookup(syslog_facilities, spec, (dot - spec));
+    int level = syslog_lookup(syslog_levels, (dot + 1), strlen(dot + 1));
+    if (facility == -1 || level == -1) {
+	perror2("bad syslog facility.level", EINVAL);
+	return false;
+    }
+    syslog_pri = (facility | level);
+
+    int cc;
+    cc = gethostname(syslog_host, (sizeof(syslog_host) - 1));
+    if (cc != 0 || syslog_host[0] == 0) {
+	strcpy(syslog_host, "-");
+    }
+
+    char *base = strrchr(command, '/');
+    base = (base != 0) ? (base + 1) : command;
+    size_t i;
+    for (i = 0; i < (sizeof(syslog_app) - 1) && base[i] != 0; i++) {
+	char c = base[i];
+	syslog_app[i] = (c > ' ' && c < 127) ? c : '_';
+    }
+    syslog_app[i] = 0;
+    if (i == 0) {
+	strcpy(syslog_app, "-");
+    }
+
+    int fd = socket(AF_UNIX, (SOCK_DGRAM|SOCK_CLOEXEC), 0);
+    if (fd == -1) {
+	perror2("socket failed", errno);
+	return false;
+    }
+    struct sockaddr_un sa;
+    memset(&sa, 0, sizeof(sa));
+    sa.sun_family = AF_UNIX;
+    strncpy(sa.sun_path, SYSLOG_PATH, (sizeof(sa.sun_path) - 1));
+    cc = connect(fd, (struct sockaddr *)&sa, sizeof(sa));
+    if (cc != 0) {
+	perror2("connect(" SYSLOG_PATH ") failed", errno);
+	close(fd);
+	return false;
+    }
+    syslog_fd = fd;
+    return true;
+}
+
+/* Returns the milliseconds left until the batch should be sent, or
+   -1 when the queue is empty or sending is blocked (then it waits
+   for POLLOUT).  It is used as a timeout to poll. */
+
+int
+syslog_timeout(void)
+{
+    if (syslog_queue_n == 0 || syslog_blocked) {
+	return -1;
+    }
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    long long ms = (((now.tv_sec - syslog_batch_time.tv_sec) * 1000LL)
+		    + ((now.tv_nsec - syslog_batch_time.tv_nsec) / 1000000));
+    return (ms >= SYSLOG_WINDOW) ? 0 : (int)(SYSLOG_WINDOW - ms);
+}
+
+/* Removes n messages at the head of the queue. */
+
+void
+syslog_dequeue(int n)
+{
+    syslog_queue_head = ((syslog_queue_head + n) % SYSLOG_QUEUE);
+    syslog_queue_n -= n;
+}
+
+/* Sends the queued messages by sendmmsg(2) in batches of up to
+   SYSLOG_BATCH messages without blocking.  It leaves the messages in
+   the queue and sets syslog_blocked when sending would block.
+   Messages are dropped on other errors.  Dropped messages are counted
+   and reported at exit. */
+
+void
+syslog_flush(void)
+{
+    syslog_blocked = false;
+    while (syslog_queue_n > 0) {
+	int h = syslog_queue_head;
+	int n = syslog_queue_n;
+	n = (n < SYSLOG_BATCH) ? n : SYSLOG_BATCH;
+	n = (n < (SYSLOG_QUEUE - h)) ? n : (SYSLOG_QUEUE - h);
+
+	struct iovec iov[SYSLOG_BATCH];
+	struct mmsghdr msgs[SYSLOG_BATCH];
+	memset(msgs, 0, sizeof(msgs));
+	for (int i = 0; i < n; i++) {
+	    iov[i].iov_base = syslog_queue[h + i].b;
+	    iov[i].iov_len = syslog_queue[h + i].len;
+	    msgs[i].msg_hdr.msg_iov = &iov[i];
+	    msgs[i].msg_hdr.msg_iovlen = 1;
+	}
+	int cc = sendmmsg(syslog_fd, msgs, n, MSG_DONTWAIT);
+	if (cc == -1) {
+	    if (errno == EINTR) {
+		continue;
+	    } else if (errno == EAGAIN || errno == EWOULDBLOCK) {
+		syslog_blocked = true;
+		return;
+	    }
+	    syslog_dropped += n;
+	    syslog_dequeue(n);
+	    continue;
+	}
+	syslog_dequeue(cc);
+    }
+}
+
+/* Formats the pending line of the stream into the queue as a
+   message.  It sends a batch first when a batch is filled.  It drops
+   the oldest message when the queue is full. */
+
+void
+syslog_end_line(int stream)
+{
+    if (syslog_line_len[stream] == 0) {
+	return;
+    }
+    if (syslog_queue_n >= SYSLOG_BATCH && !syslog_blocked) {
+	syslog_flush();
+    }
+    if (syslog_queue_n == SYSLOG_QUEUE) {
+	syslog_dropped++;
+	syslog_dequeue(1);
+    }
+    if (syslog_queue_n == 0) {
+	clock_gettime(CLOCK_MONOTONIC, &syslog_batch_time);
+    }
+
+    struct timespec now;
+    clock_gettime(CLOCK_REALTIME, &now);
+    struct tm tm;
+    gmtime_r(&now.tv_sec, &tm);
+    char date[32];
+    strftime(date, sizeof(date), "%Y-%m-%dT%H:%M:%S", &tm);
+
+    int tail = ((syslog_queue_head + syslog_queue_n) % SYSLOG_QUEUE);
+    struct syslog_message *m = &syslog_queue[tail];
+    char procid[24];
+    if (syslog_pid != 0) {
+	snprintf(procid, sizeof(procid), "%ld", (long)syslog_pid);
+    } else {
+	strcpy(procid, "-");
+    }
+    int n = snprintf(m->b, sizeof(m->b),
+		     ("<%d>1 %s.%06ldZ %s %s %s %s"
+		      " [tee2@32473 stream=\"%s\" seq=\"%llu\"] "),
+		     syslog_pri, date, (now.tv_nsec / 1000),
+		     syslog_host, syslog_app, procid,
+		     syslog_streams[stream], syslog_streams[stream],
+		     syslog_seq);
+    assert(n > 0 && (size_t)n < sizeof(m->b));
+    size_t len = syslog_line_len[stream];
+    if (len > (sizeof(m->b) - n)) {
+	len = (sizeof(m->b) - n);
+    }
+    memcpy((m->b + n), syslog_line[stream], len);
+    m->len = (n + len);
+    syslog_queue_n++;
+    syslog_seq++;
+    syslog_line_len[stream] = 0;
+}
+
+/* Accumulates outputs of the stream and makes messages at line
+   breaks.  It breaks a long line at SYSLOG_LINE_MAX. */
+
+void
+syslog_put(int stream, char *b, size_t n)
+{
+    for (size_t i = 0; i < n; i++) {
+	char c = b[i];
+	if (c == '\n' || c == '\r') {
+	    syslog_end_line(stream);
+	    continue;
+	}
+	syslog_line[stream][syslog_line_len[stream]] = c;
+	syslog_line_len[stream]++;
+	if (syslog_line_len[stream] == SYSLOG_LINE_MAX) {
+	    syslog_end_line(stream);
+	}
+    }
+}
+
+/* Opens a log sink on the fd.  It sets the fd non-blocking. */
+
+bool
+sink_open(struct sink *s, int fd)
+{
+    int flags = fcntl(fd, F_GETFL);
+    if (flags == -1) {
+	return false;
+    }
+    int cc = fcntl(fd, F_SETFL, (flags | O_NONBLOCK));
+    if (cc == -1) {
+	return false;
+    }
+    s->fd0 = fd;
+    s->flags0 = flags;
+    s->b = malloc(SINK_RING_SIZE);
+    if (s->b == 0) {
+	return false;
+    }
+    s->fd = fd;
+    s->head = 0;
+    s->len = 0;
+    s->dropped = 0;
+    return true;
+}
+
+/* Restores the file status flags of the fds of the sinks (clearing
+   O_NONBLOCK).  It is called at exit (by atexit), after the sinks are
+   drained.  It restores in the reverse order of opening, because
+   fd=3 and fd=4 may share an open file description, and then the
+   flags saved for fd=4 already have O_NONBLOCK. */
+
+void
+sink_restore_flags(void)
+{
+    for (int i = 1; i >= 0; i--) {
+	if (sinks[i].fd0 != -1) {
+	    fcntl(sinks[i].fd0, F_SETFL, sinks[i].flags0);
+	    sinks[i].fd0 = -1;
+	}
+    }
+}
+
+/* Drops n bytes at the head of the ring buffer. */
+
+void
+sink_drop(struct sink *s, size_t n)
+{
+    s->head = ((s->head + n) % SINK_RING_SIZE);
+    s->len -= n;
+    s->dropped += n;
+}
+
+/* Writes the outputs in the ring buffer as much as possible without
+   blocking.  It closes the sink on errors by dropping the outputs. */
+
+void
+sink_drain(struct sink *s)
+{
+    while (s->len > 0 && s->fd != -1) {
+	size_t n = s->len;
+	if (n > (SINK_RING_SIZE - s->head)) {
+	    n = (SINK_RING_SIZE - s->head);
+	}
+	ssize_t k = write(s->fd, (s->b + s->head), n);
+	if (k == -1) {
+	    if (errno == EINTR) {
+		continue;
+	    } else if (errno == EAGAIN || errno == EWOULDBLOCK) {
+		return;
+	    }
+	    s->fd = -1;
+	    break;
+	}
+	s->head = ((s->head + k) % SINK_RING_SIZE);
+	s->len -= k;
+    }
+    if (s->fd == -1) {
+	sink_drop(s, s->len);
+    }
+}
+
+/* Appends the outputs to the ring buffer.  When the buffer
+   overflows, it drops the oldest outputs, and further up to a line
+   break in the buffer (if any) to keep the log in lines. */
+
+void
+sink_append(struct sink *s, char *b, size_t n)
+{
+    if (n > SINK_RING_SIZE) {
+	s->dropped += (n - SINK_RING_SIZE);
+	b += (n - SINK_RING_SIZE);
+	n = SINK_RING_SIZE;
+    }
+    if (s->len + n > SINK_RING_SIZE) {
+	sink_drop(s, (s->len + n - SINK_RING_SIZE));
+	for (size_t i = 0; i < s->len; i++) {
+	    if (s->b[(s->head + i) % SINK_RING_SIZE] == '\n') {
+		sink_drop(s, (i + 1));
+		break;
+	    }
+	}
+    }
+    size_t tail = ((s->head + s->len) % SINK_RING_SIZE);
+    size_t n0 = (n < (SINK_RING_SIZE - tail)) ? n : (SINK_RING_SIZE - tail);
+    memcpy((s->b + tail), b, n0);
+    memcpy(s->b, (b + n0), (n - n0));
+    s->len += n;
+}
+
+/* Writes the outputs to the sink without blocking.  It writes
+   directly when the ring buffer is empty, and appends the rest to the
+   buffer. */
+
+void
+sink_write(struct sink *s, char *b, size_t n)
+{
+    if (s->fd == -1) {
+	s->dropped += n;
+	return;
+    }
+    while (s->len == 0 && n > 0) {
+	ssize_t k = write(s->fd, b, n);
+	if (k == -1) {
+	    if (errno == EINTR) {
+		continue;
+	    } else if (errno == EAGAIN || errno == EWOULDBLOCK) {
+		break;
+	    }
+	    s->fd = -1;
+	    s->dropped += n;
+	    return;
 	}
+	b += k;
+	n -= k;
+    }
+    if (n > 0) {
+	sink_append(s, b, n);
     }
+}
+
+/* Waits until the fd is writable.  It is used when fd=1 (fd=2) is
+   non-blocking, because outputs to them are never dropped. */
+
+void
+wait_writable(int fd)
+{
+    struct pollfd p;
+    p.fd = fd;
+    p.events = POLLOUT;
+    p.revents = 0;
+    int cc = poll(&p, 1, -1);
+    if (cc == -1 && errno != EINTR) {
+	perror2("poll failed", errno);
+    }
+}
+
+/* Writes the outputs to fd=1 (out_or_err=0) or fd=2 (out_or_err=1).
+   The stdout/stderr are unbuffered, and it writes to the fds
+   directly.  It waits when writing would block.  It marks the output
+   closed on errors and discards the outputs then. */
+
+void
+write_output(int out_or_err, char *b, size_t n)
+{
+    int fd = (out_or_err == 0) ? fileno(stdout) : fileno(stderr);
+    while (n > 0 && !closed_output[out_or_err]) {
+	ssize_t k = write(fd, b, n);
+	if (k == -1) {
+	    if (errno == EINTR) {
+		continue;
+	    } else if (errno == EAGAIN || errno == EWOULDBLOCK) {
+		wait_writable(fd);
+		continue;
+	    }
+	    closed_output[out_or_err] = true;
+	    break;
+	}
+	b += k;
+	n -= k;
+    }
+}
+
+/* Copies n bytes from the pipe fd to fd=1 (fd=2), or less at EOF.
+   It is used to consume the data after tee(2) when splice(2) is not
+   usable on the output. */
+
+void
+copy_bytes(int fd, int out_or_err, size_t n)
+{
+    while (n > 0) {
+	char b[BUFSIZ];
+	size_t size = (n < sizeof(b)) ? n : sizeof(b);
+	ssize_t k = read(fd, b, size);
+	if (k == -1 && errno == EINTR) {
+	    continue;
+	}
+	assert(k >= 0);
+	if (k == 0) {
+	    break;
+	}
+	write_output(out_or_err, b, k);
+	n -= k;
+    }
+}
+
+/* Forwards the outputs available on the pipe fd to fd=1 and fd=3
+   (out_or_err=0) or to fd=2 and fd=4 (out_or_err=1).  It duplicates
+   the outputs to fd=3 (fd=4) by tee(2), and then moves them to fd=1
+   (fd=2) by splice(2).  Otherwise, it copies the outputs through a
+   buffer.  It uses tee(2) only when the ring buffer of the sink is
+   empty to keep the ordering, and it copies when tee(2) would block.
+   A log stream whose reader has exited (EPIPE) is closed by
+   sink_write on the copying path.  When splice(2) would block on a
+   non-blocking fd=1 (fd=2), it waits, and when it fails otherwise
+   (EPIPE), it marks the output closed.  It returns the number of
+   bytes forwarded, zero at EOF, or -1 when it should be retried. */
+
+ssize_t
+forward(int out_or_err, int fd)
+{
+    int f0 = (out_or_err == 0) ? fileno(stdout) : fileno(stderr);
+    struct sink *f1 = (out_or_err == 0) ? logout : logerr;
+
+    if (use_tee[out_or_err] && f1->fd != -1 && f1->len == 0) {
+	ssize_t n = tee(fd, f1->fd, PIPE_CHUNK, SPLICE_F_NONBLOCK);
+	if (n == -1) {
+	    if (errno == EINTR) {
+		return -1;
+	    } else if (errno == EAGAIN) {
+		/* Copy when the log pipe is full. */
+	    } else if (errno == EINVAL) {
+		use_tee[out_or_err] = false;
+	    } else {
+		/* Let sink_write handle the error (EPIPE). */
+	    }
+	    /*FALLTHRU*/
+	} else if (n == 0) {
+	    return 0;
+	} else {
+	    size_t left = n;
+	    while (left > 0 && use_splice[out_or_err]
+		   && !closed_output[out_or_err]) {
+		ssize_t k = splice(fd, 0, f0, 0, left, SPLICE_F_MOVE);
+		if (k == -1) {
+		    if (errno == EINTR) {
+			continue;
+		    } else if (errno == EAGAIN) {
+			wait_writable(f0);
+			continue;
+		    } else if (errno == EINVAL) {
+			use_splice[out_or_err] = false;
+		    } else {
+			closed_output[out_or_err] = true;
+		    }
+		    break;
+		}
+		assert(k > 0);
+		left -= k;
+		moved_bytes[out_or_err] += k;
+	    }
+	    copy_bytes(fd, out_or_err, left);
+	    forwarded_bytes[out_or_err] += n;
+	    return n;
+	}
+    }
+
+    char b[BUFSIZ];
+    ssize_t n = read(fd, b, sizeof(b));
+    if (n == -1 && errno == EINTR) {
+	return -1;
+    }
+    assert(n >= 0);
+    if (n == 0) {
+	return 0;
+    }
+
+    write_output(out_or_err, b, n);
+    if (f1 != 0) {
+	sink_write(f1, b, n);
+    }
+    if (syslog_fd != -1) {
+	syslog_put(out_or_err, b, n);
+    }
+    forwarded_bytes[out_or_err] += n;
+    return n;
+}
+
+/* Reports the counters of forwarded bytes to the log streams, when
+   report_stats is set or when some outputs to the logs are dropped.
+   It does not disturb the stdout/stderr. */
+
+void
+report_counters(void)
+{
+    if (!report_stats && sinks[0].dropped == 0 && sinks[1].dropped == 0
+	&& syslog_dropped == 0) {
+	return;
+    }
+    char m[240];
+    snprintf(m, sizeof(m), ("tee2 info: stdout %lld bytes (%lld moved),"
+			    " stderr %lld bytes (%lld moved),"
+			    " dropped fd=3 %lld bytes, fd=4 %lld bytes,"
+			    " syslog %lld lines"),
+	     forwarded_bytes[0], moved_bytes[0],
+	     forwarded_bytes[1], moved_bytes[1],
+	     sinks[0].dropped, sinks[1].dropped, syslog_dropped);
+    log_line(m);
     fflush(0);
 }
 
+/* Waits for the log sinks and the syslog sink to drain, for
+   SINK_DRAIN_TIMEOUT milliseconds at most.  It drops the rest, and
+   prints the counters of the dropped outputs to the stderr. */
+
+void
+drain_sinks(void)
+{
+    if (syslog_fd != -1) {
+	syslog_end_line(2);
+	syslog_flush();
+    }
+
+    struct timespec start;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    while (1) {
+	struct pollfd fds[3];
+	nfds_t nfds = 0;
+	for (int i = 0; i < 2; i++) {
+	    sink_drain(&sinks[i]);
+	    if (sinks[i].fd != -1 && sinks[i].len > 0) {
+		fds[nfds].fd = sinks[i].fd;
+		fds[nfds].events = POLLOUT;
+		fds[nfds].revents = 0;
+		nfds++;
+	    }
+	}
+	if (syslog_fd != -1 && syslog_queue_n > 0) {
+	    fds[nfds].fd = syslog_fd;
+	    fds[nfds].events = POLLOUT;
+	    fds[nfds].revents = 0;
+	    nfds++;
+	}
+	if (nfds == 0) {
+	    break;
+	}
+	struct timespec now;
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	long long ms = (((now.tv_sec - start.tv_sec) * 1000LL)
+			+ ((now.tv_nsec - start.tv_nsec) / 1000000));
+	if (ms >= SINK_DRAIN_TIMEOUT) {
+	    break;
+	}
+	int cc = poll(fds, nfds, (int)(SINK_DRAIN_TIMEOUT - ms));
+	if (cc == -1 && errno != EINTR) {
+	    break;
+	}
+	if (syslog_fd != -1) {
+	    syslog_flush();
+	}
+    }
+
+    for (int i = 0; i < 2; i++) {
+	sink_drop(&sinks[i], sinks[i].len);
+    }
+    syslog_dropped += syslog_queue_n;
+    syslog_queue_n = 0;
+
+    if (sinks[0].dropped != 0 || sinks[1].dropped != 0
+	|| syslog_dropped != 0) {
+	fprintf(stderr, ("tee2 warning: dropped fd=3 %lld bytes,"
+			 " fd=4 %lld bytes, syslog %lld lines\n"),
+		sinks[0].dropped, sinks[1].dropped, syslog_dropped);
+    }
+}
+
 /* Starts a subprocess and forwards the stdout outputs to fd=1 and
    fd=3 and the stderr outputs to fd=2 and fd=4 (or to fd=3 when fd=4 is
    not passed). */
@@ -75,11 +836,23 @@ main(int argc, char **argv)
 {
     int cc;
 
-    if (argc == 1 || strcmp(argv[1], "--version") == 0) {
+    char **argv1 = argv + 1;
+    char *syslog_spec = 0;
+
+    if (argc >= 3 && strcmp(argv1[0], "--syslog") == 0) {
+	syslog_spec = argv1[1];
+	argv1 += 2;
+    }
+    if (argv1[0] == 0 || strcmp(argv1[0], "--version") == 0) {
 	fprintf(stdout, ("tee2 version " VERSION " (See " GITHUB ")\n"));
 	exit(1);
     }
 
+    {
+	char *v = getenv("TEE2_STATS");
+	report_stats = (v != 0 && v[0] != 0);
+    }
+
     /* Prepare the streams for logging. */
 
     logout = 0;
@@ -98,38 +871,59 @@ main(int argc, char **argv)
 	if (flags4 >= 0) {
 	    o_fdset |= 2;
 	}
-	if ((o_fdset & 1) == 0) {
+	if ((o_fdset & 1) == 0 && syslog_spec == 0) {
 	    perror2("fd=3 not given", EBADF);
 	    exit(1);
+	} else if ((o_fdset & 1) == 0) {
+	    /* Use only the syslog sink. */
+	    o_fdset = 0;
 	}
 
-	{
-	    int fd = ((o_fdset & 2) != 0) ? 4 : 3;
-	    logerr = fdopen(fd, "w");
-	    if (logerr == 0) {
-		perror2("fdopen failed", errno);
+	sinks[0].fd = -1;
+	sinks[1].fd = -1;
+	sinks[0].fd0 = -1;
+	sinks[1].fd0 = -1;
+	atexit(sink_restore_flags);
+	if (o_fdset != 0) {
+	    if (!sink_open(&sinks[0], 3)) {
+		perror2("setting fd=3 failed", errno);
 		exit(1);
 	    }
-	    cc = setvbuf(logerr, 0, _IONBF, 0);
-	    if (cc != 0) {
-		perror2("setvbuf failed", 0);
-	    }
 	}
-	if ((o_fdset & 2) != 0) {
-	    logout = fdopen(3, "w");
-	    if (logout == 0) {
-		perror2("fdopen(3) failed", errno);
+	if (o_fdset == 0) {
+	    /* No log streams. */
+	} else if ((o_fdset & 2) != 0) {
+	    if (!sink_open(&sinks[1], 4)) {
+		perror2("setting fd=4 failed", errno);
 		exit(1);
 	    }
-	    cc = setvbuf(logout, 0, _IONBF, 0);
-	    if (cc != 0) {
-		perror2("setvbuf failed", 0);
-	    }
+	    logout = &sinks[0];
+	    logerr = &sinks[1];
 	} else {
-	    logout = logerr;
+	    logout = &sinks[0];
+	    logerr = &sinks[0];
+	}
+    }
+    assert((logerr != 0 && logout != 0) || o_fdset == 0);
+
+    if (syslog_spec != 0) {
+	if (!syslog_open(syslog_spec, argv1[0])) {
+	    exit(1);
 	}
     }
-    assert(logerr != 0 && logout != 0);
+
+    /* Check the log streams are pipes for using tee(2).  The syslog
+       sink needs the outputs in userspace. */
+
+    if (o_fdset != 0 && syslog_fd == -1) {
+	struct stat st;
+	cc = fstat(logout->fd, &st);
+	use_tee[0] = (cc == 0 && S_ISFIFO(st.st_mode));
+	cc = fstat(logerr->fd, &st);
+	use_tee[1] = (cc == 0 && S_ISFIFO(st.st_mode));
+    }
+    use_splice[0] = true;
+    use_splice[1] = true;
 
     /* Disable buffering on the stdout and the stderr. */
 
@@ -187,8 +981,10 @@ main(int argc, char **argv)
 	assert(cc == 0);
 	cc = posix_spawn_file_actions_addclose(&actions, errs[1]);
 	assert(cc == 0);
-	cc = posix_spawn_file_actions_addclose(&actions, 3);
-	assert(cc == 0);
+	if ((o_fdset & 1) != 0) {
+	    cc = posix_spawn_file_actions_addclose(&actions, 3);
+	    assert(cc == 0);
+	}
 	if (o_fdset == 3) {
 	    cc = posix_spawn_file_actions_addclose(&actions, 4);
 	    assert(cc == 0);
@@ -207,7 +1003,6 @@ main(int argc, char **argv)
     }
 
     pid_t pid;
-    char **argv1 = argv + 1;
     cc = posix_spawnp(&pid, argv1[0], &actions, &attrs, argv1, environ);
     if (cc != 0) {
 	char m[160];
@@ -217,6 +1012,8 @@ main(int argc, char **argv)
 	exit(1);
     }
 
+    syslog_pid = pid;
+
     cc = posix_spawn_file_actions_destroy(&actions);
     assert(cc == 0);
     cc = posix_spawnattr_destroy(&attrs);
@@ -239,6 +1036,13 @@ main(int argc, char **argv)
 	cc = sigaction(SIGQUIT, &ignore, 0);
 	assert(cc == 0);
 
+	/* Ignore SIGPIPE after spawning (the command inherits ignored
+	   signals), so that an exited reader of an output or a logger
+	   results in EPIPE. */
+
+	cc = sigaction(SIGPIPE, &ignore, 0);
+	assert(cc == 0);
+
 	cc = sigprocmask(SIG_SETMASK, &osigmask, 0);
 	assert(cc == 0);
     }
@@ -253,9 +1057,10 @@ main(int argc, char **argv)
     int i_fdset;
     i_fdset = 3;
     while (i_fdset != 0) {
-	int timeout = /*indefinite*/ -1;
-	struct pollfd fds[2];
+	int timeout = (syslog_fd != -1) ? syslog_timeout() : /*indefinite*/ -1;
+	struct pollfd fds[5];
 	nfds_t nfds;
+	nfds_t nins;
 
 	nfds = 0;
 	if ((i_fdset & 2) != 0) {
@@ -272,6 +1077,23 @@ main(int argc, char **argv)
 	    fds[nfds].revents = 0;
 	    nfds++;
 	}
+	nins = nfds;
+	for (int i = 0; i < 2; i++) {
+	    if (sinks[i].fd != -1 && sinks[i].len > 0) {
+		/*log-out*/
+		fds[nfds].fd = sinks[i].fd;
+		fds[nfds].events = POLLOUT;
+		fds[nfds].revents = 0;
+		nfds++;
+	    }
+	}
+	if (syslog_fd != -1 && syslog_blocked) {
+	    /*syslog-out*/
+	    fds[nfds].fd = syslog_fd;
+	    fds[nfds].events = POLLOUT;
+	    fds[nfds].revents = 0;
+	    nfds++;
+	}
 
 	int cc = poll(fds, nfds, timeout);
 	if (cc == -1) {
@@ -281,34 +1103,40 @@ main(int argc, char **argv)
 	    assert(0);
 	    return errno;
 	} else if (cc == 0) {
-	    /* TIMEDOUT! */
-	    assert(0);
+	    /* TIMEDOUT!  Send the batch of syslog messages. */
+	    assert(syslog_fd != -1);
+	    syslog_flush();
+	    continue;
 	} else {
-	    assert(cc <= 2);
+	    assert(cc <= 5);
 	    /*FALLTHRU*/
 	}
-	for (nfds_t i = 0; i < nfds; i++) {
+
+	/* Drain the log sinks first, they never block. */
+
+	for (nfds_t i = nins; i < nfds; i++) {
+	    if (fds[i].revents == 0) {
+		continue;
+	    } else if (fds[i].fd == syslog_fd) {
+		syslog_flush();
+	    } else {
+		int k = (fds[i].fd == sinks[0].fd) ? 0 : 1;
+		sink_drain(&sinks[k]);
+	    }
+	}
+
+	for (nfds_t i = 0; i < nins; i++) {
 	    int out_or_err = (((i_fdset & 2) != 0) && i == 0) ? 1 : 0;
 
 	    if (fds[i].revents == 0) {
 		continue;
 	    } else if ((fds[i].revents & (POLLIN)) != 0) {
-		char b[BUFSIZ];
-		int fd = (i == 0) ? errs[0] : outs[0];
-		ssize_t n = read(fd, b, sizeof(b));
+		int fd = (out_or_err == 1) ? errs[0] : outs[0];
+		ssize_t n = forward(out_or_err, fd);
 		if (n == 0) {
 		    i_fdset &= ~(1 << out_or_err);
 		    continue;
 		}
-		assert(n > 0);
-
-		FILE *f0 = (out_or_err == 0) ? stdout : stderr;
-		cc = fwrite(b, n, 1, f0);
-		assert(cc == 1);
-
-		FILE *f1 = (out_or_err == 0) ? logout : logerr;
-		cc = fwrite(b, n, 1, f1);
-		assert(cc == 1);
 	    } else if ((fds[i].revents & (POLLERR|POLLHUP)) != 0) {
 		/* HUP for close event. */
 		i_fdset &= ~(1 << out_or_err);
@@ -323,6 +1151,16 @@ main(int argc, char **argv)
 
 	    break;
 	}
+	if (syslog_fd != -1 && syslog_timeout() == 0) {
+	    syslog_flush();
+	}
+    }
+
+    /* Send the last lines which may not end with a newline. */
+
+    if (syslog_fd != -1) {
+	syslog_end_line(1);
+	syslog_end_line(0);
     }
 
     int stat;
@@ -339,6 +1177,8 @@ main(int argc, char **argv)
 	assert(errno == EINTR);
     }
 
+    report_counters();
+
     /* Return normally as exited -- It needs to fake the status. */
 
     /*WIFEXITED(stat)*/
@@ -355,6 +1195,8 @@ main(int argc, char **argv)
 	perror2(m, 0);
     }
 
+    drain_sinks();
+
     int v = WEXITSTATUS(stat);
     exit(v);
 }
@@ -1,9 +1,16 @@
 #!/bin/bash
 
 ## A command wrapper with logging to syslog.  This does not work with
-## KSH.
+## KSH.  When the environment variable "TEE2_SYSLOG" is set to a
+## non-empty value, tee2 sends the outputs to syslog by itself
+## (--syslog) without running logger.  It needs rsyslog to parse the
+## RFC 5424 format on /dev/log (see README.md).
 
 log="ftp.debug"
 echo HPCI-ACCESS "$0" "$*" | /bin/logger -p ${log}
-exec ./tee2 "$@" \
-     3> >(trap '' INT QUIT; exec /bin/logger -p ${log})
+if [ -z "${TEE2_SYSLOG}" ]; then
+    exec ./tee2 "$@" \
+	 3> >(trap '' INT QUIT; exec /bin/logger -p ${log})
+else
+    exec ./tee2 --syslog ${log} "$@"
+fi
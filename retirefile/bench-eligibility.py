@@ -0,0 +1,123 @@
+## bench-eligibility.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""Measures the cost of evaluating the conditions of removing files
+in retirefile.py.  It does not need libgfarm.  It fills an array of
+gfs_stat with synthetic states, and times evaluate_conditions with
+NumPy (when available), the same without NumPy, and the old style
+that converts times to floats file by file.  It prints the time per
+file in microseconds."""
+
+## Usage:
+## python3 bench-eligibility.py [--files 100000] [--repeat 5]
+
+import os
+import sys
+import time
+import random
+import argparse
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gfarm
+
+def load_retirefile():
+    """Loads retirefile.py as a module (its main part is not run)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "retirefile.py")
+    spec = importlib.util.spec_from_file_location("retirefile", path)
+    m = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(m)
+    return m
+
+def make_states(n, now):
+    """Makes synthetic inputs: local mtimes, a _stat_array, error codes,
+    and ncopy settings.  About a tenth of the files are young, lack a
+    replica, or are modified locally."""
+    rnd = random.Random(0)
+    sts = gfarm._stat_array(n)
+    mtimel = []
+    ncs = []
+    for i in range(n):
+        st = sts.a[i]
+        age = (rnd.randrange(60, 86400) if rnd.random() > 0.1
+               else rnd.randrange(0, 60))
+        ct = (now - age * 1000000000 - rnd.randrange(1000000000))
+        mt = (ct - rnd.randrange(3600 * 1000000000))
+        st.st_size = rnd.randrange(1 << 30)
+        st.st_ncopy = (2 if rnd.random() > 0.1 else 1)
+        st.st_mtimespec.tv_sec = (mt // 1000000000)
+        st.st_mtimespec.tv_nsec = (mt % 1000000000)
+        st.st_ctimespec.tv_sec = (ct // 1000000000)
+        st.st_ctimespec.tv_nsec = (ct % 1000000000)
+        mtimel.append(mt if rnd.random() > 0.1 else (mt + 7200000000000))
+        ncs.append(2)
+    ## Keep the entries from being freed by gfs_stat_free.
+    ccs = sts.ccs
+    for i in range(n):
+        ccs[i] = gfarm.GFARM_ERR_NO_ERROR
+    return (mtimel, sts, ccs, ncs)
+
+def evaluate_by_floats(rf, mtimel, sts, ccs, ncs, now):
+    """Evaluates the conditions file by file with floats as
+    retirefile.py did before."""
+    now = (now * 1e-9)
+    selected = []
+    for i in range(len(mtimel)):
+        st = sts.a[i]
+        mtimer = gfarm.timespec_to_float(st.st_mtimespec)
+        ctimer = gfarm.timespec_to_float(st.st_ctimespec)
+        replicas_created = (st.st_ncopy >= ncs[i])
+        sufficiently_old = ((ctimer + rf.time_to_stabilize) < now)
+        mtime_unmodified = (abs(mtimer - mtimel[i] * 1e-9) <= rf.time_drift)
+        if (replicas_created and sufficiently_old and mtime_unmodified):
+            selected.append(i)
+    return selected
+
+def measure(f, repeat):
+    """Returns the best time of calls to f and its last value."""
+    best = None
+    v = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        v = f()
+        t1 = time.perf_counter()
+        best = ((t1 - t0) if best == None else min(best, (t1 - t0)))
+    return (best, v)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description='''
+bench-eligibility.py measures the cost of the conditions of removing
+files in retirefile.py.''')
+    p.add_argument('--files', dest='files', type=int, default=100000)
+    p.add_argument('--repeat', dest='repeat', type=int, default=5)
+    args = p.parse_args()
+    rf = load_retirefile()
+    numpy = rf.numpy
+    now = int(time.time() * 1e9)
+    (mtimel, sts, ccs, ncs) = make_states(args.files, now)
+
+    def run(use_numpy):
+        rf.numpy = (numpy if use_numpy else None)
+        c = rf.evaluate_conditions(mtimel, sts, ccs, ncs, now)
+        return rf.select_files(c)
+
+    results = {}
+    if (numpy != None):
+        results["numpy"] = measure(lambda: run(True), args.repeat)
+    results["python"] = measure(lambda: run(False), args.repeat)
+    results["floats"] = measure(
+        lambda: evaluate_by_floats(rf, mtimel, sts, ccs, ncs, now),
+        args.repeat)
+    rf.numpy = numpy
+
+    selected = None
+    for (k, (t, v)) in results.items():
+        if (selected == None):
+            selected = v
+        elif (v != selected):
+            print("Mismatch in selected files: " + k, file=sys.stderr)
+        print(k + ": " + ("%.3f" % (t * 1e6 / args.files)) + " us/file"
+              + " (" + str(len(v)) + "/" + str(args.files) + " selected)")
+    sys.exit(0)
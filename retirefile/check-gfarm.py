@@ -49,6 +49,29 @@ assert cc == 0
 (nc, cc) = gfarm.get_ncopy(f0)
 assert cc == 0
 
+(sts, ccs) = gfarm.stat_many([f0, os.path.join(remote, "nonexisting")])
+assert ccs[0] == 0 and ccs[1] == 2
+assert sts[0].st_size == st.st_size
+(ncs, ccs) = gfarm.get_ncopy_many([f0])
+assert ccs[0] == 0 and ncs[0] == nc
+
+gfarm.set_stat_cache_expiration(10.0)
+gfarm.expire_stat_cache()
+gfarm.clear_stat_cache()
+(st, cc) = gfarm.stat(f0)
+assert cc == 0
+cs = gfarm.cache_statistics()
+assert cs["stat"]["hits"] + cs["stat"]["misses"] > 0
+
+##
+## Quota (a directory quota may not be set).
+##
+
+(uq, cc) = gfarm.user_quota(remote)
+assert cc == 0
+(dq, cc) = gfarm.directory_quota(remote)
+assert cc == 0 or cc == gfarm.GFARM_ERR_NO_SUCH_OBJECT
+
 ##
 ## Copy, rename some files.
 ##
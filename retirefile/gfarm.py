@@ -20,10 +20,17 @@ raise assertion errors."""
 ## This library does not follow the coding of file names in
 ## os.fsdecode() and os.fsencode().
 
+import os
 import ctypes
 import sys
 import pathlib
 import time
+import tempfile
+import atexit
+import threading
+import collections
+import multiprocessing
+import multiprocessing.util
 ##import warnings
 ##import inspect
 ##import traceback
@@ -295,6 +302,8 @@ def load(so = "libgfarm.so"):
     gfso.gfs_replica_info_nth_is_dead_host.restype = _c_int
     gfso.gfs_replica_info_nth_is_dead_copy.argtypes = [_c_void_p, _c_int]
     gfso.gfs_replica_info_nth_is_dead_copy.restype = _c_int
+    gfso.gfs_replica_info_free.argtypes = [_c_void_p]
+    gfso.gfs_replica_info_free.restype = None
 
     gfso.gfarm_realpath_by_gfarm2fs.argtypes = [_c_string, _c_string_p]
     gfso.gfarm_realpath_by_gfarm2fs.restype = _c_int
@@ -303,6 +312,8 @@ def load(so = "libgfarm.so"):
     gfso.gfs_stat_cached.restype = _c_int
     gfso.gfs_lstat_cached.argtypes = [_c_string, _c_gfs_stat_p]
     gfso.gfs_lstat_cached.restype = _c_int
+    gfso.gfs_stat_free.argtypes = [_c_gfs_stat_p]
+    gfso.gfs_stat_free.restype = None
 
     gfso.gfs_getxattr_cached.argtypes = [_c_string, _c_string, _c_pointer,
                                          _c_size_t_p]
@@ -320,6 +331,12 @@ def load(so = "libgfarm.so"):
 
     gfso.gfs_stat_cache_enable.argtypes = [_c_int]
     gfso.gfs_stat_cache_enable.restype = None
+    gfso.gfs_stat_cache_expiration_set.argtypes = [_c_long]
+    gfso.gfs_stat_cache_expiration_set.restype = None
+    gfso.gfs_stat_cache_clear.argtypes = []
+    gfso.gfs_stat_cache_clear.restype = None
+    gfso.gfs_stat_cache_expire.argtypes = []
+    gfso.gfs_stat_cache_expire.restype = None
     gfso.gfarm_xattr_caching_pattern_add.argtypes = [_c_string]
     gfso.gfarm_xattr_caching_pattern_add.restype = _c_int
 
@@ -335,6 +352,26 @@ def load(so = "libgfarm.so"):
 
     gfso.gfs_rename.argtypes = [_c_string, _c_string]
     gfso.gfs_rename.restype1 = _c_int
+
+    gfso.gfm_client_connection_and_process_acquire_by_path.argtypes = [
+        _c_string, _c_pointer_p]
+    gfso.gfm_client_connection_and_process_acquire_by_path.restype = _c_int
+    gfso.gfm_client_connection_free.argtypes = [_c_pointer]
+    gfso.gfm_client_connection_free.restype = None
+    gfso.gfm_client_username.argtypes = [_c_pointer]
+    gfso.gfm_client_username.restype = _c_string
+    gfso.gfm_client_quota_user_get.argtypes = [
+        _c_pointer, _c_string, _c_gfarm_quota_get_info_p]
+    gfso.gfm_client_quota_user_get.restype = _c_int
+    gfso.gfarm_quota_get_info_free.argtypes = [_c_gfarm_quota_get_info_p]
+    gfso.gfarm_quota_get_info_free.restype = None
+    gfso.gfs_dirquota_get.argtypes = [
+        _c_string, _c_gfarm_dirset_info_p, _c_gfarm_quota_limit_info_p,
+        _c_gfarm_quota_subject_info_p, _c_gfarm_quota_subject_time_p,
+        _c_uint64_p]
+    gfso.gfs_dirquota_get.restype = _c_int
+    gfso.gfarm_dirset_info_free.argtypes = [_c_gfarm_dirset_info_p]
+    gfso.gfarm_dirset_info_free.restype = None
     return None
 
 ##
@@ -351,12 +388,286 @@ def terminate():
     """(See Gfarm)."""
     cc = gfso.gfarm_terminate()
     assert cc == GFARM_ERR_NO_ERROR
+    _remove_stat_cache_config()
     return cc
 
 def error_string(cc):
     """Returns a string for an error code."""
     return (gfso.gfarm_error_string(cc)).decode("latin-1")
 
+##
+## Stat cache statistics.
+##
+
+## libgfarm does not tell whether a call is served from the stat
+## cache.  The calls to the caching routines are timed, and a call is
+## counted as a hit when it returns faster than a round-trip to gfmd.
+## The counts are estimates.  A count is a list [hits, misses,
+## hit_time, miss_time].
+
+cache_hit_threshold = 1e-4
+
+"""A time in seconds.  A call to a caching routine taking less than
+this is counted as a hit.  Round-trips to gfmd take a millisecond or
+more on usual sites."""
+
+_cache_counts = {"stat": [0, 0, 0.0, 0.0], "xattr": [0, 0, 0.0, 0.0]}
+
+def _count_call(c, dt):
+    if (dt < cache_hit_threshold):
+        c[0] += 1
+        c[2] += dt
+    else:
+        c[1] += 1
+        c[3] += dt
+    return None
+
+def cache_statistics():
+    """Returns the estimated counts of hits and misses of the stat
+    cache, as a dict {"stat": {...}, "xattr": {...}}.  Each entry has
+    "hits", "misses", "hit_rate", and the average times in seconds
+    "hit_time" and "miss_time" (None when there are no calls)."""
+    r = {}
+    for (k, (hits, misses, ht, mt)) in _cache_counts.items():
+        n = (hits + misses)
+        r[k] = {"hits": hits,
+                "misses": misses,
+                "hit_rate": ((hits / n) if n > 0 else None),
+                "hit_time": ((ht / hits) if hits > 0 else None),
+                "miss_time": ((mt / misses) if misses > 0 else None)}
+    return r
+
+def reset_cache_statistics():
+    for c in _cache_counts.values():
+        c[:] = [0, 0, 0.0, 0.0]
+    return None
+
+##
+## Rate governor.
+##
+
+## The governor limits the calls that reach gfmd, to keep from
+## flooding gfmd shared with other users.  It is a token bucket with
+## a ceiling rate and an AIMD (additive-increase/multiplicative-
+## decrease) controller on the rate and on a window of concurrency.
+## It takes the minimum latency of calls as a baseline, and halves the
+## rate and the window when the smoothed latency rises above the
+## baseline times a tolerance, at most once in a second.  It increases
+## them additively otherwise.  Cache hits (see cache_hit_threshold)
+## are not charged, because they do not reach gfmd.  A token is
+## charged after a call, when a call is known to be a miss, and a call
+## waits while the bucket is in debt.
+##
+## The window bounds the calls in flight by threads, but libgfarm is
+## usually called from one thread (the context is not thread-safe).
+## Concurrency is in walk, where the window bounds the directories in
+## flight in the worker processes.  The workers report the latencies
+## of their calls with the results (see observe).
+
+class _rate_governor():
+    """The state of the rate governor.  It is inactive (and costs
+    nothing) until set_rate_limit is called."""
+
+    def __init__(self):
+        self.cv = threading.Condition()
+        self.active = False
+        self.ceiling = None
+        self.adaptive = False
+        self.tolerance = 2.0
+        self.max_window = 8
+        self.min_rate = 1.0
+        self.rate_increase = 10.0
+        self.reset()
+        return
+
+    def reset(self):
+        self.rate = self.ceiling
+        self.window = float(self.max_window)
+        self.inflight = 0
+        self.tokens = 0.0
+        self.stamp = time.perf_counter()
+        self.baseline = None
+        self.smoothed = None
+        self.interval = None
+        self.last_miss = None
+        self.last_decrease = 0.0
+        self.rpcs = 0
+        self.busy = 0.0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.decreases = 0
+        return None
+
+    def refill(self, now):
+        if (self.rate != None):
+            burst = max(1.0, (self.rate * 0.1))
+            self.tokens = min(burst, (self.tokens
+                                      + (now - self.stamp) * self.rate))
+        self.stamp = now
+        return None
+
+    def admit(self):
+        with self.cv:
+            t0 = None
+            while True:
+                now = time.perf_counter()
+                self.refill(now)
+                if (self.inflight >= int(self.window)):
+                    timeout = None
+                elif (self.rate != None and self.tokens < 0.0):
+                    timeout = (-self.tokens / self.rate)
+                else:
+                    break
+                if (t0 == None):
+                    t0 = now
+                    self.waits += 1
+                self.cv.wait(timeout)
+            if (t0 != None):
+                self.wait_time += (time.perf_counter() - t0)
+            self.inflight += 1
+        return None
+
+    def settle(self, dt, miss):
+        with self.cv:
+            self.inflight -= 1
+            if (miss):
+                self.rpcs += 1
+                self.busy += dt
+                if (self.rate != None):
+                    self.tokens -= 1.0
+                if (self.adaptive):
+                    self.adapt(dt)
+            self.cv.notify_all()
+        return None
+
+    def observe(self, n, busy):
+        """Takes n calls reaching gfmd taking busy seconds in total,
+        made in another process (a worker of walk).  They adapt the
+        window but not the rate, which the process governs itself."""
+        with self.cv:
+            self.rpcs += n
+            self.busy += busy
+            if (self.adaptive and n > 0):
+                now = time.perf_counter()
+                if (self.congested(busy / n)):
+                    self.back_off(now)
+                else:
+                    self.widen()
+            self.cv.notify_all()
+        return None
+
+    def congested(self, dt):
+        ## The baseline follows upward slowly, so that a permanent
+        ## change of the server is eventually accepted.
+        if (self.baseline == None or dt < self.baseline):
+            self.baseline = dt
+        else:
+            self.baseline += ((dt - self.baseline) * 0.001)
+        self.smoothed = (dt if self.smoothed == None
+                         else (self.smoothed * 0.9 + dt * 0.1))
+        return (self.smoothed > (self.baseline * self.tolerance))
+
+    def back_off(self, now):
+        if ((now - self.last_decrease) < 1.0):
+            return False
+        self.last_decrease = now
+        self.decreases += 1
+        self.window = max(1.0, (self.window * 0.5))
+        return True
+
+    def widen(self):
+        self.window = min(float(self.max_window),
+                          (self.window + 1.0 / self.window))
+        return None
+
+    def adapt(self, dt):
+        now = time.perf_counter()
+        if (self.last_miss != None):
+            gap = (now - self.last_miss)
+            self.interval = (gap if self.interval == None
+                             else (self.interval * 0.9 + gap * 0.1))
+        self.last_miss = now
+        if (self.congested(dt)):
+            if (self.back_off(now)):
+                if (self.rate == None and self.interval != None):
+                    self.rate = (1.0 / self.interval)
+                if (self.rate != None):
+                    self.rate = max(self.min_rate, (self.rate * 0.5))
+        else:
+            self.widen()
+            if (self.rate != None):
+                r = (self.rate + self.rate_increase / self.rate)
+                if (self.ceiling != None):
+                    self.rate = min(self.ceiling, r)
+                elif (self.interval != None
+                      and r > (2.0 / self.interval)):
+                    ## Unlimited again when calls do not reach the rate.
+                    self.rate = None
+                else:
+                    self.rate = r
+        return None
+
+_governor = _rate_governor()
+
+def set_rate_limit(rate = None, adaptive = False, concurrency = None,
+                   tolerance = 2.0):
+    """Sets the rate governor.  The rate is a ceiling of calls to gfmd
+    per second (None for unlimited).  The adaptive option enables the
+    AIMD controller, which lowers the rate and the concurrency when the
+    latency of calls rises above tolerance times the baseline.  The
+    concurrency is a maximum of calls in flight by threads, and of
+    directories in flight in walk (8 when None).  The governor is
+    inactive when all of the rate, adaptive, and concurrency are not
+    specified."""
+    with _governor.cv:
+        _governor.ceiling = (float(rate) if rate != None else None)
+        _governor.adaptive = adaptive
+        _governor.max_window = (max(1, int(concurrency))
+                                if concurrency != None else 8)
+        _governor.tolerance = tolerance
+        _governor.reset()
+        _governor.active = (rate != None or adaptive
+                            or concurrency != None)
+        _governor.cv.notify_all()
+    return None
+
+def rate_governor_state():
+    """Returns the state of the rate governor as a dict.  "rate" is the
+    current allowed rate (None for unlimited), "window" is the allowed
+    concurrency, "rpcs" is a count of calls reaching gfmd (including
+    the ones by the workers of walk), "waits" and "wait_time" are a
+    count and a total time in seconds of waiting, and "decreases" is a
+    count of back-offs.  Latencies are in seconds."""
+    g = _governor
+    with g.cv:
+        return {"active": g.active,
+                "ceiling": g.ceiling,
+                "adaptive": g.adaptive,
+                "rate": g.rate,
+                "window": int(g.window),
+                "rpcs": g.rpcs,
+                "waits": g.waits,
+                "wait_time": g.wait_time,
+                "decreases": g.decreases,
+                "baseline": g.baseline,
+                "latency": g.smoothed}
+
+def _call_begin():
+    """Waits for the governor, and returns a start time of a call."""
+    if (_governor.active):
+        _governor.admit()
+    return time.perf_counter()
+
+def _call_end(c, t0):
+    """Counts a call to a caching routine in the cache statistics c,
+    or a call to an uncached routine (when c is None)."""
+    dt = (time.perf_counter() - t0)
+    if (c != None):
+        _count_call(c, dt)
+    if (_governor.active):
+        _governor.settle(dt, (c == None or dt >= cache_hit_threshold))
+    return None
+
 ##
 ## Replica information.
 ##
@@ -377,8 +688,9 @@ def _gfs_replica_info_by_name(path, flags):
     ioring of GFS_REPLICA_INFO_XXX."""
     assert_active_context()
     r = _c_pointer()
+    t0 = _call_begin()
     cc = gfso.gfs_replica_info_by_name(path, flags, ctypes.byref(r))
-    assert cc == GFARM_ERR_NO_ERROR
+    _call_end(None, t0)
     if (cc != GFARM_ERR_NO_ERROR):
         return (None, cc)
     else:
@@ -395,6 +707,20 @@ def _gfs_replica_info_by_name(path, flags):
             gfso.gfs_replica_info_free(r)
     return (host_generation_flags, cc)
 
+def replica_info(path):
+    """Returns information of the replicas of a path as a list of tuples
+    (host, generation, [incomplete, dead_host, dead_copy]), including
+    incomplete and dead ones.  The host is a string.  It returns None
+    when the operation failed."""
+    s = str(abst_path(path)).encode(name_coding)
+    flags = (GFS_REPLICA_INFO_INCLUDING_DEAD_HOST
+             | GFS_REPLICA_INFO_INCLUDING_INCOMPLETE_COPY
+             | GFS_REPLICA_INFO_INCLUDING_DEAD_COPY)
+    (ri, cc) = _gfs_replica_info_by_name(s, flags)
+    if (ri == None):
+        return (None, cc)
+    return ([(h.decode(name_coding), g, f) for (h, g, f) in ri], cc)
+
 def _gfarm_realpath_by_gfarm2fs(path):
     """???."""
     assert_active_context()
@@ -494,10 +820,12 @@ def _gfs_stat_cached(path, aboutlink = False):
     """(See Gfarm)."""
     assert_active_context()
     st = _c_gfs_stat()
+    t0 = _call_begin()
     if (aboutlink):
         cc = gfso.gfs_lstat_cached(path, ctypes.byref(st))
     else:
         cc = gfso.gfs_stat_cached(path, ctypes.byref(st))
+    _call_end(_cache_counts["stat"], t0)
     assert (cc == GFARM_ERR_NO_ERROR
             or cc == GFARM_ERR_OPERATION_NOT_PERMITTED
             or cc == GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY)
@@ -531,12 +859,13 @@ def _gfs_getxattr_cached(path, attr, aboutlink = False):
     limit = 128
     v = ctypes.create_string_buffer((limit + 1))
     size = _c_size_t(limit)
+    t0 = _call_begin()
     if (aboutlink):
         cc = gfso.gfs_lgetxattr_cached(path, attr, v, ctypes.byref(size))
-        assert (cc == GFARM_ERR_NO_ERROR or cc == GFARM_ERR_NO_SUCH_OBJECT)
     else:
         cc = gfso.gfs_getxattr_cached(path, attr, v, ctypes.byref(size))
-        assert (cc == GFARM_ERR_NO_ERROR or cc == GFARM_ERR_NO_SUCH_OBJECT)
+    _call_end(_cache_counts["xattr"], t0)
+    assert (cc == GFARM_ERR_NO_ERROR or cc == GFARM_ERR_NO_SUCH_OBJECT)
     if (cc == GFARM_ERR_NO_ERROR):
         return (v[0:size.value], cc)
     else:
@@ -551,8 +880,8 @@ def getxattr_loop(path, attr, aboutlink):
         return (a.decode(name_coding), cc)
     elif (cc == GFARM_ERR_NO_SUCH_OBJECT):
         p = path.parent
-        if (p == s):
-            (None, cc)
+        if (p == path):
+            return (None, cc)
         else:
             return getxattr_loop(p, attr, aboutlink)
     else:
@@ -579,6 +908,132 @@ def get_ncopy(path, aboutlink = False):
 ##gfs_lremovexattr
 ##gfs_removexattr
 
+##
+## Batched operations.
+##
+
+## The batched variants check the context once and encode the paths
+## up front, and then call libgfarm in a loop.  They do not check the
+## paths by abst_path, and the paths should be absolute and
+## normalized.  They do not raise assertion errors on errors, but
+## return error codes in a parallel array.
+
+class _stat_array():
+    """A holder of a contiguous array of gfs_stat filled by stat_many.
+    It frees the strings (st_user and st_group) held by the entries
+    when reclaimed.  Entries are valid only where the error code is
+    GFARM_ERR_NO_ERROR."""
+    def __init__(self, n):
+        self.a = (_c_gfs_stat * n)()
+        self.ccs = (_c_int * n)()
+        return
+    def __len__(self):
+        return len(self.a)
+    def __getitem__(self, i):
+        return self.a[i]
+    def __del__(self):
+        if (gfso != None):
+            for i in range(len(self.a)):
+                if (self.ccs[i] == GFARM_ERR_NO_ERROR):
+                    gfso.gfs_stat_free(ctypes.byref(self.a[i]))
+        else:
+            pass
+
+def _encode_paths(paths):
+    """Encodes a list of absolute path strings."""
+    ss = [p.encode(name_coding) for p in paths]
+    for s in ss:
+        assert s.startswith(b"/")
+    return ss
+
+def stat_many(paths, aboutlink = False):
+    """Calls gfs_stat_cached (or gfs_lstat_cached) on a list of path
+    strings.  It returns a pair of a _stat_array and an array of error
+    codes (the same as _stat_array.ccs).  The gfs_stat structure of
+    the i-th path is the i-th entry of _stat_array."""
+    assert_active_context()
+    ss = _encode_paths(paths)
+    sts = _stat_array(len(ss))
+    a = sts.a
+    ccs = sts.ccs
+    if (aboutlink):
+        f = gfso.gfs_lstat_cached
+    else:
+        f = gfso.gfs_stat_cached
+    byref = ctypes.byref
+    count = _cache_counts["stat"]
+    for i in range(len(ss)):
+        t0 = _call_begin()
+        ccs[i] = f(ss[i], byref(a[i]))
+        _call_end(count, t0)
+    return (sts, ccs)
+
+def _parent_path(s):
+    """Returns the parent of a byte string path, or None for the
+    root."""
+    if (s == b"/"):
+        return None
+    else:
+        p = s.rstrip(b"/").rpartition(b"/")[0]
+        return (p if p != b"" else b"/")
+
+def getxattr_many(paths, attr, aboutlink = False):
+    """Calls gfs_getxattr_cached on a list of path strings.  Like
+    getxattr, it looks up the parents until it finds an attribute.
+    The results of the lookups (of the paths without the attribute and
+    of the one where it is found) are shared in a call, so that the
+    parents are looked up once for files in a directory.  It returns a
+    pair of a list of strings (or None) and an array of error codes."""
+    assert_active_context()
+    ss = _encode_paths(paths)
+    if (aboutlink):
+        f = gfso.gfs_lgetxattr_cached
+    else:
+        f = gfso.gfs_getxattr_cached
+    limit = 128
+    v = ctypes.create_string_buffer((limit + 1))
+    size = _c_size_t(limit)
+    sizep = ctypes.byref(size)
+    count = _cache_counts["xattr"]
+    memo = {}
+    values = [None] * len(ss)
+    ccs = (_c_int * len(ss))()
+    for i in range(len(ss)):
+        s = ss[i]
+        chain = []
+        while True:
+            r = memo.get(s)
+            if (r != None):
+                break
+            size.value = limit
+            t0 = _call_begin()
+            cc = f(s, attr, v, sizep)
+            _call_end(count, t0)
+            if (cc == GFARM_ERR_NO_ERROR):
+                r = (v[0:size.value].decode(name_coding), cc)
+                memo[s] = r
+                break
+            elif (cc == GFARM_ERR_NO_SUCH_OBJECT):
+                chain.append(s)
+                s = _parent_path(s)
+                if (s == None):
+                    r = (None, cc)
+                    break
+            else:
+                r = (None, cc)
+                break
+        for c in chain:
+            memo[c] = r
+        (values[i], ccs[i]) = r
+    return (values, ccs)
+
+def get_ncopy_many(paths, aboutlink = False):
+    """Returns ncopy attribute values of a list of path strings by
+    getxattr_many.  It returns a pair of a list of integers (or None)
+    and an array of error codes."""
+    (values, ccs) = getxattr_many(paths, GFARM_EA_NCOPY, aboutlink)
+    return ([(int(n) if n != None else None) for n in values], ccs)
+
 ##
 ## Directory scanning.
 ##
@@ -632,7 +1087,9 @@ def _gfs_opendir_caching(path):
     will usually be stored in _dir."""
     assert_active_context()
     d = _c_pointer()
+    t0 = _call_begin()
     cc = gfso.gfs_opendir_caching(path, ctypes.byref(d))
+    _call_end(None, t0)
     assert cc == GFARM_ERR_NO_ERROR
     if (cc == GFARM_ERR_NO_ERROR):
         return (d, cc)
@@ -643,7 +1100,9 @@ def _gfs_readdir(d):
     """Calls gfs_readdir and returns a gfs_dirent structure or None."""
     assert_active_context()
     p = _c_gfs_dirent_p()
+    t0 = _call_begin()
     cc = gfso.gfs_readdir(d, ctypes.byref(p))
+    _call_end(_readdir_counts, t0)
     assert cc == GFARM_ERR_NO_ERROR
     if (p):
         return (p.contents, cc)
@@ -657,6 +1116,13 @@ def _gfs_closedir(d):
     assert cc == GFARM_ERR_NO_ERROR
     return (None, cc)
 
+## gfs_readdir returns entries read ahead from gfmd in chunks.  A
+## call is timed as a call to a caching routine, so that only the
+## calls reaching gfmd are charged to the governor.  The counts are
+## not reported in cache_statistics.
+
+_readdir_counts = [0, 0, 0.0, 0.0]
+
 def listdir(path):
     """Lists directory entries like os.listdir(path), but returns tuples
     of (name,ino,type).  It returns a generator."""
@@ -675,6 +1141,208 @@ def listdir(path):
                 del(dx)
                 return None
 
+def read_directory(path):
+    """Reads all the entries of a directory.  It returns a pair of a
+    list of tuples (name,ino,type) and an error code, instead of
+    raising assertion errors as listdir does.  The entries read before
+    an error are returned with the error code."""
+    assert_active_context()
+    s = str(abst_path(path)).encode(name_coding)
+    d = _c_pointer()
+    t0 = _call_begin()
+    cc = gfso.gfs_opendir_caching(s, ctypes.byref(d))
+    _call_end(None, t0)
+    if (cc != GFARM_ERR_NO_ERROR):
+        return ([], cc)
+    entries = []
+    p = _c_gfs_dirent_p()
+    try:
+        while True:
+            t0 = _call_begin()
+            cc = gfso.gfs_readdir(d, ctypes.byref(p))
+            _call_end(_readdir_counts, t0)
+            if (cc != GFARM_ERR_NO_ERROR or not p):
+                break
+            e = p.contents
+            entries.append((e.d_name[0:e.d_namlen].decode(name_coding),
+                            e.d_fileno, e.d_type))
+    finally:
+        gfso.gfs_closedir(d)
+    return (entries, cc)
+
+##
+## Tree walk.
+##
+
+## walk traverses a tree with an explicit stack of directories.  The
+## directories are listed by a pool of worker processes, because
+## libgfarm has a single context (a session to gfmd) in a process.
+## Each worker loads and initializes libgfarm, and terminates it at
+## exit.  Up to "prefetch" directories are listed ahead, and the
+## results are taken in the order of submission.  When the rate
+## governor is active in the calling process, each worker runs its
+## own governor with the ceiling divided by the number of workers, so
+## that the workers together stay under the ceiling.
+
+walk_context = "spawn"
+
+"""A start method of the worker processes of walk (see
+multiprocessing).  Workers should not inherit the session of the
+parent, so "spawn" is used by default."""
+
+def _walk_worker_init(so, coding, governor):
+    global name_coding
+    name_coding = coding
+    if (gfso == None):
+        load(so)
+    initialize()
+    if (governor != None):
+        (rate, adaptive, tolerance) = governor
+        set_rate_limit(rate, adaptive, tolerance = tolerance)
+    multiprocessing.util.Finalize(None, terminate, exitpriority=10)
+    return None
+
+def _join_path(d, name):
+    return ((d + "/" + name) if d != "/" else ("/" + name))
+
+def _entry_type(m):
+    if (GFARM_S_ISDIR(m)):
+        return "dir"
+    elif (GFARM_S_ISREG(m)):
+        return "file"
+    elif (GFARM_S_ISLNK(m)):
+        return "link"
+    else:
+        return "other"
+
+def _list_directory(path):
+    """Lists a directory and stats its entries (without following
+    symbolic links).  It returns a triple of a list of tuples
+    (name,type,size,ncopy), an error string (None on success), and a
+    pair of a count and a total time of the calls reaching gfmd (for
+    the governor of the calling process of walk).  Entries removed
+    meanwhile are skipped."""
+    g = _governor
+    (n0, b0) = (g.rpcs, g.busy)
+    (es, cc) = read_directory(path)
+    if (cc != GFARM_ERR_NO_ERROR):
+        return ([], error_string(cc), ((g.rpcs - n0), (g.busy - b0)))
+    names = [n for (n, ino, t) in es if n != "." and n != ".."]
+    (sts, ccs) = stat_many([_join_path(path, n) for n in names], True)
+    entries = []
+    for i in range(len(names)):
+        if (ccs[i] == GFARM_ERR_NO_ERROR):
+            st = sts.a[i]
+            entries.append((names[i], _entry_type(st.st_mode),
+                            st.st_size, st.st_ncopy))
+    return (entries, None, ((g.rpcs - n0), (g.busy - b0)))
+
+def _worker_governor(workers):
+    """Returns the settings of the governor of a worker of walk as a
+    tuple (rate,adaptive,tolerance), or None when the governor is
+    inactive."""
+    g = _governor
+    with g.cv:
+        if (not (g.ceiling != None or g.adaptive)):
+            return None
+        rate = ((g.ceiling / workers) if g.ceiling != None else None)
+        return (rate, g.adaptive, g.tolerance)
+
+def walk(path, workers = 4, prefetch = 16, onerror = None):
+    """Traverses a tree and yields tuples (path,type,size,ncopy) for
+    the entries under the path, where type is one of "dir", "file",
+    "link", and "other", and ncopy is the count of replicas.  A
+    directory is yielded before its entries, but the order is not
+    sorted.  Directories are listed by "workers" processes, or in the
+    calling process (which should be initialized) when workers is 0.
+    The workers follow the rate governor of the calling process (see
+    set_rate_limit), and the directories in flight are bounded by the
+    window of the governor as well as by prefetch.
+    onerror is called with a path and an error string for a directory
+    that cannot be listed.  It returns a generator."""
+    top = str(abst_path(path))
+    pool = None
+    if (workers > 0):
+        ctx = multiprocessing.get_context(walk_context)
+        pool = ctx.Pool(workers, _walk_worker_init,
+                        (so_name, name_coding, _worker_governor(workers)))
+    stack = [top]
+    pending = collections.deque()
+    completed = False
+    try:
+        while (len(stack) != 0 or len(pending) != 0):
+            limit = max(1, prefetch)
+            if (pool != None and _governor.active):
+                limit = max(1, min(limit, int(_governor.window)))
+            while (len(stack) != 0 and len(pending) < limit):
+                d = stack.pop()
+                if (pool != None):
+                    r = pool.apply_async(_list_directory, (d,))
+                else:
+                    r = None
+                pending.append((d, r))
+            (d, r) = pending.popleft()
+            if (r != None):
+                (entries, error, (n, busy)) = r.get()
+                if (_governor.active):
+                    _governor.observe(n, busy)
+            else:
+                (entries, error, _) = _list_directory(d)
+            if (error != None):
+                if (onerror != None):
+                    onerror(d, error)
+                continue
+            subdirs = []
+            for (name, kind, size, ncopy) in entries:
+                p = _join_path(d, name)
+                yield (p, kind, size, ncopy)
+                if (kind == "dir"):
+                    subdirs.append(p)
+            stack.extend(reversed(subdirs))
+        completed = True
+    finally:
+        if (pool != None):
+            if (completed):
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+    return None
+
+def du(path, workers = 4, prefetch = 16, onerror = None):
+    """Sums up sizes in a tree by walk.  It yields tuples
+    (path,files,size,replica_size) for the path and the directories
+    under it, where the values include the subdirectories.  size is
+    the sum of the sizes of files, and replica_size is the sum of the
+    sizes times the counts of replicas (the space used in Gfarm).
+    Subdirectories are yielded before their parents, after the
+    traversal ends.  It returns a generator."""
+    top = str(abst_path(path))
+    order = [top]
+    parents = {top: None}
+    totals = {top: [0, 0, 0]}
+    for (p, kind, size, ncopy) in walk(top, workers, prefetch, onerror):
+        d = p.rpartition("/")[0]
+        d = (d if d != "" else "/")
+        if (kind == "dir"):
+            order.append(p)
+            parents[p] = d
+            totals[p] = [0, 0, 0]
+        elif (kind == "file"):
+            t = totals[d]
+            t[0] += 1
+            t[1] += size
+            t[2] += (size * ncopy)
+    for d in reversed(order):
+        t = totals[d]
+        yield (d, t[0], t[1], t[2])
+        if (parents[d] != None):
+            u = totals[parents[d]]
+            u[0] += t[0]
+            u[1] += t[1]
+            u[2] += t[2]
+    return None
+
 ##
 ## Control to file stat operations.
 ##
@@ -704,6 +1372,87 @@ def enable_stat_cache():
     _gfarm_xattr_caching_pattern_add(GFARM_EA_REPATTR)
     return None
 
+def set_stat_cache_expiration(seconds):
+    """Sets the expiration time of entries in the stat cache by
+    gfs_stat_cache_expiration_set (it takes milliseconds).  The
+    initial value is attr_cache_timeout in the configuration."""
+    assert_active_context()
+    gfso.gfs_stat_cache_expiration_set(int(seconds * 1000))
+    return None
+
+def clear_stat_cache():
+    """Drops all entries in the stat cache by gfs_stat_cache_clear."""
+    assert_active_context()
+    gfso.gfs_stat_cache_clear()
+    return None
+
+def expire_stat_cache():
+    """Drops expired entries in the stat cache by
+    gfs_stat_cache_expire."""
+    assert_active_context()
+    gfso.gfs_stat_cache_expire()
+    return None
+
+## The capacity of the stat cache is fixed at initialization by
+## attr_cache_limit (entries) in the configuration.  It can only be
+## changed by a configuration file.  A user configuration file is
+## specified by GFARM_CONFIG_FILE (~/.gfarm2rc by default), and the
+## first setting of a parameter takes effect.
+
+_stat_cache_config = None
+
+"""A pair of a temporary configuration file made by
+configure_stat_cache and the previous value of GFARM_CONFIG_FILE."""
+
+def configure_stat_cache(limit = None, timeout = None):
+    """Sets the capacity (in entries) and the expiration (in seconds)
+    of the stat cache.  Call it before initialize.  It makes a
+    temporary configuration file with attr_cache_limit and
+    attr_cache_timeout followed by the contents of the user
+    configuration file, and sets GFARM_CONFIG_FILE to it.  The file is
+    removed by terminate, or at exit when terminate is not called."""
+    global _stat_cache_config
+    lines = []
+    if (limit != None):
+        lines.append("attr_cache_limit " + str(int(limit)) + "\n")
+    if (timeout != None):
+        lines.append("attr_cache_timeout "
+                     + str(int(timeout * 1000)) + "\n")
+    if (len(lines) == 0):
+        return None
+    _remove_stat_cache_config()
+    previous = os.environ.get("GFARM_CONFIG_FILE")
+    user = (previous if previous != None
+            else os.path.expanduser("~/.gfarm2rc"))
+    try:
+        with open(user, "rb") as f:
+            contents = f.read()
+    except FileNotFoundError:
+        contents = b""
+    (fd, name) = tempfile.mkstemp(prefix="gfarm2rc-")
+    with os.fdopen(fd, "wb") as f:
+        f.write("".join(lines).encode("ascii"))
+        f.write(contents)
+    os.environ["GFARM_CONFIG_FILE"] = name
+    _stat_cache_config = (name, previous)
+    atexit.register(_remove_stat_cache_config)
+    return None
+
+def _remove_stat_cache_config():
+    global _stat_cache_config
+    if (_stat_cache_config != None):
+        (name, previous) = _stat_cache_config
+        _stat_cache_config = None
+        if (previous != None):
+            os.environ["GFARM_CONFIG_FILE"] = previous
+        else:
+            del os.environ["GFARM_CONFIG_FILE"]
+        try:
+            os.unlink(name)
+        except FileNotFoundError:
+            pass
+    return None
+
 ##
 ## File operations (removing).
 ##
@@ -711,7 +1460,9 @@ def enable_stat_cache():
 def _gfs_link(src, dst):
     """(See Gfarm)."""
     assert_active_context()
+    t0 = _call_begin()
     cc = gfso.gfs_link(src, dst)
+    _call_end(None, t0)
     assert (cc == GFARM_ERR_NO_ERROR
             or cc == GFARM_ERR_OPERATION_NOT_PERMITTED
             or cc == GFARM_ERR_ALREADY_EXISTS)
@@ -720,7 +1471,9 @@ def _gfs_link(src, dst):
 def _gfs_unlink(path):
     """"(See Gfarm)."""
     assert_active_context()
+    t0 = _call_begin()
     cc = gfso.gfs_unlink(path)
+    _call_end(None, t0)
     assert (cc == GFARM_ERR_NO_ERROR
             or cc == GFARM_ERR_OPERATION_NOT_PERMITTED
             or cc == GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY
@@ -746,7 +1499,9 @@ def unlink(path):
 def _gfs_mkdir(path, mode):
     """(See Gfarm)."""
     assert_active_context()
+    t0 = _call_begin()
     cc = gfso.gfs_mkdir(path, mode)
+    _call_end(None, t0)
     assert (cc == GFARM_ERR_NO_ERROR
             or cc == GFARM_ERR_OPERATION_NOT_PERMITTED
             or cc == GFARM_ERR_ALREADY_EXISTS)
@@ -755,7 +1510,9 @@ def _gfs_mkdir(path, mode):
 def _gfs_rmdir(path):
     """(See Gfarm)."""
     assert_active_context()
+    t0 = _call_begin()
     cc = gfso.gfs_rmdir(path)
+    _call_end(None, t0)
     ##print(cc)
     assert (cc == GFARM_ERR_NO_ERROR
             or cc == GFARM_ERR_OPERATION_NOT_PERMITTED
@@ -780,7 +1537,9 @@ def rmdir(path):
 def _gfs_rename(src, dst):
     """(See Gfarm)."""
     assert_active_context()
+    t0 = _call_begin()
     cc = gfso.gfs_rename(src, dst)
+    _call_end(None, t0)
     assert (cc == GFARM_ERR_NO_ERROR
             or cc == GFARM_ERR_OPERATION_NOT_PERMITTED
             or cc == GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY)
@@ -795,6 +1554,152 @@ def rename(src, dst):
     cc = _gfs_rename(s0, s1)
     return cc
 
+##
+## Quota.
+##
+
+## The structures are of "gfm_proto.h" and "gfs_quota.h".  A quota
+## value GFARM_QUOTA_INVALID (-1) means not set (unlimited), and it is
+## returned as None.  Space is in bytes.  "phy_space" counts the space
+## used by all replicas.
+
+GFARM_QUOTA_INVALID = -1
+
+##struct gfarm_quota_get_info {
+##      char *name;
+##      gfarm_int64_t grace_period;
+##      gfarm_int64_t space, space_grace, space_soft, space_hard;
+##      gfarm_int64_t num, num_grace, num_soft, num_hard;
+##      gfarm_int64_t phy_space, phy_space_grace, phy_space_soft,
+##              phy_space_hard;
+##      gfarm_int64_t phy_num, phy_num_grace, phy_num_soft, phy_num_hard;
+##};
+
+_quota_fields = ["space", "space_grace", "space_soft", "space_hard",
+                 "num", "num_grace", "num_soft", "num_hard",
+                 "phy_space", "phy_space_grace", "phy_space_soft",
+                 "phy_space_hard",
+                 "phy_num", "phy_num_grace", "phy_num_soft", "phy_num_hard"]
+
+class _c_gfarm_quota_get_info(ctypes.Structure):
+    _fields_ = ([("name", _c_pointer), ("grace_period", _c_int64)]
+                + [(f, _c_int64) for f in _quota_fields])
+
+_c_gfarm_quota_get_info_p = ctypes.POINTER(_c_gfarm_quota_get_info)
+
+##struct gfarm_dirset_info { char *username; char *dirsetname; };
+##struct gfarm_quota_subject_info {
+##      gfarm_uint64_t space, num, phy_space, phy_num;
+##};
+##struct gfarm_quota_subject_time {
+##      gfarm_int64_t space_time, num_time, phy_space_time, phy_num_time;
+##};
+##struct gfarm_quota_limit_info {
+##      gfarm_int64_t grace_period;
+##      struct gfarm_quota_subject_info soft, hard;
+##};
+
+class _c_gfarm_dirset_info(ctypes.Structure):
+    _fields_ = [("username", _c_string), ("dirsetname", _c_string)]
+
+class _c_gfarm_quota_subject_info(ctypes.Structure):
+    _fields_ = [("space", _c_int64), ("num", _c_int64),
+                ("phy_space", _c_int64), ("phy_num", _c_int64)]
+
+class _c_gfarm_quota_subject_time(ctypes.Structure):
+    _fields_ = [("space_time", _c_int64), ("num_time", _c_int64),
+                ("phy_space_time", _c_int64), ("phy_num_time", _c_int64)]
+
+class _c_gfarm_quota_limit_info(ctypes.Structure):
+    _fields_ = [("grace_period", _c_int64),
+                ("soft", _c_gfarm_quota_subject_info),
+                ("hard", _c_gfarm_quota_subject_info)]
+
+_c_gfarm_dirset_info_p = ctypes.POINTER(_c_gfarm_dirset_info)
+_c_gfarm_quota_subject_info_p = ctypes.POINTER(_c_gfarm_quota_subject_info)
+_c_gfarm_quota_subject_time_p = ctypes.POINTER(_c_gfarm_quota_subject_time)
+_c_gfarm_quota_limit_info_p = ctypes.POINTER(_c_gfarm_quota_limit_info)
+_c_uint64_p = ctypes.POINTER(_c_uint64)
+
+def _quota_value(v):
+    return (v if v != GFARM_QUOTA_INVALID else None)
+
+def user_quota(path):
+    """Returns the quota of the user on the gfmd serving a path as a
+    dict with the keys "user", "grace_period", and the ones in
+    _quota_fields (None when not set).  It returns None when the
+    operation failed."""
+    assert_active_context()
+    s = str(abst_path(path)).encode(name_coding)
+    conn = _c_pointer()
+    t0 = _call_begin()
+    cc = gfso.gfm_client_connection_and_process_acquire_by_path(
+        s, ctypes.byref(conn))
+    _call_end(None, t0)
+    if (cc != GFARM_ERR_NO_ERROR):
+        return (None, cc)
+    try:
+        user = gfso.gfm_client_username(conn)
+        qi = _c_gfarm_quota_get_info()
+        t0 = _call_begin()
+        cc = gfso.gfm_client_quota_user_get(conn, user, ctypes.byref(qi))
+        _call_end(None, t0)
+        if (cc != GFARM_ERR_NO_ERROR):
+            return (None, cc)
+        q = {"user": user.decode(name_coding),
+             "grace_period": _quota_value(qi.grace_period)}
+        for f in _quota_fields:
+            q[f] = _quota_value(getattr(qi, f))
+        gfso.gfarm_quota_get_info_free(ctypes.byref(qi))
+        return (q, cc)
+    finally:
+        gfso.gfm_client_connection_free(conn)
+
+def directory_quota(path):
+    """Returns the directory quota (of the dirset) of a path, which is
+    set by "gfarm.directory_quota" (GFARM_EA_DIRECTORY_QUOTA) on a top
+    directory.  It returns a dict with the keys "dirset"
+    ("user:dirset"), "space", "num", "phy_space", "phy_num" for the
+    usage and the ones suffixed by "_soft" and "_hard" for the limits
+    (None when not set).  It returns None with GFARM_ERR_NO_SUCH_OBJECT
+    when the path is not in a dirset."""
+    assert_active_context()
+    s = str(abst_path(path)).encode(name_coding)
+    ds = _c_gfarm_dirset_info()
+    limit = _c_gfarm_quota_limit_info()
+    usage = _c_gfarm_quota_subject_info()
+    grace = _c_gfarm_quota_subject_time()
+    flags = _c_uint64()
+    t0 = _call_begin()
+    cc = gfso.gfs_dirquota_get(s, ctypes.byref(ds), ctypes.byref(limit),
+                               ctypes.byref(usage), ctypes.byref(grace),
+                               ctypes.byref(flags))
+    _call_end(None, t0)
+    if (cc != GFARM_ERR_NO_ERROR):
+        return (None, cc)
+    q = {"dirset": ((ds.username or b"").decode(name_coding) + ":"
+                    + (ds.dirsetname or b"").decode(name_coding))}
+    gfso.gfarm_dirset_info_free(ctypes.byref(ds))
+    for f in ["space", "num", "phy_space", "phy_num"]:
+        q[f] = _quota_value(getattr(usage, f))
+        q[f + "_soft"] = _quota_value(getattr(limit.soft, f))
+        q[f + "_hard"] = _quota_value(getattr(limit.hard, f))
+    return (q, cc)
+
+##
+## Asyncio facade.
+##
+
+## An asyncio facade is in "gfarm_aio.py".  It is imported lazily by a
+## reference to gfarm.aio (module __getattr__ needs Python 3.7 or
+## later; import gfarm_aio directly with older versions).
+
+def __getattr__(name):
+    if (name == "aio"):
+        import gfarm_aio
+        return gfarm_aio
+    raise AttributeError("module 'gfarm' has no attribute " + repr(name))
+
 ## Copyright (C) 2020-2021 RIKEN
 ## This library is distributed WITHOUT ANY WARRANTY.  This library can be
 ## redistributed and/or modified under the terms of the BSD 2-Clause License.
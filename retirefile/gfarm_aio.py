@@ -0,0 +1,194 @@
+## gfarm_aio.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""An asyncio facade over gfarm.py.  It is also accessible as
+gfarm.aio (with Python 3.7 or later).  libgfarm is not thread-safe
+and its context is global, so a session runs all the calls on a
+single dedicated thread, which calls initialize at the start and
+terminate at the end.  Coroutines queue calls to the thread and await
+the results, and the event loop is not blocked during round trips to
+gfmd.  The number of calls in flight (queued or running) is capped by
+the concurrency of a session.  The values are the same as the ones of
+gfarm.py, a pair of a value and an error code."""
+
+## Usage:
+## async with gfarm_aio.Session() as s:
+##     (st, cc) = await s.stat("/home/user/file")
+##     async for (name, ino, type) in s.listdir("/home/user"):
+##         ...
+
+import asyncio
+import queue
+import threading
+
+import gfarm
+
+concurrency = 64
+
+"""A default cap of the number of calls in flight in a session."""
+
+listdir_chunk = 256
+
+"""A number of directory entries read at once by listdir."""
+
+class SessionClosedError(Exception):
+    pass
+
+class Session():
+    """A session of libgfarm owned by a dedicated thread.  start loads
+    libgfarm (when not yet loaded) and initializes it on the thread,
+    and close terminates it on the thread.  It can be used by "async
+    with".  Only one session should be active in a process.  The
+    event loop and the cap are bound at start (by the running loop)."""
+
+    def __init__(self, so = "libgfarm.so", concurrency = concurrency):
+        self.so = so
+        self.concurrency = concurrency
+        self.loop = None
+        self.limit = None
+        self.requests = queue.Queue()
+        self.thread = None
+        self.closed = False
+        return
+
+    def run(self):
+        """The body of the thread.  It runs requests (a function, the
+        arguments, and a future) until it gets None."""
+        while True:
+            r = self.requests.get()
+            if (r == None):
+                break
+            (f, args, future) = r
+            try:
+                v = f(*args)
+            except BaseException as e:
+                self.loop.call_soon_threadsafe(_set_exception, future, e)
+            else:
+                self.loop.call_soon_threadsafe(_set_result, future, v)
+        return None
+
+    def submit(self, f, *args):
+        """Queues a call to the thread and returns a future."""
+        if (self.closed or self.thread == None):
+            raise SessionClosedError()
+        future = self.loop.create_future()
+        self.requests.put((f, args, future))
+        return future
+
+    async def call(self, f, *args):
+        """Calls f(*args) on the thread under the concurrency cap."""
+        async with self.limit:
+            return await self.submit(f, *args)
+
+    async def start(self):
+        """Starts the thread and initializes libgfarm on it.  When loading
+        or initializing fails, it stops the thread before raising the
+        error, because __aexit__ is not called then."""
+        self.loop = asyncio.get_running_loop()
+        self.limit = asyncio.Semaphore(self.concurrency)
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="gfarm-aio")
+        self.thread.start()
+        try:
+            await self.submit(_initialize, self.so)
+        except BaseException:
+            self.requests.put(None)
+            await self.loop.run_in_executor(None, self.thread.join)
+            self.thread = None
+            raise
+        return self
+
+    async def close(self):
+        """Terminates libgfarm on the thread after the queued calls, and
+        stops the thread."""
+        if (self.closed or self.thread == None):
+            return None
+        future = self.submit(gfarm.terminate)
+        self.closed = True
+        self.requests.put(None)
+        try:
+            await future
+        finally:
+            await self.loop.run_in_executor(None, self.thread.join)
+            self.thread = None
+        return None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    async def stat(self, path, aboutlink = False):
+        """See gfarm.stat."""
+        return await self.call(gfarm.stat, path, aboutlink)
+
+    async def getxattr(self, path, attr, aboutlink = False):
+        """See gfarm.getxattr."""
+        return await self.call(gfarm.getxattr, path, attr, aboutlink)
+
+    async def get_ncopy(self, path, aboutlink = False):
+        """See gfarm.get_ncopy."""
+        return await self.call(gfarm.get_ncopy, path, aboutlink)
+
+    async def unlink(self, path):
+        """See gfarm.unlink."""
+        return await self.call(gfarm.unlink, path)
+
+    async def rename(self, src, dst):
+        """See gfarm.rename."""
+        return await self.call(gfarm.rename, src, dst)
+
+    async def stat_many(self, paths, aboutlink = False):
+        """See gfarm.stat_many.  It takes one slot of the cap."""
+        return await self.call(gfarm.stat_many, paths, aboutlink)
+
+    async def listdir(self, path, chunk = None):
+        """An async generator of tuples (name,ino,type) as
+        gfarm.listdir.  Entries are read by chunks on the thread.  The
+        generator of gfarm.listdir is made, advanced, and closed on the
+        thread, also when the iteration is abandoned (the event loop
+        calls aclose of an abandoned async generator)."""
+        n = (chunk if chunk != None else listdir_chunk)
+        g = await self.call(gfarm.listdir, path)
+        done = False
+        try:
+            while (not done):
+                es = await self.call(_read_entries, g, n)
+                done = (len(es) < n)
+                for e in es:
+                    yield e
+        finally:
+            if (not done and not self.closed):
+                await self.call(g.close)
+
+def _set_result(future, v):
+    if (not future.cancelled()):
+        future.set_result(v)
+    return None
+
+def _set_exception(future, e):
+    if (not future.cancelled()):
+        future.set_exception(e)
+    return None
+
+def _initialize(so):
+    if (gfarm.gfso == None):
+        gfarm.load(so)
+    return gfarm.initialize()
+
+def _read_entries(g, n):
+    """Reads at most n entries from a generator of gfarm.listdir.  It
+    closes the generator at the end."""
+    es = []
+    for e in g:
+        es.append(e)
+        if (len(es) >= n):
+            return es
+    g.close()
+    return es
+
+## Copyright (C) 2026 RIKEN
+## This library is distributed WITHOUT ANY WARRANTY.  This library can be
+## redistributed and/or modified under the terms of the BSD 2-Clause License.
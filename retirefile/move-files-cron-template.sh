@@ -28,9 +28,17 @@ docopy() {
     echo ${conf}
     export GFARM_CONFIG_FILE=${conf}
     gfpcopy -P ${src} gfarm://${dst}
-    retirefile.py --verbose --summary ${src} ${dst}/${dir}
+    retirefile.py --summary --events events_${id}.jsonl \
+        --time-budget 3000 --cursor cursor_${id}.json ${src} ${dst}/${dir}
 }
 
+## A run of retirefile.py stops in 50 minutes not to overlap the next
+## run (for hourly runs).  The next run resumes from the position
+## saved in "cursor_hpciNNNNNN.json".
+
+## Decisions on files are recorded in "events_hpciNNNNNN.jsonl" as
+## JSON lines, instead of "[OK]" lines of --verbose in "log.txt".
+
 filter() {
     tee -a log.txt | grep -v '^\[OK\]'
 }
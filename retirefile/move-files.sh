@@ -6,14 +6,28 @@
 ## messages to a logging file and the logger.  The environment variable
 ## "GFLIB" is used to specify the place of "libgfarm.so".
 
+## An optional third argument "i/N" runs the i-th of N shards, which
+## are partitioned by the top-level subdirectories of the local
+## directory (the top-level files are in the shard 0).  Shards can run
+## on different nodes sharing the local filesystem.  A mutex is taken
+## for each shard, and retirefile.py holds a lease for the shard.
+
+## The quota of the destination is checked by quota-preflight.py
+## before copying.  It does not copy when the files not yet copied in
+## the local directory (or in a top-level entry of a shard) do not fit
+## in the remaining quota.  Files copied earlier and waiting for
+## retirement are not counted.  retirefile.py runs even when copying
+## is refused, so that retired files release the quota.  The quota
+## state is kept in a temporary file during a run.
+
 log="ftp.debug"
 
 ##
 ## Check the arguments and the environment setting.
 ##
 
-if [ "$#" -ne 2 ]; then
-    echo "Usage: ksh move-files.sh local remote"
+if [ "$#" -ne 2 -a "$#" -ne 3 ]; then
+    echo "Usage: ksh move-files.sh local remote [i/N]"
     exit 1
 fi
 if [ -z "${GFLIB}" ]; then
@@ -24,8 +38,16 @@ fi
 
 src=$1
 dst=$2
+shard=$3
 dir=`basename $1`
-mutex=gfarm://${dst}/${dir}/_move_files_in_progress_
+if [ -z "${shard}" ]; then
+    mutex=gfarm://${dst}/${dir}/_move_files_in_progress_
+else
+    i=${shard%/*}
+    n=${shard#*/}
+    mutex=gfarm://${dst}/${dir}/_move_files_in_progress_${i}of${n}_
+    gfmkdir -p gfarm://${dst}/${dir} > /dev/null 2>&1
+fi
 
 ##
 ## Take a mutex on the remote directory.
@@ -35,16 +57,41 @@ if ! gfmkdir ${mutex} > /dev/null 2>&1; then
     echo "Mutexing failed.  Some other move-files.sh running."
     exit 1
 fi
-trap "gfrmdir ${mutex}; trap - EXIT; exit" INT TERM EXIT
+quotastate=/tmp/move-files-quota.$$
+trap "gfrmdir ${mutex}; rm -f ${quotastate}; trap - EXIT; exit" INT TERM EXIT
 
 docopy() {
     date +"%Y-%m-%dT%H:%M:%S%z"
-    gfpcopy -P ${src} gfarm://${dst}
+    if quota-preflight.py ${lib} --local ${src} \
+            --remote ${dst}/${dir} ${dst}; then
+        gfpcopy -P ${src} gfarm://${dst}
+    else
+        echo "Not copying ${src}: quota exceeded or not obtained."
+    fi
     retirefile.py ${lib} --verbose --summary ${src} ${dst}/${dir}
 }
 
+doshard() {
+    date +"%Y-%m-%dT%H:%M:%S%z"
+    retirefile.py --shard-members ${shard} ${src} | while read -r x; do
+        if ! quota-preflight.py ${lib} --state ${quotastate} \
+                --local "${src}/${x}" --remote "${dst}/${dir}/${x}" \
+                ${dst}/${dir}; then
+            echo "Not copying ${src}/${x}: quota exceeded or not obtained."
+            continue
+        fi
+        gfpcopy -P "${src}/${x}" gfarm://${dst}/${dir}
+    done
+    retirefile.py ${lib} --verbose --summary --shard ${shard} \
+        ${src} ${dst}/${dir}
+}
+
 ##
 ## Do moving.
 ##
 
-docopy 2>&1 | tee >(logger -p ${log})
+if [ -z "${shard}" ]; then
+    docopy 2>&1 | tee >(logger -p ${log})
+else
+    doshard 2>&1 | tee >(logger -p ${log})
+fi
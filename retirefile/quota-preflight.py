@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+## quota-preflight.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""quota-preflight.py checks the remaining quota of a destination in
+Gfarm before transferring data.  It reads the user quota and the
+directory quota (of the dirset of the destination), and compares the
+remaining space and file counts with the bytes to transfer, which are
+given by a number, by a walk of a local directory, or by groups of an
+index-file of file-courier.  It refuses (or trims groups) when they do
+not fit.  The quota state and the bytes reserved by earlier checks are
+kept in a state file, so that checks of many groups in a run call
+gfmd only once."""
+
+## Usage:
+## quota-preflight.py --so libgfarm.so --local srcdir \
+##   --remote /home/hpNNNNNN/dst/srcdir /home/hpNNNNNN/dst
+## quota-preflight.py --so libgfarm.so --state /tmp/xxxx.quota \
+##   --index index.txt --groups 0 9 /home/hpNNNNNN/dst
+## It exits with 0 when all fit, 2 when groups are trimmed (it prints
+## the last group that fits), 3 when nothing fits, and 4 when the
+## quota cannot be obtained from gfmd.
+
+import os
+import sys
+import time
+import json
+import argparse
+import gfarm
+
+use_soft_limits = False
+
+"""An option to take soft limits as the limits instead of hard
+limits."""
+
+state_timeout = 3600.0
+
+"""A time in seconds to reuse the quota state in a state file."""
+
+per_file_overhead = 128
+
+"""Bytes added for each file in an index-file, for the headers of a
+zip archive (in addition to twice the length of the name)."""
+
+time_drift = 5.0
+
+"""A time in seconds of a tolerance to compare mtimes of local and
+remote files (see retirefile.py)."""
+
+class QuotaState():
+    """The quota state of a destination.  It holds the user quota and
+    the directory quota as returned by gfarm.user_quota and
+    gfarm.directory_quota (None when not available), the ncopy setting
+    of the destination to estimate the space of replicas, and the
+    bytes and the files reserved by earlier checks."""
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.fetched = None
+        self.user = None
+        self.dirset = None
+        self.ncopy = 1
+        self.reserved_bytes = 0
+        self.reserved_files = 0
+        return
+
+    def fetch(self):
+        """Fetches the quota state from gfmd.  It returns None on
+        success, or an error message when some call fails.  A missing
+        dirset (or a missing ncopy setting) is not an error.  The
+        state is left unfetched on errors."""
+        (user, cc) = gfarm.user_quota(self.destination)
+        if (cc != gfarm.GFARM_ERR_NO_ERROR):
+            return ("user quota: " + gfarm.error_string(cc))
+        (dirset, cc) = gfarm.directory_quota(self.destination)
+        if (cc == gfarm.GFARM_ERR_NO_SUCH_OBJECT):
+            dirset = None
+        elif (cc != gfarm.GFARM_ERR_NO_ERROR):
+            return ("directory quota: " + gfarm.error_string(cc))
+        (nc, cc) = gfarm.get_ncopy(self.destination)
+        if (cc == gfarm.GFARM_ERR_NO_SUCH_OBJECT):
+            nc = None
+        elif (cc != gfarm.GFARM_ERR_NO_ERROR):
+            return ("ncopy: " + gfarm.error_string(cc))
+        self.user = user
+        self.dirset = dirset
+        self.ncopy = (nc if nc != None else 1)
+        self.fetched = time.time()
+        return None
+
+    def load(self, path):
+        """Loads a state file, when it is for the same destination and
+        it is not older than state_timeout.  It returns true when
+        loaded."""
+        try:
+            with open(path, "r") as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return False
+        if (d.get("destination") != self.destination
+            or (time.time() - d.get("fetched", 0)) > state_timeout):
+            return False
+        for k in ["fetched", "user", "dirset", "ncopy",
+                  "reserved_bytes", "reserved_files"]:
+            setattr(self, k, d[k])
+        return True
+
+    def save(self, path):
+        tmp = (path + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"destination": self.destination,
+                       "fetched": self.fetched,
+                       "user": self.user,
+                       "dirset": self.dirset,
+                       "ncopy": self.ncopy,
+                       "reserved_bytes": self.reserved_bytes,
+                       "reserved_files": self.reserved_files}, f)
+        os.replace(tmp, path)
+        return None
+
+    def remaining(self):
+        """Returns a triple of the remaining bytes, the remaining space of
+        replicas, and the remaining files, after the reservations.  A
+        value is None when unlimited."""
+        suffix = ("_soft" if use_soft_limits else "_hard")
+        rs = [None, None, None]
+        for q in [self.user, self.dirset]:
+            if (q == None):
+                continue
+            for (i, f) in enumerate(["space", "phy_space", "num"]):
+                limit = q.get(f + suffix)
+                if (limit == None):
+                    continue
+                left = (limit - (q.get(f) or 0))
+                rs[i] = (left if rs[i] == None else min(rs[i], left))
+        reserved = [self.reserved_bytes,
+                    (self.reserved_bytes * self.ncopy),
+                    self.reserved_files]
+        return [((r - x) if r != None else None)
+                for (r, x) in zip(rs, reserved)]
+
+    def fits(self, nbytes, nfiles):
+        (space, phy_space, num) = self.remaining()
+        return ((space == None or nbytes <= space)
+                and (phy_space == None or (nbytes * self.ncopy) <= phy_space)
+                and (num == None or nfiles <= num))
+
+    def reserve(self, nbytes, nfiles):
+        self.reserved_bytes += nbytes
+        self.reserved_files += nfiles
+        return None
+
+def local_usage(path, remote=None):
+    """Returns a pair of the bytes and the count of files in a local
+    directory (or of a file).  Symbolic links are not followed.  When
+    remote (the counterpart of path in Gfarm) is given, it counts only
+    the files that are absent in Gfarm or differ in the size or the
+    mtime, that is, the files gfpcopy would copy.  Files copied
+    earlier and waiting for retirement are not counted again."""
+    nbytes = 0
+    nfiles = 0
+    if (os.path.isdir(path)):
+        tree = os.walk(path)
+    else:
+        tree = [(os.path.dirname(path), [], [os.path.basename(path)])]
+    for (d, dirs, files) in tree:
+        sts = []
+        for n in files:
+            try:
+                sts.append((n, os.lstat(os.path.join(d, n))))
+            except OSError:
+                continue
+        if (remote != None and len(sts) != 0):
+            if (os.path.isdir(path)):
+                rd = os.path.normpath(os.path.join(remote,
+                                                   os.path.relpath(d, path)))
+            else:
+                rd = os.path.dirname(remote)
+            (rsts, ccs) = gfarm.stat_many([os.path.join(rd, n)
+                                           for (n, _) in sts])
+            sts = [(n, st) for (i, (n, st)) in enumerate(sts)
+                   if not (ccs[i] == gfarm.GFARM_ERR_NO_ERROR
+                           and same_file(st, rsts[i]))]
+        for (n, st) in sts:
+            nbytes += st.st_size
+            nfiles += 1
+    return (nbytes, nfiles)
+
+def same_file(st, rst):
+    """Checks a remote file has the same size and mtime as a local
+    one."""
+    mtimer = gfarm.timespec_to_float(rst.st_mtimespec)
+    return (rst.st_size == st.st_size
+            and abs(mtimer - st.st_mtime) <= time_drift)
+
+def index_usage(path, n0, n1):
+    """Returns a list of triples (group, bytes, files) for the groups n0
+    to n1 (inclusive) in an index-file made by make-index.sh.  Alias
+    lines are not counted."""
+    usage = {}
+    group = None
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.rstrip(b"\n")
+            if (len(line) == 4 and line.isdigit()):
+                group = int(line)
+            elif (line.startswith(b"=\t") or group == None):
+                continue
+            elif (n0 <= group <= n1):
+                (size, sep, name) = line.partition(b" ")
+                u = usage.setdefault(group, [0, 0])
+                u[0] += (int(size) + per_file_overhead + 2 * len(name))
+                u[1] += 1
+    return [(g, usage.get(g, [0, 0])[0], usage.get(g, [0, 0])[1])
+            for g in range(n0, n1 + 1)]
+
+def format_remaining(state):
+    names = ["bytes", "replica_bytes", "files"]
+    return " ".join((n + "=" + (str(v) if v != None else "unlimited"))
+                    for (n, v) in zip(names, state.remaining()))
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description='''
+quota-preflight.py checks the quota of a destination in Gfarm before
+transferring data.''')
+    p.add_argument('destination', type=str,
+                   help='destination directory in Gfarm')
+    p.add_argument('--so', dest='so', type=str, action='store',
+                   default="libgfarm.so",
+                   help='use the so file instead of libgfarm.so')
+    p.add_argument('--state', dest='state', type=str, action='store',
+                   default=None, metavar='FILE',
+                   help='keep the quota state and reservations in FILE')
+    p.add_argument('--soft', dest='soft', action='store_const',
+                   const=True, default=False,
+                   help='check against soft limits')
+    p.add_argument('--bytes', dest='nbytes', type=int, action='store',
+                   default=None, help='bytes to transfer')
+    p.add_argument('--files', dest='nfiles', type=int, action='store',
+                   default=1, help='files to transfer (with --bytes)')
+    p.add_argument('--local', dest='local', type=str, action='store',
+                   default=None, metavar='DIR',
+                   help='transfer a local directory')
+    p.add_argument('--remote', dest='remote', type=str, action='store',
+                   default=None, metavar='DIR',
+                   help=('the counterpart of --local in Gfarm, to count'
+                         ' only files not yet copied'))
+    p.add_argument('--index', dest='index', type=str, action='store',
+                   default=None, metavar='FILE',
+                   help='transfer groups in an index-file')
+    p.add_argument('--groups', dest='groups', type=int, nargs=2,
+                   default=None, metavar=('N0', 'N1'),
+                   help='groups in the index-file (inclusive)')
+    args = p.parse_args()
+    use_soft_limits = args.soft
+    if (args.index != None):
+        if (args.groups == None):
+            print("--index needs --groups", file=sys.stderr)
+            sys.exit(1)
+        items = index_usage(args.index, args.groups[0], args.groups[1])
+    elif (args.local != None):
+        items = None
+    elif (args.nbytes != None):
+        items = [(None, args.nbytes, args.nfiles)]
+    else:
+        p.print_help()
+        sys.exit(1)
+    destination = str(gfarm.abst_path(args.destination))
+    state = QuotaState(destination)
+    reuse = (args.state != None and state.load(args.state))
+    if (not reuse or args.remote != None):
+        gfarm.load(args.so)
+        gfarm.initialize()
+        try:
+            if (not reuse):
+                error = state.fetch()
+                if (error != None):
+                    print(("Quota not obtained for " + destination + ": "
+                           + error), file=sys.stderr)
+                    sys.exit(4)
+            if (items == None):
+                remote = (str(gfarm.abst_path(args.remote))
+                          if args.remote != None else None)
+                items = [(None,) + local_usage(args.local, remote)]
+        finally:
+            gfarm.terminate()
+    elif (items == None):
+        items = [(None,) + local_usage(args.local)]
+    last = None
+    refused = None
+    for (g, nbytes, nfiles) in items:
+        if (not state.fits(nbytes, nfiles)):
+            refused = (g, nbytes, nfiles)
+            break
+        state.reserve(nbytes, nfiles)
+        last = g
+    if (args.state != None):
+        state.save(args.state)
+    if (refused != None):
+        (g, nbytes, nfiles) = refused
+        print(("Quota exceeded" + (" at group " + str(g) if g != None else "")
+               + ": needs bytes=" + str(nbytes) + " files=" + str(nfiles)
+               + ", remaining " + format_remaining(state)),
+              file=sys.stderr)
+    if (last != None):
+        print("%04d" % last, file=sys.stdout)
+    if (refused == None):
+        sys.exit(0)
+    elif (items[0][0] != None and last != None):
+        sys.exit(2)
+    else:
+        sys.exit(3)
@@ -27,13 +27,31 @@ sites."""
 
 import types
 import os
+import ctypes
 import sys
 import time
 import argparse
 import datetime
 import traceback
+import json
+import zlib
+import socket
+import threading
+import queue
+import heapq
+import struct
+import itertools
+import sqlite3
 import gfarm
 
+## NumPy is optional.  It is used to evaluate the conditions on the
+## files in a directory at once.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 dryrun = False
 
 """An option to skip unlinking local files."""
@@ -51,6 +69,11 @@ print_summary = False
 
 """An option to print operation summary."""
 
+events_file = None
+
+"""A file to write decisions in JSON lines (an option --events).  It
+is None when not specified, and then events are not formatted."""
+
 time_to_stabilize = (30.0 * 60.0)
 
 """A time in seconds to allow removal of local files.  It needs to
@@ -65,19 +88,187 @@ mtime, and a near-zero value is acceptable.  But, the conversion from
 a tv value to a float may use different routines for local and remote
 files."""
 
+stat_cache_limit = None
+
+"""A capacity of the stat cache of libgfarm in entries.  It is None to
+use the value in the Gfarm configuration (attr_cache_limit, 40000 by
+default).  It should exceed the number of files in a directory to
+reuse entries while checking a directory."""
+
+stat_cache_timeout = None
+
+"""An expiration time of entries in the stat cache in seconds.  It is
+None to use the value in the Gfarm configuration (attr_cache_timeout,
+1 second by default)."""
+
+max_rpc_rate = None
+
+"""A ceiling of calls to gfmd per second.  It is None for unlimited.
+See gfarm.set_rate_limit."""
+
+adaptive_rate = False
+
+"""An option to lower the rate of calls to gfmd when the latency of
+calls rises.  See gfarm.set_rate_limit."""
+
+shard = None
+
+"""A pair (i, n) to work on the i-th shard of n shards (an option
+--shard i/n), or None to work on the whole tree.  A tree is
+partitioned by hashing the names of the top-level subdirectories.
+The top-level files belong to the shard 0."""
+
+lease_dir = None
+
+"""A directory to place lease files of shards.  It is None to use the
+parent of the source directory.  It should be visible from all the
+nodes running shards."""
+
+lease_timeout = (10.0 * 60.0)
+
+"""A time in seconds for a lease of a shard to expire without a
+heartbeat.  A heartbeat is sent by a third of the time.  The clocks
+of the nodes should be synchronized within a fraction of it."""
+
+adopt_shards = False
+
+"""An option to also work on the other shards whose leases have
+expired (whose nodes crashed)."""
+
+use_pipeline = False
+
+"""An option to run scanning, checking, and unlinking in the pipeline
+of threads."""
+
+batch_size = 4096
+
+"""A maximum number of files checked at once.  A larger directory is
+checked in batches."""
+
+pipeline_depth = 4
+
+"""A capacity of the queues between the stages of the pipeline, in
+batches."""
+
+prune_empty_dirs = False
+
+"""An option to remove empty local directories bottom-up, when they
+are not modified for time_to_stabilize.  The top-level directory is
+not removed."""
+
+replica_readiness = False
+
+"""An option to allow removal of files before time_to_stabilize, when
+complete replicas are placed on distinct hosts as many as the
+requested count (ncopy).  Incomplete replicas, dead copies, and
+replicas on dead hosts are not counted."""
+
+required_groups = 1
+
+"""A number of distinct host groups (such as sites) required to hold
+complete replicas in replica_readiness."""
+
+host_groups = None
+
+"""A dict mapping host names to group names (an option --host-groups).
+When it is None, the group of a host is its domain name (the host
+name without the first label)."""
+
+time_budget = None
+
+"""A time in seconds a run may take (an option --time-budget).  A run
+stops cleanly after it, and saves the position of the traversal in
+cursor_file.  It is None for unlimited."""
+
+cursor_file = None
+
+"""A file to keep the positions of traversals between runs (an option
+--cursor).  A run resumes after the saved position, and wraps around
+at the end of a tree."""
+
+remote_snapshot = None
+
+"""A file of a metadata listing of the destination (an option
+--remote-snapshot).  The conditions are evaluated on the states in
+the listing instead of calling gfmd, and only the files selected to
+remove are confirmed by stat calls.  See open_snapshot."""
+
+snapshot_index = None
+
+"""A connection to the index (sqlite3) made from remote_snapshot."""
+
+free_target = None
+
+"""A target of free space of the local filesystem (an option
+--free-target).  It is a pair ("percent", usage) to stop when the
+usage falls to the percentage, or ("bytes", n) to stop when n bytes
+are available.  When set, files are removed largest first.  See
+retire_largest_first."""
+
 class GfarmException(Exception):
     def __init__(self, cc_):
         self.cc = cc_
 
+class LeaseLostException(Exception):
+    pass
+
+## Messages and events are written from the threads of the pipeline.
+
+_output_lock = threading.Lock()
+
 def verbose_message(s):
     if (be_verbose):
-        print(s, file=sys.stdout)
+        with _output_lock:
+            print(s, file=sys.stdout)
     else:
         pass
     return None
 
 def warning_message(s):
-    print(s, file=sys.stdout)
+    with _output_lock:
+        print(s, file=sys.stdout)
+    return None
+
+def open_events(path):
+    """Opens a file for events with a large buffer.  Events are written
+    by write_event, one JSON object in a line."""
+    global events_file
+    events_file = open(path, "a", buffering=(1024 * 1024))
+    return None
+
+def close_events():
+    global events_file
+    if (events_file != None):
+        events_file.close()
+        events_file = None
+    return None
+
+def write_event(path, action, rst=None, nc=None, flags=None, ready=None):
+    """Writes a decision on a file as a JSON object.  The action is one
+    of "unlink", "unlink_failed", "skip", "dryrun", "missing", and
+    "unknown_ncopy".  rst, nc, and flags (a tuple of times in seconds
+    and the conditions) are None when the remote state is not
+    obtained.  ready is None when replicas are not checked.
+    Call it after checking events_file is not None, to avoid making
+    the arguments."""
+    e = {"path": str(path), "action": action}
+    if (rst != None):
+        e["size"] = rst.st_size
+        e["ncopy"] = rst.st_ncopy
+    if (nc != None):
+        e["ncopy_required"] = nc
+    if (flags != None):
+        (mtimer, ctimer, replicas_created, sufficiently_old,
+         mtime_unmodified) = flags
+        e["ctime"] = ctimer
+        e["mtime"] = mtimer
+        e["replicas_created"] = replicas_created
+        e["sufficiently_old"] = sufficiently_old
+        e["mtime_unmodified"] = mtime_unmodified
+    if (ready != None):
+        e["replicas_ready"] = ready
+    with _output_lock:
+        events_file.write(json.dumps(e) + "\n")
     return None
 
 ## Operation summary information.
@@ -86,12 +277,28 @@ summary_counters = types.SimpleNamespace()
 summary_counters.retire_begin = None
 summary_counters.retire_end = None
 summary_counters.removed = 0
+summary_counters.removed_bytes = 0
 summary_counters.skipped = 0
 summary_counters.unremovable = 0
 summary_counters.missing = 0
 summary_counters.gfarm_error = 0
 summary_counters.state_unobtainable = 0
 summary_counters.directories = None
+summary_counters.stat_cache = None
+summary_counters.rate_governor = None
+summary_counters.shards = []
+summary_counters.pipeline = []
+summary_counters.scanned_directories = 0
+summary_counters.scan_time = 0.0
+summary_counters.pruned_directories = 0
+summary_counters.readiness_checked = 0
+summary_counters.readiness_ready = 0
+summary_counters.traversals = []
+summary_counters.snapshot_entries = 0
+summary_counters.snapshot_lookups = 0
+summary_counters.snapshot_confirmed = 0
+summary_counters.snapshot_rejected = 0
+summary_counters.free_targets = []
 
 def dump_summary():
     print(("retire_time: " + str(summary_counters.retire_begin)
@@ -113,23 +320,264 @@ def dump_summary():
           file=sys.stdout)
     print(("unknown_state_files: " + str(summary_counters.state_unobtainable)),
           file=sys.stdout)
+    if (summary_counters.stat_cache != None):
+        for (k, c) in summary_counters.stat_cache.items():
+            print(("stat_cache_" + k + ": "
+                   + "hits=" + str(c["hits"])
+                   + " misses=" + str(c["misses"])
+                   + " hit_rate=" + format_float(c["hit_rate"], 3)
+                   + " hit_time_us=" + format_float(c["hit_time"], 1, 1e6)
+                   + " miss_time_us=" + format_float(c["miss_time"], 1, 1e6)),
+                  file=sys.stdout)
+    for (src, status, freed, candidates, dt) in summary_counters.free_targets:
+        print(("free_target: " + format_free_target(free_target)
+               + " " + str(src) + " " + status
+               + " freed_bytes=" + str(freed)
+               + " candidates=" + str(candidates)
+               + " time=" + format_float(dt, 3)),
+              file=sys.stdout)
+    if (remote_snapshot != None):
+        print(("remote_snapshot: "
+               + "entries=" + str(summary_counters.snapshot_entries)
+               + " lookups=" + str(summary_counters.snapshot_lookups)
+               + " confirmed=" + str(summary_counters.snapshot_confirmed)
+               + " rejected=" + str(summary_counters.snapshot_rejected)),
+              file=sys.stdout)
+    if (replica_readiness):
+        print(("replicas_ready_files: "
+               + str(summary_counters.readiness_ready) + " of "
+               + str(summary_counters.readiness_checked) + " checked"),
+              file=sys.stdout)
+    if (prune_empty_dirs):
+        n = summary_counters.scanned_directories
+        average = ((summary_counters.scan_time / n) if n > 0 else 0.0)
+        print(("pruned_directories: "
+               + str(summary_counters.pruned_directories)),
+              file=sys.stdout)
+        print(("scan_time_saved: "
+               + format_float((average
+                               * summary_counters.pruned_directories), 3)
+               + " (estimated per run, "
+               + format_float(average * 1e3, 3) + " ms per directory)"),
+              file=sys.stdout)
+    stages = {}
+    for st in summary_counters.pipeline:
+        r = stages.setdefault(st.name, [0.0, 0, 0, 0, 0, 0])
+        r[0] += st.busy
+        r[1] += st.batches
+        r[2] += st.files
+        r[3] = max(r[3], st.depth_max)
+        r[4] += st.depth_sum
+        r[5] += (st.batches + 1)
+    for (name, r) in stages.items():
+        print(("pipeline_" + name + ": "
+               + "busy=" + format_float(r[0], 3)
+               + " batches=" + str(r[1])
+               + " files=" + str(r[2])
+               + ((" queue_max=" + str(r[3])
+                   + " queue_avg=" + format_float((r[4] / r[5]), 2))
+                  if name != "scan" else "")),
+              file=sys.stdout)
+    for (key, status, position) in summary_counters.traversals:
+        print(("traversal: " + key + " " + status
+               + ((" at " + "/".join(name for (kind, name) in position))
+                  if position != None else "")),
+              file=sys.stdout)
+    for (src, k, n, status) in summary_counters.shards:
+        print(("shard: " + str(k) + "/" + str(n) + " " + str(src)
+               + " " + status),
+              file=sys.stdout)
+    g = summary_counters.rate_governor
+    if (g != None and g["active"]):
+        print(("rate_governor: "
+               + "ceiling=" + format_float(g["ceiling"], 1)
+               + " rate=" + format_float(g["rate"], 1)
+               + " window=" + str(g["window"])
+               + " rpcs=" + str(g["rpcs"])
+               + " waits=" + str(g["waits"])
+               + " wait_time=" + format_float(g["wait_time"], 3)
+               + " backoffs=" + str(g["decreases"])
+               + " baseline_ms=" + format_float(g["baseline"], 3, 1e3)
+               + " latency_ms=" + format_float(g["latency"], 3, 1e3)),
+              file=sys.stdout)
     pass
 
+def format_float(v, digits, scale=1):
+    return (("%." + str(digits) + "f") % (v * scale) if v != None else "-")
+
 ## (stat.st_mtime is float).
 
-def check_condition(path, lst, nc, rst, message=True):
-    """Checks the condition of removing a source file.  Note that gfpcopy
-    sets mtime.  It uses ctime for the oldness test."""
-    now = time.time()
-    mtimel = lst.st_mtime
-    mtimer = gfarm.timespec_to_float(rst.st_mtimespec)
-    ctimer = gfarm.timespec_to_float(rst.st_ctimespec)
-    replicas_created = (rst.st_ncopy >= nc)
-    sufficiently_old = ((ctimer + time_to_stabilize) < now)
-    mtime_unmodified = (abs(mtimer - mtimel) <= time_drift)
-    if (message):
-        verbose_message(
-            "[OK] "
+def _stat_dtype():
+    """Returns a NumPy dtype to view the fields of an array of
+    gfarm._c_gfs_stat that are used in the conditions."""
+    st = gfarm._c_gfs_stat
+    tv = gfarm._c_gfarm_timespec
+    mt = st.st_mtimespec.offset
+    ct = st.st_ctimespec.offset
+    return numpy.dtype({
+        "names": ["size", "ncopy", "mtime_sec", "mtime_nsec",
+                  "ctime_sec", "ctime_nsec"],
+        "formats": ["=i8", "=u8", "=i8", "=u4", "=i8", "=u4"],
+        "offsets": [st.st_size.offset, st.st_ncopy.offset,
+                    (mt + tv.tv_sec.offset), (mt + tv.tv_nsec.offset),
+                    (ct + tv.tv_sec.offset), (ct + tv.tv_nsec.offset)],
+        "itemsize": ctypes.sizeof(st)})
+
+def _evaluate_numpy(mtimel, sts, ccs, ncs, now):
+    """Evaluates the conditions with NumPy.  See evaluate_conditions."""
+    r = numpy.frombuffer(sts.a, dtype=_stat_dtype())
+    found = (numpy.frombuffer(ccs, dtype=numpy.intc)
+             == gfarm.GFARM_ERR_NO_ERROR)
+    nc = numpy.array([(v if v != None else -1) for v in ncs],
+                     dtype=numpy.int64)
+    valid = (found & (nc >= 0))
+    assert numpy.all(r["mtime_nsec"][valid] < 1000000000), "bad nsec range"
+    assert numpy.all(r["ctime_nsec"][valid] < 1000000000), "bad nsec range"
+    mtimer = (r["mtime_sec"] * 1000000000 + r["mtime_nsec"])
+    ctimer = (r["ctime_sec"] * 1000000000 + r["ctime_nsec"])
+    mtimel = numpy.array(mtimel, dtype=numpy.int64)
+    replicas_created = (r["ncopy"].astype(numpy.int64) >= nc)
+    sufficiently_old = ((ctimer + int(time_to_stabilize * 1e9)) < now)
+    mtime_unmodified = (numpy.abs(mtimer - mtimel)
+                        <= int(time_drift * 1e9))
+    return (valid, mtimer, ctimer,
+            replicas_created, sufficiently_old, mtime_unmodified)
+
+def _stat_columns(sts):
+    """Returns the fields of an array of gfarm._c_gfs_stat that are
+    used in the conditions as lists (ncopy, mtime_sec, mtime_nsec,
+    ctime_sec, ctime_nsec).  The fields are read by strided views of
+    the array as _stat_dtype does with NumPy."""
+    st = gfarm._c_gfs_stat
+    tv = gfarm._c_gfarm_timespec
+    mt = st.st_mtimespec.offset
+    ct = st.st_ctimespec.offset
+    b = memoryview(sts.a).cast("B")
+    k = ctypes.sizeof(st)
+    def column(offset, code):
+        w = struct.calcsize(code)
+        assert (offset % w) == 0 and (k % w) == 0, "unaligned field"
+        return b.cast(code)[(offset // w)::(k // w)].tolist()
+    return (column(st.st_ncopy.offset, "Q"),
+            column((mt + tv.tv_sec.offset), "q"),
+            column((mt + tv.tv_nsec.offset), "I"),
+            column((ct + tv.tv_sec.offset), "q"),
+            column((ct + tv.tv_nsec.offset), "I"))
+
+def _evaluate_python(mtimel, sts, ccs, ncs, now):
+    """Evaluates the conditions without NumPy.  The fields are taken as
+    columns by _stat_columns, and nsec ranges are checked once per
+    batch.  See evaluate_conditions."""
+    n = len(mtimel)
+    stabilize = int(time_to_stabilize * 1e9)
+    drift = int(time_drift * 1e9)
+    ok = gfarm.GFARM_ERR_NO_ERROR
+    valid = [(cc == ok and nc != None) for (cc, nc) in zip(ccs, ncs)]
+    if (n == 0):
+        return (valid, [], [], [], [], [])
+    (ncopy, msec, mnsec, csec, cnsec) = _stat_columns(sts)
+    assert max(itertools.compress(mnsec, valid), default=0) < 1000000000, \
+        "bad nsec range"
+    assert max(itertools.compress(cnsec, valid), default=0) < 1000000000, \
+        "bad nsec range"
+    mtimer = [(s * 1000000000 + ns) for (s, ns) in zip(msec, mnsec)]
+    ctimer = [(s * 1000000000 + ns) for (s, ns) in zip(csec, cnsec)]
+    replicas_created = [(v and c >= nc)
+                        for (v, c, nc) in zip(valid, ncopy, ncs)]
+    sufficiently_old = [((t + stabilize) < now) for t in ctimer]
+    mtime_unmodified = [(abs(r - l) <= drift)
+                        for (r, l) in zip(mtimer, mtimel)]
+    return (valid, mtimer, ctimer,
+            replicas_created, sufficiently_old, mtime_unmodified)
+
+def evaluate_conditions(mtimel, sts, ccs, ncs, now):
+    """Evaluates the conditions of removing source files at once.  It
+    takes a list of local mtimes, a _stat_array and error codes
+    returned by gfarm.stat_many, a list of ncopy settings (None when
+    unknown), and the current time.  Times are integers in nanoseconds
+    to avoid rounding.  It returns a tuple of arrays (or lists) (valid,
+    mtimer, ctimer, replicas_created, sufficiently_old,
+    mtime_unmodified), where valid is true when the remote state is
+    obtained.  Note that gfpcopy sets mtime.  It uses ctime for the
+    oldness test.  It uses NumPy if available."""
+    if (numpy != None):
+        return _evaluate_numpy(mtimel, sts, ccs, ncs, now)
+    else:
+        return _evaluate_python(mtimel, sts, ccs, ncs, now)
+
+def select_files(conditions, ready=None):
+    """Returns a list of indices of files to remove from a value
+    returned by evaluate_conditions, and a dict of files whose
+    replicas are ready (returned by check_readiness)."""
+    (valid, mtimer, ctimer, replicas_created, sufficiently_old,
+     mtime_unmodified) = conditions
+    if (dryrun):
+        return []
+    elif (numpy != None):
+        mask = (valid & replicas_created & sufficiently_old
+                & mtime_unmodified)
+        selected = numpy.flatnonzero(mask).tolist()
+    else:
+        selected = [i for i in range(len(valid))
+                    if (valid[i] and replicas_created[i]
+                        and sufficiently_old[i] and mtime_unmodified[i])]
+    early = ([i for (i, v) in ready.items() if v]
+             if ready != None else [])
+    return (sorted(selected + early) if len(early) != 0 else selected)
+
+def host_group(h):
+    if (host_groups != None):
+        return host_groups.get(h, h)
+    else:
+        (first, sep, rest) = h.partition(".")
+        return (rest if rest != "" else h)
+
+def load_host_groups(path):
+    """Reads a file of lines "host group".  Lines starting with "#" are
+    comments."""
+    groups = {}
+    with open(path, "r") as f:
+        for line in f:
+            ws = line.split()
+            if (len(ws) == 0 or ws[0].startswith("#")):
+                continue
+            elif (len(ws) != 2):
+                raise Exception("Bad line in host groups: " + line.strip())
+            groups[ws[0]] = ws[1]
+    return groups
+
+def replicas_ready(path, nc):
+    """Checks complete replicas of a file are placed on nc distinct hosts
+    (and on required_groups distinct groups).  It calls
+    gfs_replica_info_by_name (not cached)."""
+    (ri, cc) = gfarm.replica_info(path)
+    if (ri == None):
+        return False
+    hosts = set(h for (h, gen, (incomplete, dead_host, dead_copy)) in ri
+                if not (incomplete or dead_host or dead_copy))
+    groups = set(host_group(h) for h in hosts)
+    return (len(hosts) >= nc and len(groups) >= required_groups)
+
+def check_readiness(paths, ncs, conditions):
+    """Checks the replicas of the files which satisfy the conditions but
+    are not old enough.  It returns a dict of indices to a flag of
+    readiness."""
+    (valid, mtimer, ctimer, replicas_created, sufficiently_old,
+     mtime_unmodified) = conditions
+    ready = {}
+    for i in range(len(paths)):
+        if (valid[i] and replicas_created[i] and mtime_unmodified[i]
+            and not sufficiently_old[i]):
+            ready[i] = replicas_ready(paths[i], ncs[i])
+            summary_counters.readiness_checked += 1
+            if (ready[i]):
+                summary_counters.readiness_ready += 1
+    return ready
+
+def condition_message(path, rst, nc, flags):
+    (mtimer, ctimer, replicas_created, sufficiently_old,
+     mtime_unmodified) = flags
+    return ("[OK] "
             + str(path)
             + " size=" + str(rst.st_size)
             + " ncopy=" + str(rst.st_ncopy) + "/" + str(nc)
@@ -138,91 +586,1047 @@ def check_condition(path, lst, nc, rst, message=True):
             + " replicas_created=" + str(replicas_created)
             + ", " + "sufficiently_old=" + str(sufficiently_old)
             + ", " + "mtime_unmodified=" + str(mtime_unmodified))
+
+def remote_path(dst, name):
+    """Joins a name to a remote directory path (normalized)."""
+    return ((dst + "/" + name) if dst != "/" else ("/" + name))
+
+def entry_kind(di):
+    """Returns "file" for an os.DirEntry to check, "dir" for a
+    subdirectory, or None to ignore.  It treats regular files and
+    symbol links in the same way (when os.DirEntry.is_file)."""
+    if (di.is_symlink() and ignore_links):
+        return None
+    elif (di.is_file(follow_symlinks=False) or di.is_symlink()):
+        return "file"
+    elif (di.is_dir(follow_symlinks=False)):
+        return "dir"
     else:
-        pass
-    return ((not dryrun)
-            and (replicas_created and sufficiently_old and mtime_unmodified))
+        return None
 
-def retire(src, dst):
-    """Removes files in the source if they have replicas.  It takes a pair
-    of source and destination directories.  It treats regular files
-    and symbol links in the same way (when os.DirEntry.is_file).  Note
-    os.scandir allows to remove found files safely."""
-    verbose_message("[OK] " + "Retiring: " + src + " to " + dst)
-    some_missing = False
+def scan_directory(src):
+    """Lists a local directory.  It returns a pair of a list of
+    os.DirEntry of files to check and a list of names of
+    subdirectories."""
+    files = []
+    dirs = []
+    ##with os.scandir(src) as entries:
+    entries = os.scandir(src)
+    for di in entries:
+        k = entry_kind(di)
+        if (k == "file"):
+            files.append(di)
+        elif (k == "dir"):
+            dirs.append(di.name)
+        else:
+            pass
+    return (files, dirs)
+
+def walk_batches(src, dst, top=False):
+    """Yields batches (src, dst, files, done) for the directories in a
+    tree in pre-order, where files is a list of os.DirEntry and done is
+    None (see retire_batches).  A large
+    directory is split into batches of batch_size files, and it yields
+    while scanning a directory to bound the memory use.  It yields an
+    empty list for a directory without files.  It checks the lease at
+    each directory.  When prune_empty_dirs, it yields a marker after
+    the batches of a directory and its subdirectories (except for the
+    top one), whose done function prunes the directory (see
+    prune_directory)."""
+    if (active_lease != None and active_lease.lost):
+        raise LeaseLostException()
+    t0 = time.perf_counter()
+    prunable = (prune_empty_dirs and not top and not dryrun
+                and is_stable_directory(src))
+    files = []
+    names = []
+    yielded = False
     ##with os.scandir(src) as entries:
     entries = os.scandir(src)
     for di in entries:
-            if (di.is_symlink() and ignore_links):
+        k = entry_kind(di)
+        if (k == "file"):
+            files.append(di)
+            if (len(files) >= batch_size):
+                yield (src, dst, files, None)
+                yielded = True
+                files = []
+        elif (k == "dir"):
+            names.append(di.name)
+        else:
+            pass
+    summary_counters.scanned_directories += 1
+    summary_counters.scan_time += (time.perf_counter() - t0)
+    if (len(files) != 0 or not yielded):
+        yield (src, dst, files, None)
+    for n in names:
+        yield from walk_batches(os.path.join(src, n), remote_path(dst, n))
+    if (prunable):
+        yield (None, None, None, _pruner(src))
+    return None
+
+def is_stable_directory(src):
+    """Checks the mtime of a directory (before removing its entries) is
+    older than time_to_stabilize, that is, no entries were added or
+    removed by others for a while."""
+    try:
+        st = os.stat(src, follow_symlinks=False)
+    except OSError:
+        return False
+    return ((st.st_mtime + time_to_stabilize) < time.time())
+
+def prune_directory(src):
+    """Removes a directory if it is empty.  It is called by a marker
+    batch after the files in the directory are processed (by the
+    unlinker in the pipeline), and subdirectories are pruned before
+    their parent.  It fails when some entries remain.  It returns true
+    on success."""
+    try:
+        os.rmdir(src)
+    except OSError:
+        return False
+    verbose_message("[OK] Prune: " + str(src))
+    summary_counters.pruned_directories += 1
+    return True
+
+def _pruner(src):
+    return (lambda: prune_directory(src))
+
+def local_mtimes(files):
+    """Returns mtimes of local files in nanoseconds.  It follows
+    symbolic links as gfarm.stat does."""
+    return [di.stat().st_mtime_ns for di in files]
+
+def check_files(src, dst, files, mtimel):
+    """Checks the files in a batch.  It takes a pair of source and
+    destination directories, a list of os.DirEntry in the source, and
+    a list of their mtimes.  It obtains the remote states of the files
+    at once by gfarm.stat_many and gfarm.get_ncopy_many, and evaluates
+    the conditions at once.  It returns a pair of a flag of missing
+    files and a checked batch, which is a tuple (files, paths, sts,
+    ncs, conditions, selected)."""
+    if (be_verbose):
+        verbose_message("[OK] " + "Retiring: " + src + " to " + dst)
+    some_missing = False
+    n = len(files)
+    if (n == 0):
+        return (some_missing, None)
+    paths = [remote_path(dst, di.name) for di in files]
+    if (snapshot_index != None):
+        (sts, ccs, ncs) = snapshot_states(paths)
+    else:
+        (sts, ccs) = gfarm.stat_many(paths)
+        ncs = [None] * n
+    found = []
+    for i in range(n):
+        cc = ccs[i]
+        if (cc == gfarm.GFARM_ERR_NO_ERROR):
+            found.append(i)
+        elif (cc == gfarm.GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY):
+            warning_message(
+                "Skipping a local file: " + str(files[i].name)
+                + ": " + gfarm.error_string(cc))
+            some_missing = (some_missing | True)
+            summary_counters.missing += 1
+            if (events_file != None):
+                write_event(files[i].path, "missing")
+        else:
+            summary_counters.gfarm_error += 1
+    if (snapshot_index != None):
+        ## ncopy settings omitted in the snapshot are looked up.
+        found = [i for i in found if ncs[i] == None]
+    (vs, nccs) = gfarm.get_ncopy_many([paths[i] for i in found])
+    for k in range(len(found)):
+        i = found[k]
+        cc = nccs[k]
+        if (cc == gfarm.GFARM_ERR_NO_ERROR):
+            ncs[i] = vs[k]
+        elif (cc == gfarm.GFARM_ERR_NO_SUCH_OBJECT):
+            warning_message(
+                "No replica setting found: " + str(files[i].name)
+                + ": " + gfarm.error_string(cc))
+            summary_counters.state_unobtainable += 1
+            if (events_file != None):
+                write_event(files[i].path, "unknown_ncopy", sts[i])
+        else:
+            summary_counters.gfarm_error += 1
+
+    now = int(time.time() * 1e9)
+    conditions = evaluate_conditions(mtimel, sts, ccs, ncs, now)
+    ready = (check_readiness(paths, ncs, conditions)
+             if replica_readiness else {})
+    selected = select_files(conditions, ready)
+    if (snapshot_index != None and len(selected) != 0):
+        selected = confirm_states(paths, mtimel, sts, ncs, conditions,
+                                  selected, ready)
+    valid = conditions[0]
+    summary_counters.skipped += (int(sum(valid)) - len(selected))
+    return (some_missing,
+            (files, paths, sts, ncs, conditions, selected, ready))
+
+## Remote snapshot.
+
+## A snapshot is a text file of lines
+## "path<TAB>size<TAB>ncopy<TAB>mtime<TAB>ctime[<TAB>ncopy_required]",
+## where a path is absolute in Gfarm (in name_coding of gfarm.py), and
+## times are seconds since the epoch with optional fractions (up to
+## nanoseconds).  ncopy is a count of replicas, and ncopy_required is
+## the setting applied to the file (the "gfarm.ncopy" attribute of the
+## file or the nearest ancestor).  When ncopy_required is omitted or
+## "-", it is looked up by gfarm.get_ncopy_many (cached calls).  Lines
+## starting with "#" are ignored.  A listing can be made on the server
+## side, for example, from a dump of the metadata.  The snapshot is
+## loaded into an index in a file (the snapshot name with ".index"),
+## which is reused while it is newer than the snapshot.  Files missing
+## in the snapshot are treated as missing in the destination.
+
+def parse_snapshot_time(v):
+    """Converts seconds in a decimal string to integer nanoseconds
+    without rounding."""
+    (sec, dot, frac) = v.partition(".")
+    return (int(sec) * 1000000000 + int((frac + "000000000")[:9]))
+
+def build_snapshot_index(path, index):
+    """Loads a snapshot into an index.  It makes the index under a
+    temporary name and renames it."""
+    tmp = (index + ".tmp")
+    if (os.path.exists(tmp)):
+        os.unlink(tmp)
+    db = sqlite3.connect(tmp)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("CREATE TABLE files (path TEXT PRIMARY KEY,"
+               " size INTEGER, ncopy INTEGER, mtime INTEGER,"
+               " ctime INTEGER, ncopy_required INTEGER) WITHOUT ROWID")
+    insert = ("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)")
+    rows = []
+    with open(path, "rb") as f:
+        for (lineno, line) in enumerate(f, 1):
+            line = line.rstrip(b"\r\n")
+            if (line == b"" or line.startswith(b"#")):
+                continue
+            ws = line.decode(gfarm.name_coding).split("\t")
+            if (len(ws) < 5 or len(ws) > 6 or not ws[0].startswith("/")):
+                db.close()
+                os.unlink(tmp)
+                raise Exception("Bad line in a snapshot: " + path
+                                + ":" + str(lineno))
+            nc = (int(ws[5]) if (len(ws) == 6 and ws[5] != "-")
+                  else None)
+            rows.append((str(gfarm.abst_path(ws[0])), int(ws[1]),
+                         int(ws[2]), parse_snapshot_time(ws[3]),
+                         parse_snapshot_time(ws[4]), nc))
+            if (len(rows) >= 10000):
+                db.executemany(insert, rows)
+                rows = []
+    db.executemany(insert, rows)
+    db.commit()
+    db.close()
+    os.replace(tmp, index)
+    return None
+
+def open_snapshot(path):
+    """Opens the index of a snapshot, after making it if it does not
+    exist or it is older than the snapshot."""
+    global snapshot_index
+    index = (path + ".index")
+    try:
+        stale = (os.stat(index).st_mtime_ns < os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        stale = True
+    if (stale):
+        verbose_message("[OK] Indexing a snapshot: " + path)
+        build_snapshot_index(path, index)
+    snapshot_index = sqlite3.connect(index)
+    (n,) = snapshot_index.execute("SELECT COUNT(*) FROM files").fetchone()
+    summary_counters.snapshot_entries = n
+    return None
+
+def close_snapshot():
+    global snapshot_index
+    if (snapshot_index != None):
+        snapshot_index.close()
+        snapshot_index = None
+    return None
+
+def snapshot_states(paths):
+    """Looks up a list of paths in the snapshot.  It returns a triple of
+    a _stat_array and an array of error codes (as gfarm.stat_many),
+    and a list of ncopy settings (None when unknown).  Missing paths
+    have GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY."""
+    n = len(paths)
+    sts = gfarm._stat_array(n)
+    ccs = sts.ccs
+    ncs = [None] * n
+    rows = {}
+    for k in range(0, n, 500):
+        chunk = paths[k:(k + 500)]
+        q = ("SELECT * FROM files WHERE path IN ("
+             + ",".join(["?"] * len(chunk)) + ")")
+        for r in snapshot_index.execute(q, chunk):
+            rows[r[0]] = r
+    summary_counters.snapshot_lookups += n
+    for i in range(n):
+        r = rows.get(paths[i])
+        if (r == None):
+            ccs[i] = gfarm.GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY
+            continue
+        (_, size, ncopy, mtime, ctime, nc) = r
+        st = sts.a[i]
+        st.st_size = size
+        st.st_ncopy = ncopy
+        st.st_mtimespec.tv_sec = (mtime // 1000000000)
+        st.st_mtimespec.tv_nsec = (mtime % 1000000000)
+        st.st_ctimespec.tv_sec = (ctime // 1000000000)
+        st.st_ctimespec.tv_nsec = (ctime % 1000000000)
+        ccs[i] = gfarm.GFARM_ERR_NO_ERROR
+        ncs[i] = nc
+    return (sts, ccs, ncs)
+
+def confirm_states(paths, mtimel, sts, ncs, conditions, selected, ready):
+    """Re-checks the selected files by stat calls, since a snapshot may
+    be stale.  It replaces the states and the conditions of the
+    selected files with the live ones in place, and returns the
+    selected files that still satisfy the conditions (or whose
+    replicas were found ready, see check_readiness)."""
+    live = [paths[i] for i in selected]
+    (lsts, lccs) = gfarm.stat_many(live)
+    now = int(time.time() * 1e9)
+    lconditions = evaluate_conditions([mtimel[i] for i in selected],
+                                      lsts, lccs,
+                                      [ncs[i] for i in selected], now)
+    for k in range(len(selected)):
+        i = selected[k]
+        if (lccs[k] == gfarm.GFARM_ERR_NO_ERROR):
+            (d, s) = (sts.a[i], lsts.a[k])
+            d.st_size = s.st_size
+            d.st_ncopy = s.st_ncopy
+            d.st_mtimespec = s.st_mtimespec
+            d.st_ctimespec = s.st_ctimespec
+        else:
+            sts.ccs[i] = lccs[k]
+        for j in range(len(conditions)):
+            conditions[j][i] = lconditions[j][k]
+        if (i in ready):
+            (v, _, _, r, _, m) = lconditions
+            ready[i] = bool(ready[i] and v[k] and r[k] and m[k])
+    confirmed = select_files(conditions, ready)
+    summary_counters.snapshot_confirmed += len(confirmed)
+    summary_counters.snapshot_rejected += (len(selected) - len(confirmed))
+    return confirmed
+
+def unlink_files(batch):
+    """Unlinks the selected files in a batch returned by check_files,
+    and then writes messages and events on the batch.  It returns a
+    list of the indices of the unlinked files.  Note os.scandir allows
+    to remove found files safely."""
+    (files, paths, sts, ncs, conditions, selected, ready) = batch
+    actions = {}
+    for i in selected:
+        di = files[i]
+        try:
+            os.unlink(di.path)
+            if (be_verbose):
+                verbose_message("[OK] Unlink: " + str(di.path)
+                                + " size=" + str(sts[i].st_size))
+            summary_counters.removed += 1
+            summary_counters.removed_bytes += sts[i].st_size
+            actions[i] = "unlink"
+        except Exception as x:
+            warning_message("Unlink failed: " + str(di.path))
+            summary_counters.unremovable += 1
+            actions[i] = "unlink_failed"
+
+    if (be_verbose or events_file != None):
+        (valid, mtimer, ctimer, replicas_created, sufficiently_old,
+         mtime_unmodified) = conditions
+        for i in range(len(files)):
+            if (not valid[i]):
+                continue
+            flags = ((int(mtimer[i]) * 1e-9), (int(ctimer[i]) * 1e-9),
+                     bool(replicas_created[i]), bool(sufficiently_old[i]),
+                     bool(mtime_unmodified[i]))
+            r = ready.get(i)
+            if (be_verbose):
+                verbose_message(condition_message(paths[i], sts[i], ncs[i],
+                                                  flags)
+                                + ("" if r == None
+                                   else (", replicas_ready=" + str(r))))
+            if (events_file != None):
+                action = actions.get(i)
+                if (action == None):
+                    action = ("dryrun" if (dryrun and (all(flags[2:]) or r))
+                              else "skip")
+                write_event(files[i].path, action, sts[i], ncs[i], flags, r)
+    return [i for i in selected if actions[i] == "unlink"]
+
+def retire_files(src, dst, files):
+    """Removes files in the source if they have replicas.  It takes a pair
+    of source and destination directories, and a list of os.DirEntry
+    in the source.  See check_files and unlink_files."""
+    (some_missing, batch) = check_files(src, dst, files, local_mtimes(files))
+    if (batch != None):
+        unlink_files(batch)
+    return some_missing
+
+def retire_batches(batches):
+    """Removes files given by an iterator of batches (src, dst, files,
+    done), in the pipeline when use_pipeline.  done is None or a
+    function called after the files are processed.  A batch with src
+    None is a marker to only call done.  It stops when the time budget
+    runs out.  It removes files largest first when free_target."""
+    if (free_target != None):
+        return retire_largest_first(batches)
+    if (use_pipeline):
+        return run_pipeline(batches)
+    some_missing = False
+    for (src, dst, files, done) in batches:
+        if (run_deadline != None and time.time() > run_deadline):
+            break
+        if (src != None):
+            cc = retire_files(src, dst, files)
+            some_missing = (some_missing or cc)
+        if (done != None):
+            done()
+    return some_missing
+
+## Free-space target.
+
+## In the free-space target mode, the files in a tree are first
+## gathered with their local sizes in a heap, and then they are
+## checked and removed largest first, by chunks of free_target_chunk
+## files.  The free space of the source filesystem is checked by
+## os.statvfs after each chunk, and it stops when the target is
+## reached.  The positions of traversals are not recorded in this mode
+## (done functions of batches are not called).
+
+free_target_chunk = 64
+
+"""A number of files checked and removed at once in the free-space
+target mode."""
+
+def parse_free_target(v):
+    """Parses "N%" to ("percent", N), or "N" with an optional suffix K,
+    M, G, or T (powers of 1024) to ("bytes", N)."""
+    units = {"K": (1 << 10), "M": (1 << 20), "G": (1 << 30),
+             "T": (1 << 40)}
+    try:
+        if (v.endswith("%")):
+            p = float(v[:-1])
+            if (not (0.0 <= p <= 100.0)):
+                raise ValueError()
+            return ("percent", p)
+        elif (v[-1:].upper() in units):
+            return ("bytes", int(float(v[:-1]) * units[v[-1:].upper()]))
+        else:
+            return ("bytes", int(v))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Bad free target (not PERCENT% or BYTES): " + v)
+
+def format_free_target(target):
+    (kind, v) = target
+    return ((format_float(v, 1) + "%") if kind == "percent"
+            else (str(v) + "B"))
+
+def free_target_reached(path):
+    """Checks the free space of the filesystem of a path.  The usage in
+    percent is the one df shows, which excludes the blocks reserved
+    for root from the total."""
+    st = os.statvfs(path)
+    (kind, v) = free_target
+    if (kind == "percent"):
+        used = (st.f_blocks - st.f_bfree)
+        total = (used + st.f_bavail)
+        return (total == 0 or (used * 100.0 / total) <= v)
+    else:
+        return ((st.f_bavail * st.f_frsize) >= v)
+
+def retire_largest_first(batches):
+    """Removes files given by an iterator of batches largest first,
+    until the free-space target is reached.  Files are ranked by their
+    local sizes without following symbolic links, because removing a
+    link frees only the link.  The freed bytes are counted by the
+    local sizes.  See retire_batches."""
+    t0 = time.perf_counter()
+    some_missing = False
+    freed = 0
+    heap = []
+    top = None
+    for (src, dst, files, done) in batches:
+        if (src == None):
+            continue
+        if (top == None):
+            top = src
+            if (free_target_reached(top)):
+                break
+        for di in files:
+            try:
+                size = di.stat(follow_symlinks=False).st_size
+                st = di.stat()
+            except OSError:
+                continue
+            heapq.heappush(heap, (-size, len(heap), src, dst, di,
+                                  st.st_mtime_ns))
+    candidates = len(heap)
+    reached = (top == None or free_target_reached(top))
+    while (not reached and len(heap) != 0):
+        if (run_deadline != None and time.time() > run_deadline):
+            break
+        chunk = [heapq.heappop(heap)
+                 for _ in range(min(free_target_chunk, len(heap)))]
+        ## Group the files by directories, keeping the order.
+        groups = []
+        for (size, _, src, dst, di, mtime) in chunk:
+            if (len(groups) == 0 or groups[-1][0] != src):
+                groups.append((src, dst, [], [], []))
+            groups[-1][2].append(di)
+            groups[-1][3].append(mtime)
+            groups[-1][4].append(-size)
+        for (src, dst, files, mtimel, sizes) in groups:
+            (cc, batch) = check_files(src, dst, files, mtimel)
+            some_missing = (some_missing or cc)
+            if (batch != None):
+                freed += sum(sizes[i] for i in unlink_files(batch))
+        reached = free_target_reached(top)
+    if (top != None):
+        summary_counters.free_targets.append(
+            (top, ("reached" if reached else "not reached"),
+             freed, candidates,
+             (time.perf_counter() - t0)))
+    return some_missing
+
+def retire(src, dst):
+    """Removes files in the source if they have replicas.  It takes a pair
+    of source and destination directories.  See retire_files."""
+    (files, dirs) = scan_directory(src)
+    return retire_files(src, dst, files)
+
+def retire_pair(src0, dst0):
+    if (time_budget != None or cursor_file != None):
+        return retire_resumable((src0 + " " + dst0), src0, dst0)
+    return retire_batches(walk_batches(src0, dst0, top=True))
+
+## Pipeline.
+
+## In the pipeline, a scanner thread lists local directories and
+## takes local mtimes (stat), the main thread (which owns the session
+## of libgfarm) checks the remote states, and an unlinker thread
+## unlinks files and writes messages and events.  The stages are
+## connected by bounded queues, so that local and remote latencies
+## overlap and the memory use is bounded.  A stage stops at None in a
+## queue.  An exception in the scanner or the unlinker is passed to
+## the main thread.  The scanner stops scanning and the main thread
+## stops checking when the time budget runs out.  The done function of
+## a batch is called by the unlinker.
+
+class _stage():
+    """Statistics of a stage: a busy time (excluding waits on queues), a
+    count of batches, a count of files, and samples of the depth of
+    the input queue."""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.batches = 0
+        self.files = 0
+        self.depth_max = 0
+        self.depth_sum = 0
+        return
+
+    def sample(self, q):
+        d = q.qsize()
+        self.depth_max = max(self.depth_max, d)
+        self.depth_sum += d
+        return None
+
+def _scanner(batches, out, stage, failure):
+    try:
+        it = iter(batches)
+        while True:
+            t0 = time.perf_counter()
+            b = next(it, None)
+            if (b == None):
+                break
+            (src, dst, files, done) = b
+            mtimel = (local_mtimes(files) if src != None else None)
+            stage.busy += (time.perf_counter() - t0)
+            stage.batches += 1
+            stage.files += (len(files) if src != None else 0)
+            out.put((src, dst, files, mtimel, done))
+            if (failure):
+                break
+            if (run_deadline != None and time.time() > run_deadline):
+                break
+    except BaseException as x:
+        failure.append(x)
+    finally:
+        out.put(None)
+    return None
+
+def _unlinker(q, stage, failure):
+    while True:
+        stage.sample(q)
+        item = q.get()
+        if (item == None):
+            break
+        if (failure):
+            continue
+        (batch, done) = item
+        t0 = time.perf_counter()
+        try:
+            if (batch != None):
+                unlink_files(batch)
+            if (done != None):
+                done()
+        except BaseException as x:
+            failure.append(x)
+        stage.busy += (time.perf_counter() - t0)
+        stage.batches += 1
+        stage.files += (len(batch[5]) if batch != None else 0)
+    return None
+
+def run_pipeline(batches):
+    """Removes files given by an iterator of batches in the pipeline.
+    See retire_batches."""
+    some_missing = False
+    scanq = queue.Queue(maxsize=pipeline_depth)
+    unlinkq = queue.Queue(maxsize=pipeline_depth)
+    stages = [_stage("scan"), _stage("check"), _stage("unlink")]
+    failure = []
+    scanner = threading.Thread(target=_scanner,
+                               args=(batches, scanq, stages[0], failure),
+                               daemon=True)
+    unlinker = threading.Thread(target=_unlinker,
+                                args=(unlinkq, stages[2], failure),
+                                daemon=True)
+    scanner.start()
+    unlinker.start()
+    checking = stages[1]
+    try:
+        while True:
+            checking.sample(scanq)
+            item = scanq.get()
+            if (item == None):
+                break
+            if (failure):
+                continue
+            if (run_deadline != None and time.time() > run_deadline):
+                continue
+            (src, dst, files, mtimel, done) = item
+            if (src == None):
+                unlinkq.put((None, done))
+                continue
+            t0 = time.perf_counter()
+            (cc, batch) = check_files(src, dst, files, mtimel)
+            checking.busy += (time.perf_counter() - t0)
+            checking.batches += 1
+            checking.files += len(files)
+            some_missing = (some_missing or cc)
+            if (batch != None or done != None):
+                unlinkq.put((batch, done))
+    except BaseException as x:
+        failure.append(x)
+        ## Let the scanner stop.
+        while (scanner.is_alive()):
+            try:
+                scanq.get(timeout=0.1)
+            except queue.Empty:
                 pass
-            elif (di.is_file(follow_symlinks=False) or di.is_symlink()):
-                name = di.name
-                path = os.path.join(dst, name)
-                lst = di.stat()
-                try:
-                    (rst, cc) = gfarm.stat(path)
-                    if (cc == gfarm.GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY):
-                        warning_message(
-                            "Skipping a local file: " + str(name)
-                            + ": " + gfarm.error_string(cc))
-                        some_missing = (some_missing | True)
-                        summary_counters.missing += 1
-                    elif (cc != gfarm.GFARM_ERR_NO_ERROR):
-                        summary_counters.gfarm_error += 1
-                        raise GfarmException(cc)
-                    else:
-                        ##raise_if_error(cc)
-                        (nc, cc) = gfarm.get_ncopy(path)
-                        if (cc == gfarm.GFARM_ERR_NO_SUCH_OBJECT):
-                            warning_message(
-                                "No replica setting found: " + str(name)
-                                + ": " + gfarm.error_string(cc))
-                            summary_counters.state_unobtainable += 1
-                        elif (cc != gfarm.GFARM_ERR_NO_ERROR):
-                            summary_counters.gfarm_error += 1
-                            raise GfarmException(cc)
-                        elif (check_condition(path, lst, nc, rst)):
-                            try:
-                                os.unlink(di.path)
-                                verbose_message("[OK] Unlink: " + str(di.path)
-                                                + " size=" + str(rst.st_size))
-                                summary_counters.removed += 1
-                            except Exception as x:
-                                warning_message("Unlink failed: "
-                                                + str(di.path))
-                                summary_counters.unremovable += 1
-                        else:
-                            summary_counters.skipped += 1
-                            pass
-                except GfarmException:
-                    pass
+    finally:
+        unlinkq.put(None)
+        unlinker.join()
+        scanner.join()
+        for st in stages:
+            summary_counters.pipeline.append(st)
+    if (failure):
+        raise failure[0]
+    return some_missing
+
+## Resumable traversal.
+
+## A resumable traversal visits entries in sorted order, files first
+## and then subdirectories, by keys (0, name) for files and (1, name)
+## for subdirectories.  A position is a list of keys from the top
+## directory to a file, and the traversal order is the lexicographic
+## order of positions.  The position of the last file of a batch is
+## recorded by the done function of the batch, after the batch is
+## processed.  Positions are saved in cursor_file by keys of directory
+## pairs (and shards).
+
+class _StopWalk(Exception):
+    pass
+
+run_deadline = None
+
+"""A time (by time.time) to stop a run for time_budget."""
+
+cursors = {}
+
+"""Positions of traversals loaded from cursor_file and updated while
+running.  A value None means to start from the beginning."""
+
+_cursor_saved = 0.0
+
+def load_cursors():
+    global cursors
+    try:
+        with open(cursor_file, "r") as f:
+            d = json.load(f)
+    except FileNotFoundError:
+        d = {}
+    cursors = {k: ([tuple(x) for x in v] if v != None else None)
+               for (k, v) in d.items()}
+    return None
+
+def save_cursors():
+    """Saves the positions atomically (by renaming)."""
+    global _cursor_saved
+    _cursor_saved = time.time()
+    if (cursor_file == None):
+        return None
+    tmp = (cursor_file + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(cursors, f)
+    os.replace(tmp, cursor_file)
+    return None
+
+def note_position(key, position):
+    cursors[key] = position
+    if ((time.time() - _cursor_saved) > 10.0):
+        save_cursors()
+    return None
+
+def _noter(key, position):
+    return (lambda: note_position(key, position))
+
+def walk_sorted(key, src, dst, keys, after, until, member=None):
+    """Yields batches (src, dst, files, done) in the sorted order, for
+    the files after the position after and before the position until
+    (either can be None).  It raises _StopWalk at until or when the
+    time budget runs out.  The member is a predicate on the keys of
+    top-level entries (for shards).  The done function of a batch
+    records the position.  Pruning is the same as walk_batches, but a
+    directory with subdirectories skipped (before after) is not
+    pruned."""
+    if (active_lease != None and active_lease.lost):
+        raise LeaseLostException()
+    if (run_deadline != None and time.time() > run_deadline):
+        raise _StopWalk("budget")
+    t0 = time.perf_counter()
+    prunable = (prune_empty_dirs and len(keys) != 0 and not dryrun
+                and is_stable_directory(src))
+    entries = []
+    ##with os.scandir(src) as it:
+    it = os.scandir(src)
+    for di in it:
+        kind = entry_kind(di)
+        if (kind == None):
+            continue
+        k = ((0, di.name) if kind == "file" else (1, di.name))
+        if (member == None or member(k)):
+            entries.append((k, di))
+    entries.sort(key=(lambda e: e[0]))
+    summary_counters.scanned_directories += 1
+    summary_counters.scan_time += (time.perf_counter() - t0)
+    files = []
+    last = None
+    skipped = 0
+    for (k, di) in entries:
+        position = (keys + [k])
+        if (until != None and not (position < until)):
+            if (len(files) != 0):
+                yield (src, dst, files, _noter(key, last))
+            raise _StopWalk("until")
+        if (k[0] == 0):
+            if (after != None and not (position > after)):
+                continue
+            files.append(di)
+            last = position
+            if (len(files) >= batch_size):
+                yield (src, dst, files, _noter(key, last))
+                files = []
+                if (run_deadline != None and time.time() > run_deadline):
+                    raise _StopWalk("budget")
+        else:
+            if (len(files) != 0):
+                yield (src, dst, files, _noter(key, last))
+                files = []
+            if (after != None and not (position > after)
+                and after[:len(position)] != position):
+                skipped += 1
+                continue
+            sub = (after if (after != None
+                             and after[:len(position)] == position)
+                   else None)
+            yield from walk_sorted(key, os.path.join(src, k[1]),
+                                   remote_path(dst, k[1]),
+                                   position, sub, until)
+    if (len(files) != 0):
+        yield (src, dst, files, _noter(key, last))
+    if (prunable and skipped == 0):
+        yield (None, None, None, _pruner(src))
+    return None
+
+def retire_resumable(key, src, dst, member=None):
+    """Removes files in a tree from the saved position, wrapping around
+    at the end of the tree, until it comes back to the saved position
+    or the time budget runs out."""
+    start = cursors.get(key)
+    status = ["stopped"]
+    def complete():
+        status[0] = "completed"
+    def batches():
+        try:
+            yield from walk_sorted(key, src, dst, [], start, None, member)
+            yield (None, None, None, _noter(key, None))
+            if (start != None):
+                yield from walk_sorted(key, src, dst, [], None, start,
+                                       member)
+        except _StopWalk as x:
+            if (x.args[0] == "until"):
+                yield (None, None, None, _noter(key, start))
             else:
-                pass
+                return None
+        yield (None, None, None, complete)
+        return None
+    if (run_deadline != None and time.time() > run_deadline):
+        some_missing = False
+        status[0] = "not started"
+    else:
+        some_missing = retire_batches(batches())
+    summary_counters.traversals.append((key, status[0], cursors.get(key)))
     return some_missing
 
-def retire_pair(src0, dst0):
+## Sharding.
+
+## A lease of a shard is a file created exclusively (O_EXCL) in the
+## lease directory.  Its mtime is updated by a heartbeat thread.  A
+## lease is expired when its mtime is older than lease_timeout, and it
+## is taken over by renaming it aside and creating a new one.  Only
+## one of racing nodes succeeds in renaming.  The heartbeat thread
+## notices a lost lease by the owner recorded in the file, and then
+## the work on the shard stops at the next directory.
+
+active_lease = None
+
+"""A lease held while working on a shard."""
+
+class Lease():
+    """A lease of a shard.  It holds an owner string, and a heartbeat
+    thread while it is acquired."""
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = (socket.gethostname() + ":" + str(os.getpid())
+                      + ":" + os.urandom(4).hex())
+        self.lost = False
+        self.took_over = None
+        self.stopping = threading.Event()
+        self.thread = None
+        return
+
+    def holder(self):
+        """Returns the owner string in the lease file, or None."""
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f).get("owner")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def expired(self, st):
+        return ((st.st_mtime + lease_timeout) < time.time())
+
+    def create(self):
+        fd = os.open(self.path, (os.O_WRONLY | os.O_CREAT | os.O_EXCL),
+                     0o644)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"owner": self.owner, "timeout": lease_timeout}, f)
+        return None
+
+    def acquire(self, adopting=False):
+        """Takes a lease.  It takes over an expired lease.  When
+        adopting, it only takes over an expired lease, and does not
+        take a lease nobody has taken.  It returns true on success."""
+        if (not adopting):
+            try:
+                self.create()
+                self.start()
+                return True
+            except FileExistsError:
+                pass
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if (not self.expired(st)):
+            return False
+        previous = self.holder()
+        stale = (self.path + ".stale-" + self.owner)
+        try:
+            os.rename(self.path, stale)
+        except FileNotFoundError:
+            return False
+        ## Put it back if it is renewed or replaced meanwhile.
+        if (not self.expired(os.stat(stale))):
+            try:
+                os.link(stale, self.path)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        os.unlink(stale)
+        try:
+            self.create()
+        except FileExistsError:
+            return False
+        self.took_over = previous
+        self.start()
+        return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.thread.start()
+        return None
+
+    def heartbeat(self):
+        while (not self.stopping.wait(lease_timeout / 3.0)):
+            try:
+                if (self.holder() != self.owner):
+                    self.lost = True
+                    return None
+                os.utime(self.path)
+            except OSError:
+                self.lost = True
+                return None
+        return None
+
+    def release(self):
+        if (self.thread != None):
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        if (not self.lost and self.holder() == self.owner):
+            os.unlink(self.path)
+        return None
+
+def parse_shard(v):
+    """Parses "i/n" to a pair of integers."""
+    (i, sep, n) = v.partition("/")
+    try:
+        (i, n) = (int(i), int(n))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Bad shard (not i/n): " + v)
+    if (sep == "" or not (0 <= i < n)):
+        raise argparse.ArgumentTypeError("Bad shard (not i/n): " + v)
+    return (i, n)
+
+def shard_of(name, n):
+    """Returns a shard of a top-level subdirectory.  The hash is stable
+    across nodes and Python runs (unlike hash())."""
+    return (zlib.crc32(os.fsencode(name)) % n)
+
+def shard_members(src, k, n):
+    """Returns a pair of lists of os.DirEntry of the top-level files and
+    names of the top-level subdirectories in the shard k."""
+    (files, names) = scan_directory(src)
+    return ((files if k == 0 else []),
+            [d for d in names if (shard_of(d, n) == k)])
+
+def lease_path(src, k, n):
+    d = (lease_dir if lease_dir != None
+         else os.path.dirname(os.path.abspath(src)))
+    base = os.path.basename(os.path.abspath(src))
+    return os.path.join(d, (".retirefile-" + base + "-shard-"
+                            + str(k) + "of" + str(n) + ".lease"))
+
+def retire_shard(src, dst, k, n):
     some_missing = False
-    cc = retire(src0, dst0)
+    if (time_budget != None or cursor_file != None):
+        def member(key):
+            (kind, name) = key
+            return ((k == 0) if kind == 0 else (shard_of(name, n) == k))
+        return retire_resumable((src + " " + dst + " " + str(k) + "/"
+                                 + str(n)), src, dst, member)
+    (files, names) = shard_members(src, k, n)
+    if (be_verbose):
+        verbose_message("[OK] " + "Retiring shard: " + str(k) + "/" + str(n)
+                        + " " + src + " (" + str(len(names))
+                        + " subdirectories)")
+    def batches():
+        yield (src, dst, files, None)
+        for d in names:
+            yield from walk_batches(os.path.join(src, d), remote_path(dst, d))
+    cc = retire_batches(batches())
     some_missing = (some_missing or cc)
-    ##with os.scandir(src0) as entries:
-    entries = os.scandir(src0)
-    names = [di.name for di in entries
-                 if (di.is_dir(follow_symlinks=False))]
-    for n in names:
-        src1 = os.path.join(src0, n)
-        dst1 = os.path.join(dst0, n)
-        cc = retire_pair(src1, dst1)
-        some_missing = (some_missing or cc)
+    return some_missing
+
+def retire_sharded(src, dst):
+    """Works on a shard under a lease, and then on expired shards of
+    others when adopt_shards.  It returns true when some files are
+    missing or the shard is held by others."""
+    global active_lease
+    (i, n) = shard
+    some_missing = False
+    ks = ([i] + ([k for k in range(n) if k != i] if adopt_shards else []))
+    for k in ks:
+        lease = Lease(lease_path(src, k, n))
+        if (not lease.acquire(adopting=(k != i))):
+            if (k == i):
+                warning_message("Shard " + str(k) + "/" + str(n)
+                                + " is held by: " + str(lease.holder()))
+                summary_counters.shards.append((src, k, n, "busy"))
+                some_missing = True
+            continue
+        if (lease.took_over != None):
+            warning_message("Taking over shard " + str(k) + "/" + str(n)
+                            + " from: " + str(lease.took_over))
+        active_lease = lease
+        try:
+            cc = retire_shard(src, dst, k, n)
+            some_missing = (some_missing or cc)
+            status = ("done" if k == i else "adopted")
+        except LeaseLostException:
+            warning_message("Lease of shard lost: " + lease.path)
+            status = "lost"
+            some_missing = True
+        finally:
+            active_lease = None
+            lease.release()
+        summary_counters.shards.append((src, k, n, status))
     return some_missing
 
 def retire_list(pairs):
+    """Removes files in directory pairs.  It terminates libgfarm (which
+    removes the temporary configuration of the stat cache) on errors
+    as well."""
+    gfarm.configure_stat_cache(stat_cache_limit, stat_cache_timeout)
     gfarm.initialize()
-    gfarm.enable_stat_cache()
-    some_missing = False
-    for (s, d) in pairs:
-        cc = retire_pair(s, d)
-        some_missing = (some_missing or cc)
-    gfarm.terminate()
+    try:
+        gfarm.enable_stat_cache()
+        gfarm.reset_cache_statistics()
+        if (max_rpc_rate != None or adaptive_rate):
+            gfarm.set_rate_limit(max_rpc_rate, adaptive_rate)
+        global run_deadline
+        if (time_budget != None):
+            run_deadline = (time.time() + time_budget)
+        if (cursor_file != None):
+            load_cursors()
+        if (remote_snapshot != None):
+            open_snapshot(remote_snapshot)
+        some_missing = False
+        for (s, d) in pairs:
+            if (shard == None):
+                cc = retire_pair(s, str(gfarm.abst_path(d)))
+            else:
+                cc = retire_sharded(s, str(gfarm.abst_path(d)))
+            some_missing = (some_missing or cc)
+        save_cursors()
+        summary_counters.stat_cache = gfarm.cache_statistics()
+        summary_counters.rate_governor = gfarm.rate_governor_state()
+    finally:
+        close_snapshot()
+        gfarm.terminate()
     if (some_missing):
         warning_message("Some missing files in remote")
     else:
@@ -253,6 +1657,71 @@ copying them via gfpcopy.  Typical usage is: retirefile.py --so
     p.add_argument('--ignore-links', dest='ignore_links', action='store_const',
                    const=True, default=False,
                    help='do not remove symbolic links')
+    p.add_argument('--events', dest='events', type=str, action='store',
+                   default=None, metavar='FILE',
+                   help='append decisions on files in JSON lines to FILE')
+    p.add_argument('--stat-cache-limit', dest='stat_cache_limit', type=int,
+                   action='store', default=None, metavar='ENTRIES',
+                   help='capacity of the stat cache of libgfarm')
+    p.add_argument('--stat-cache-timeout', dest='stat_cache_timeout',
+                   type=float, action='store', default=None,
+                   metavar='SECONDS',
+                   help='expiration of the stat cache of libgfarm')
+    p.add_argument('--max-rpc-rate', dest='max_rpc_rate', type=float,
+                   action='store', default=None, metavar='RATE',
+                   help='limit calls to gfmd per second')
+    p.add_argument('--adaptive-rate', dest='adaptive_rate',
+                   action='store_const', const=True, default=False,
+                   help='back off when the latency of gfmd rises')
+    p.add_argument('--shard', dest='shard', type=parse_shard,
+                   action='store', default=None, metavar='I/N',
+                   help='work on the I-th of N shards under a lease')
+    p.add_argument('--lease-dir', dest='lease_dir', type=str,
+                   action='store', default=None, metavar='DIR',
+                   help='place lease files of shards in DIR')
+    p.add_argument('--lease-timeout', dest='lease_timeout', type=float,
+                   action='store', default=lease_timeout,
+                   metavar='SECONDS',
+                   help='expire leases without heartbeats')
+    p.add_argument('--adopt', dest='adopt_shards', action='store_const',
+                   const=True, default=False,
+                   help='also work on shards whose leases expired')
+    p.add_argument('--shard-members', dest='shard_members',
+                   type=parse_shard, action='store', default=None,
+                   metavar='I/N',
+                   help='list top-level entries of a shard and exit')
+    p.add_argument('--time-to-stabilize', dest='time_to_stabilize',
+                   type=float, action='store', default=time_to_stabilize,
+                   metavar='SECONDS',
+                   help='age of files to allow removal')
+    p.add_argument('--replica-readiness', dest='replica_readiness',
+                   action='store_const', const=True, default=False,
+                   help='allow early removal when replicas are placed')
+    p.add_argument('--required-groups', dest='required_groups', type=int,
+                   action='store', default=required_groups, metavar='N',
+                   help='distinct host groups required to hold replicas')
+    p.add_argument('--host-groups', dest='host_groups', type=str,
+                   action='store', default=None, metavar='FILE',
+                   help='map hosts to groups by lines "host group"')
+    p.add_argument('--prune-empty-dirs', dest='prune_empty_dirs',
+                   action='store_const', const=True, default=False,
+                   help='remove emptied local directories')
+    p.add_argument('--time-budget', dest='time_budget', type=float,
+                   action='store', default=None, metavar='SECONDS',
+                   help='stop after SECONDS and save the position')
+    p.add_argument('--cursor', dest='cursor_file', type=str,
+                   action='store', default=None, metavar='FILE',
+                   help='resume the traversal from the position in FILE')
+    p.add_argument('--free-target', dest='free_target',
+                   type=parse_free_target, action='store', default=None,
+                   metavar='PERCENT%|BYTES',
+                   help='remove largest files first until the target')
+    p.add_argument('--remote-snapshot', dest='remote_snapshot', type=str,
+                   action='store', default=None, metavar='FILE',
+                   help='decide on remote states in a listing in FILE')
+    p.add_argument('--pipeline', dest='use_pipeline', action='store_const',
+                   const=True, default=False,
+                   help='scan, check, and unlink in parallel threads')
     args = p.parse_args()
     directories = args.directories
     so = args.so
@@ -260,6 +1729,32 @@ copying them via gfpcopy.  Typical usage is: retirefile.py --so
     print_summary = args.print_summary
     dryrun = args.dryrun
     ignore_links = args.ignore_links
+    stat_cache_limit = args.stat_cache_limit
+    stat_cache_timeout = args.stat_cache_timeout
+    max_rpc_rate = args.max_rpc_rate
+    adaptive_rate = args.adaptive_rate
+    shard = args.shard
+    lease_dir = args.lease_dir
+    lease_timeout = args.lease_timeout
+    adopt_shards = args.adopt_shards
+    use_pipeline = args.use_pipeline
+    time_budget = args.time_budget
+    cursor_file = args.cursor_file
+    remote_snapshot = args.remote_snapshot
+    free_target = args.free_target
+    prune_empty_dirs = args.prune_empty_dirs
+    time_to_stabilize = args.time_to_stabilize
+    replica_readiness = args.replica_readiness
+    required_groups = args.required_groups
+    if (args.host_groups != None):
+        host_groups = load_host_groups(args.host_groups)
+    if (args.shard_members != None):
+        (k, n) = args.shard_members
+        for src in directories:
+            (files, names) = shard_members(src, k, n)
+            for x in ([di.name for di in files] + names):
+                print(x, file=sys.stdout)
+        sys.exit(0)
     if (len(directories) == 0):
         p.print_help()
         sys.exit(1)
@@ -271,6 +1766,8 @@ copying them via gfpcopy.  Typical usage is: retirefile.py --so
         some_expection = False
         summary_counters.retire_begin = datetime.datetime.now()
         try:
+            if (args.events != None):
+                open_events(args.events)
             gfarm.load(so)
             pairs = list(zip(directories[0::2], directories[1::2]))
             summary_counters.directories = pairs
@@ -280,6 +1777,8 @@ copying them via gfpcopy.  Typical usage is: retirefile.py --so
             some_expection = True
             ##print(str(ex))
             ##sys.exit(1)
+        finally:
+            close_events()
         summary_counters.retire_end = datetime.datetime.now()
         if (print_summary):
             dump_summary()
@@ -0,0 +1,82 @@
+## stub_gfarm.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""A stub of libgfarm for the offline tests (test-*-offline.py).  It
+serves stat and the ncopy attribute from tables, so that retirefile.py
+runs without Gfarm.  install() replaces the library in gfarm.py with a
+stub, and load_retirefile() loads retirefile.py as a module."""
+
+import os
+import sys
+import ctypes
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gfarm
+
+class StubGfarm():
+    """A stub of libgfarm.  states maps a path in Gfarm to a tuple
+    (size, ncopy, mtime, ctime) with times in nanoseconds, and ncopies
+    maps a path to its ncopy setting (a string).  The paths of the
+    calls to stat and getxattr are recorded in stats and xattrs."""
+
+    def __init__(self, states, ncopies):
+        self.states = states
+        self.ncopies = ncopies
+        self.stats = []
+        self.xattrs = []
+        return
+
+    def gfs_stat_cached(self, path, stp):
+        p = path.decode(gfarm.name_coding)
+        self.stats.append(p)
+        if (p not in self.states):
+            return gfarm.GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY
+        (size, ncopy, mtime, ctime) = self.states[p]
+        st = stp._obj
+        st.st_size = size
+        st.st_ncopy = ncopy
+        st.st_mtimespec.tv_sec = (mtime // 1000000000)
+        st.st_mtimespec.tv_nsec = (mtime % 1000000000)
+        st.st_ctimespec.tv_sec = (ctime // 1000000000)
+        st.st_ctimespec.tv_nsec = (ctime % 1000000000)
+        return gfarm.GFARM_ERR_NO_ERROR
+
+    def gfs_getxattr_cached(self, path, attr, v, sizep):
+        p = path.decode(gfarm.name_coding)
+        self.xattrs.append(p)
+        if (p in self.ncopies):
+            s = self.ncopies[p].encode()
+            ctypes.memmove(v, s, len(s))
+            sizep._obj.value = len(s)
+            return gfarm.GFARM_ERR_NO_ERROR
+        return gfarm.GFARM_ERR_NO_SUCH_OBJECT
+
+    def gfs_stat_free(self, p):
+        return None
+
+    def gfarm_error_string(self, cc):
+        return (b"error " + str(cc).encode())
+
+def install(states, ncopies):
+    """Replaces libgfarm in gfarm.py with a stub, and returns it."""
+    gfarm.gfso = StubGfarm(states, ncopies)
+    gfarm.assert_active_context = (lambda: None)
+    return gfarm.gfso
+
+def load_retirefile():
+    """Loads retirefile.py as a module (its main part is not run)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "retirefile.py")
+    spec = importlib.util.spec_from_file_location("retirefile", path)
+    m = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(m)
+    return m
+
+def check(v, m):
+    """Exits with 1 with a message when v is false."""
+    if (not v):
+        print("FAILED: " + m, file=sys.stderr)
+        sys.exit(1)
+    return None
@@ -0,0 +1,122 @@
+## test-free-target-offline.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""Tests --free-target of retirefile.py without Gfarm, where the calls
+to libgfarm are served by a stub (see stub_gfarm.py) and os.statvfs
+is replaced by a fake filesystem.  It checks the usage in percent is
+taken as df shows it (the blocks reserved for root are not counted as
+free), and that a run removes the largest files first until the
+target is reached, ranking a symbolic link by the size of the link.
+It prints "OK" and exits with 0 when all checks pass."""
+
+## Usage:
+## python3 test-free-target-offline.py
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stub_gfarm
+from stub_gfarm import check, load_retirefile
+
+## Local files (name, size) and the target of the link "l" (a large
+## file outside the tree).  Times are old enough for the stabilizing
+## time.
+
+local_files = [("a", 4000), ("b", 3000), ("c", 1000)]
+
+target_size = 9000
+
+file_time = 1700000000000000000
+
+remote_states = dict([(("/dst/" + n), (size, 2, file_time, file_time))
+                      for (n, size) in local_files]
+                     + [("/dst/l", (target_size, 2, file_time, file_time))])
+
+class FakeStatvfs():
+    """A fake result of os.statvfs in 1-byte blocks.  The files in the
+    source directory are counted as used in addition to base."""
+
+    def __init__(self, src, base, blocks, reserved):
+        self.src = src
+        self.base = base
+        self.blocks = blocks
+        self.reserved = reserved
+        return
+
+    def __call__(self, path):
+        used = self.base
+        for di in os.scandir(self.src):
+            used += di.stat(follow_symlinks=False).st_size
+        free = (self.blocks - used)
+        return os.statvfs_result((1, 1, self.blocks, free,
+                                  (free - self.reserved), 0, 0, 0, 0,
+                                  255))
+
+def test_percent(rf):
+    """Checks the percent target against the usage df shows.  With 800
+    of 1000 blocks used and 50 reserved, df shows 800/950 = 84.2%."""
+    statvfs = os.statvfs
+    os.statvfs = (lambda path: os.statvfs_result(
+        (1, 1, 1000, 200, 150, 0, 0, 0, 0, 255)))
+    try:
+        rf.free_target = ("percent", 84.0)
+        check(not rf.free_target_reached("/"), "84% with reserved blocks")
+        rf.free_target = ("percent", 85.0)
+        check(rf.free_target_reached("/"), "85% with reserved blocks")
+        rf.free_target = ("bytes", 150)
+        check(rf.free_target_reached("/"), "150 bytes available")
+        rf.free_target = ("bytes", 151)
+        check(not rf.free_target_reached("/"), "151 bytes available")
+    finally:
+        os.statvfs = statvfs
+    return None
+
+def test_largest_first(rf, work):
+    """Checks a run removes "a" (the largest) and then "b", ranking the
+    link "l" by its own size, and stops at the target."""
+    src = os.path.join(work, "src")
+    os.mkdir(src)
+    for (n, size) in local_files:
+        p = os.path.join(src, n)
+        with open(p, "wb") as f:
+            f.write(b"x" * size)
+        os.utime(p, ns=(file_time, file_time))
+    target = os.path.join(work, "target")
+    with open(target, "wb") as f:
+        f.write(b"x" * target_size)
+    os.utime(target, ns=(file_time, file_time))
+    os.symlink(target, os.path.join(src, "l"))
+    ## The usage is (2000 + files) / 20000 for df: about 50% at first,
+    ## 30% after removing "a", and 15% after removing "b".
+    statvfs = os.statvfs
+    os.statvfs = FakeStatvfs(src, 2000, 21000, 1000)
+    try:
+        rf.free_target = ("percent", 20.0)
+        rf.free_target_chunk = 1
+        rf.retire_pair(src, "/dst")
+    finally:
+        os.statvfs = statvfs
+        rf.free_target = None
+    left = sorted(os.listdir(src))
+    check(left == ["c", "l"], "left " + str(left))
+    (_, status, freed, candidates, _) = rf.summary_counters.free_targets[-1]
+    check(status == "reached", "status " + status)
+    check(freed == 7000, "freed " + str(freed))
+    check(candidates == 4, "candidates " + str(candidates))
+    return None
+
+if __name__ == "__main__":
+    stub_gfarm.install(remote_states, {"/dst": "2"})
+    rf = load_retirefile()
+    work = tempfile.mkdtemp(prefix="test-free-target-")
+    try:
+        test_percent(rf)
+        test_largest_first(rf, work)
+    finally:
+        shutil.rmtree(work)
+    print("OK")
+    sys.exit(0)
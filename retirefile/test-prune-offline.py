@@ -0,0 +1,102 @@
+## test-prune-offline.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""Tests --prune-empty-dirs of retirefile.py without Gfarm, with and
+without --pipeline.  It makes a local tree "x/f1", "x/y/f2", and
+"z/f3" whose files all have replicas, where the calls to libgfarm are
+served by a stub.  A run removes the files and prunes the three
+directories "x/y", "x", and "z" (subdirectories before parents), and
+keeps the top directory.  It also checks the scanner of the pipeline
+stops at the first batch when the time budget has run out.  It prints
+"OK" and exits with 0 when all checks pass."""
+
+## Usage:
+## python3 test-prune-offline.py
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gfarm
+import stub_gfarm
+from stub_gfarm import check, load_retirefile
+
+## Local files (path, size) and their times in nanoseconds, which are
+## old enough for the stabilizing time.
+
+local_files = [("x/f1", 100), ("x/y/f2", 200), ("z/f3", 300)]
+
+file_time = 1700000000000000000
+
+## States in Gfarm (size, ncopy, mtime, ctime in nanoseconds).  All
+## files have two replicas and the same sizes and mtimes as the local
+## ones.  The ncopy setting 2 is on "/dst".
+
+remote_states = {("/dst/" + p): (size, 2, file_time, file_time)
+                 for (p, size) in local_files}
+
+def make_tree(work):
+    """Makes the local tree with old mtimes, and returns its top."""
+    src = os.path.join(work, "src")
+    for (p, size) in local_files:
+        path = os.path.join(src, p)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        os.utime(path, ns=(file_time, file_time))
+    for d in ["x/y", "x", "z", "."]:
+        os.utime(os.path.join(src, d), ns=(file_time, file_time))
+    return src
+
+def test_prune(rf, work, pipeline):
+    """Checks a run removes the files and prunes the directories."""
+    m = ("pipeline" if pipeline else "inline")
+    src = make_tree(os.path.join(work, m))
+    rf.use_pipeline = pipeline
+    rf.summary_counters.removed = 0
+    rf.summary_counters.pruned_directories = 0
+    some_missing = rf.retire_pair(src, "/dst")
+    check(not some_missing, m + ": no missing files")
+    check(rf.summary_counters.removed == 3, m + ": removed files")
+    check(rf.summary_counters.pruned_directories == 3,
+          m + ": pruned " + str(rf.summary_counters.pruned_directories))
+    check(os.listdir(src) == [], m + ": emptied top")
+    return None
+
+def test_deadline(rf, work):
+    """Checks the scanner stops when the time budget runs out."""
+    src = make_tree(os.path.join(work, "deadline"))
+    rf.use_pipeline = True
+    rf.summary_counters.removed = 0
+    rf.summary_counters.scanned_directories = 0
+    rf.run_deadline = (time.time() - 1.0)
+    try:
+        rf.retire_batches(rf.walk_batches(src, "/dst", top=True))
+    finally:
+        rf.run_deadline = None
+    check(rf.summary_counters.removed == 0, "deadline: no removal")
+    check(rf.summary_counters.scanned_directories == 1,
+          "deadline: scanned "
+          + str(rf.summary_counters.scanned_directories))
+    return None
+
+if __name__ == "__main__":
+    stub_gfarm.install(remote_states, {"/dst": "2"})
+    rf = load_retirefile()
+    rf.prune_empty_dirs = True
+    work = tempfile.mkdtemp(prefix="test-prune-")
+    try:
+        os.mkdir(os.path.join(work, "inline"))
+        os.mkdir(os.path.join(work, "pipeline"))
+        os.mkdir(os.path.join(work, "deadline"))
+        test_prune(rf, work, False)
+        test_prune(rf, work, True)
+        test_deadline(rf, work)
+    finally:
+        shutil.rmtree(work)
+    print("OK")
+    sys.exit(0)
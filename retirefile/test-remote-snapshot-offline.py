@@ -0,0 +1,125 @@
+## test-remote-snapshot-offline.py -*-Coding: us-ascii-unix;-*-
+## Copyright (C) 2026 RIKEN
+
+"""Tests the remote snapshot of retirefile.py without Gfarm.  It
+feeds the fixture "test-remote-snapshot-fixture.txt" through
+build_snapshot_index, snapshot_states, and confirm_states (via
+check_files), where the calls to libgfarm are served by a stub from a
+table of live states.  In the fixture, "a" and "c" are removable
+("c" has no ncopy setting and it is looked up), "b" lacks a replica,
+"d" is modified after the snapshot, and "e" is removed after the
+snapshot.  "f" is missing in the snapshot.  It prints "OK" and exits
+with 0 when all checks pass."""
+
+## Usage:
+## python3 test-remote-snapshot-offline.py
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gfarm
+import stub_gfarm
+from stub_gfarm import check, load_retirefile
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "test-remote-snapshot-fixture.txt")
+
+"""The fixture snapshot."""
+
+## Local files (name, size, mtime in nanoseconds) as copied.
+
+local_files = [("a", 100, 1700000000123456789),
+               ("b", 200, 1700000000000000000),
+               ("c", 300, 1700000000500000000),
+               ("d", 400, 1700000000000000000),
+               ("e", 500, 1700000000000000000),
+               ("f", 600, 1700000000000000000)]
+
+## Live states in Gfarm (size, ncopy, mtime, ctime in nanoseconds).
+## "d" is rewritten an hour later, and "e" is removed.
+
+live_states = {
+    "/dst/gomi/a": (100, 2, 1700000000123456789, 1700000000000000000),
+    "/dst/gomi/b": (200, 1, 1700000000000000000, 1700000000000000000),
+    "/dst/gomi/c": (300, 2, 1700000000500000000, 1700000000000000000),
+    "/dst/gomi/d": (400, 2, 1700003600000000000, 1700003600000000000)}
+
+def test_index(rf, work):
+    """Checks the index and the lookups by snapshot_states."""
+    snapshot = os.path.join(work, "snapshot.txt")
+    shutil.copyfile(fixture, snapshot)
+    rf.open_snapshot(snapshot)
+    check(rf.summary_counters.snapshot_entries == 5, "entries")
+    paths = ["/dst/gomi/" + n for (n, _, _) in local_files]
+    (sts, ccs, ncs) = rf.snapshot_states(paths)
+    check(list(ccs[0:5]) == [gfarm.GFARM_ERR_NO_ERROR] * 5, "found")
+    check(ccs[5] == gfarm.GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY, "missing")
+    check(ncs == [2, 2, None, 2, 2, None], "ncopy settings")
+    a = sts.a[0]
+    check((a.st_size, a.st_ncopy) == (100, 2), "size and ncopy")
+    check((a.st_mtimespec.tv_sec, a.st_mtimespec.tv_nsec)
+          == (1700000000, 123456789), "mtime without rounding")
+    check(sts.a[2].st_mtimespec.tv_nsec == 500000000, "fraction")
+    check(len(gfarm.gfso.stats) == 0, "no stat calls")
+    return snapshot
+
+def test_bad_line(rf, work):
+    """Checks a bad line is rejected and no index is left."""
+    bad = os.path.join(work, "bad.txt")
+    with open(bad, "w") as f:
+        f.write("/dst/gomi/a\t100\t2\n")
+    try:
+        rf.build_snapshot_index(bad, (bad + ".index"))
+        check(False, "bad line accepted")
+    except Exception as e:
+        check(str(e).endswith("bad.txt:1"), "bad line message")
+    check(not os.path.exists(bad + ".index"), "no index")
+    check(not os.path.exists(bad + ".index.tmp"), "no temporary index")
+    return None
+
+def test_check_files(rf, work):
+    """Checks decisions by the snapshot confirmed by live states."""
+    src = os.path.join(work, "gomi")
+    os.mkdir(src)
+    for (n, size, mtime) in local_files:
+        p = os.path.join(src, n)
+        with open(p, "wb") as f:
+            f.write(b"x" * size)
+        os.utime(p, ns=(mtime, mtime))
+    files = sorted(os.scandir(src), key=lambda di: di.name)
+    mtimel = rf.local_mtimes(files)
+    (some_missing, batch) = rf.check_files(src, "/dst/gomi", files, mtimel)
+    (_, paths, sts, ncs, conditions, selected, ready) = batch
+    names = [files[i].name for i in selected]
+    check(some_missing, "f is missing")
+    check(names == ["a", "c"], "selected " + str(names))
+    check(sorted(gfarm.gfso.stats) == ["/dst/gomi/a", "/dst/gomi/c",
+                                       "/dst/gomi/d", "/dst/gomi/e"],
+          "stat calls only to confirm " + str(gfarm.gfso.stats))
+    check(gfarm.gfso.xattrs == ["/dst/gomi/c", "/dst/gomi"],
+          "ncopy lookup only for c " + str(gfarm.gfso.xattrs))
+    check(sts.a[3].st_mtimespec.tv_sec == 1700003600, "live state of d")
+    check(sts.ccs[4] == gfarm.GFARM_ERR_NO_SUCH_FILE_OR_DIRECTORY,
+          "live state of e")
+    check(rf.summary_counters.snapshot_confirmed == 2, "confirmed")
+    check(rf.summary_counters.snapshot_rejected == 2, "rejected")
+    return None
+
+if __name__ == "__main__":
+    stub_gfarm.install(live_states, {"/dst/gomi": "2"})
+    rf = load_retirefile()
+    work = tempfile.mkdtemp(prefix="test-snapshot-")
+    try:
+        test_index(rf, work)
+        test_bad_line(rf, work)
+        test_check_files(rf, work)
+        rf.close_snapshot()
+    finally:
+        shutil.rmtree(work)
+    print("OK")
+    sys.exit(0)
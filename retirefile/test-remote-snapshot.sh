@@ -0,0 +1,27 @@
+#!/bin/ksh
+
+## Test retirefile.py with a remote snapshot.  It makes a fixture
+## snapshot "gomi-snapshot.txt" from the local files made by Step (3)
+## of test-retirefile.sh, as if the files were copied with two
+## replicas an hour ago, except "bsd.9" files which have one replica.
+## It runs retirefile.py in dryrun, and the events show decisions by
+## the snapshot ("dryrun" except "bsd.9" files).  Files are not
+## confirmed in dryrun, and no stat calls are made to gfmd.
+
+## (3) $ sh test-make-test-files.sh
+## (7) $ sh test-remote-snapshot.sh
+
+. test-common.sh
+checksetting
+rm -f gomi-snapshot.txt gomi-snapshot.txt.index gomi-events.txt
+now=$(date +%s)
+find gomi -type f -printf "%P\t%s\t%T@\n" \
+    | awk -F '\t' -v dir="${GFDIR}/gomi" -v ctime=$((now - 3600)) \
+	'{ printf("%s/%s\t%s\t%d\t%s\t%d\t2\n", dir, $1, $2,
+		  ($1 ~ /bsd\.9$/ ? 1 : 2), $3, ctime) }' \
+	> gomi-snapshot.txt
+python3 retirefile.py --verbose --summary --dryrun --so ${GFLIB} \
+	--remote-snapshot gomi-snapshot.txt --events gomi-events.txt \
+	gomi ${GFDIR}/gomi
+grep -c '"dryrun"' gomi-events.txt
+grep -c '"skip"' gomi-events.txt